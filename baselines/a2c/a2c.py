@@ -10,7 +10,7 @@ from baselines.common.policies import build_policy
 
 
 from baselines.a2c.utils import Scheduler, find_trainable_variables
-from baselines.a2c.runner import Runner
+from baselines.a2c.runner import Runner, DoubleBufferedRunner
 from baselines.ppo2.ppo2 import safemean
 from collections import deque
 
@@ -32,16 +32,17 @@ class Model(object):
     """
     def __init__(self, policy, env, nsteps,
             ent_coef=0.01, vf_coef=0.5, max_grad_norm=0.5, lr=7e-4,
-            alpha=0.99, epsilon=1e-5, total_timesteps=int(80e6), lrschedule='linear'):
+            alpha=0.99, epsilon=1e-5, total_timesteps=int(80e6), lrschedule='linear', nbatch_act=None):
 
         sess = tf_util.get_session()
         nenvs = env.num_envs
         nbatch = nenvs*nsteps
+        nbatch_act = nbatch_act or nenvs
 
 
         with tf.variable_scope('a2c_model', reuse=tf.AUTO_REUSE):
             # step_model is used for sampling
-            step_model = policy(nenvs, 1, sess)
+            step_model = policy(nbatch_act, 1, sess)
 
             # train_model is used to train our network
             train_model = policy(nbatch, nsteps, sess)
@@ -132,6 +133,7 @@ def learn(
     gamma=0.99,
     log_interval=100,
     load_path=None,
+    double_buffered=False,
     **network_kwargs):
 
     '''
@@ -176,6 +178,9 @@ def learn(
 
     log_interval:       int, specifies how frequently the logs are printed out (default: 100)
 
+    double_buffered:    bool, if True, env must be a baselines.common.vec_env.AsyncVecEnv, and its two halves are stepped in turns
+                        so that one half is stepping while the actions of the other are computed (default: False)
+
     **network_kwargs:   keyword arguments to the policy / network builder. See baselines.common/policies.py/build_policy and arguments to a particular type of network
                         For instance, 'mlp' network architecture has arguments num_hidden and num_layers.
 
@@ -191,12 +196,14 @@ def learn(
 
     # Instantiate the model object (that creates step_model and train_model)
     model = Model(policy=policy, env=env, nsteps=nsteps, ent_coef=ent_coef, vf_coef=vf_coef,
-        max_grad_norm=max_grad_norm, lr=lr, alpha=alpha, epsilon=epsilon, total_timesteps=total_timesteps, lrschedule=lrschedule)
+        max_grad_norm=max_grad_norm, lr=lr, alpha=alpha, epsilon=epsilon, total_timesteps=total_timesteps, lrschedule=lrschedule,
+        nbatch_act=nenvs // 2 if double_buffered else nenvs)
     if load_path is not None:
         model.load(load_path)
 
     # Instantiate the runner object
-    runner = Runner(env, model, nsteps=nsteps, gamma=gamma)
+    runner_cls = DoubleBufferedRunner if double_buffered else Runner
+    runner = runner_cls(env, model, nsteps=nsteps, gamma=gamma)
     epinfobuf = deque(maxlen=100)
 
     # Calculate the batch_size
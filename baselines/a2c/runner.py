@@ -1,6 +1,7 @@
 import numpy as np
-from baselines.a2c.utils import discount_with_dones
-from baselines.common.runners import AbstractEnvRunner
+from baselines.common.returns import discounted_returns
+from baselines.common.runners import AbstractEnvRunner, RolloutStorage, double_buffered_steps
+from baselines.common.vec_env.async_vec_env import AsyncVecEnv
 
 class Runner(AbstractEnvRunner):
     """
@@ -10,17 +11,19 @@ class Runner(AbstractEnvRunner):
     - Initialize the runner
 
     run():
-    - Make a mini batch of experiences
+    - Make a mini batch of experiences. The arrays returned are views of storage that the next run overwrites.
     """
     def __init__(self, env, model, nsteps=5, gamma=0.99):
         super().__init__(env=env, model=model, nsteps=nsteps)
         self.gamma = gamma
         self.batch_action_shape = [x if x is not None else -1 for x in model.train_model.action.shape.as_list()]
         self.ob_dtype = model.train_model.X.dtype.as_numpy_dtype
+        # dones has a last step for the dones after the rollout
+        self.storage = RolloutStorage(self.nenv, nsteps, steps={'dones': nsteps + 1}, dtypes={
+            'obs': self.ob_dtype, 'rewards': np.float32, 'actions': model.train_model.action.dtype.name,
+            'values': np.float32, 'dones': np.bool_})
 
     def run(self):
-        # We initialize the lists that will contain the mb of experiences
-        mb_obs, mb_rewards, mb_actions, mb_values, mb_dones = [],[],[],[],[]
         mb_states = self.states
         epinfos = []
         for n in range(self.nsteps):
@@ -28,11 +31,8 @@ class Runner(AbstractEnvRunner):
             # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
             actions, values, states, _ = self.model.step(self.obs, S=self.states, M=self.dones)
 
-            # Append the experiences
-            mb_obs.append(np.copy(self.obs))
-            mb_actions.append(actions)
-            mb_values.append(values)
-            mb_dones.append(self.dones)
+            # Store the experiences
+            self.storage.write(n, obs=self.obs, actions=actions, values=values, dones=self.dones)
 
             # Take actions in env and look the results
             obs, rewards, dones, infos = self.env.step(actions)
@@ -42,31 +42,25 @@ class Runner(AbstractEnvRunner):
             self.states = states
             self.dones = dones
             self.obs = obs
-            mb_rewards.append(rewards)
-        mb_dones.append(self.dones)
-
-        # Batch of steps to batch of rollouts
-        mb_obs = np.asarray(mb_obs, dtype=self.ob_dtype).swapaxes(1, 0).reshape(self.batch_ob_shape)
-        mb_rewards = np.asarray(mb_rewards, dtype=np.float32).swapaxes(1, 0)
-        mb_actions = np.asarray(mb_actions, dtype=self.model.train_model.action.dtype.name).swapaxes(1, 0)
-        mb_values = np.asarray(mb_values, dtype=np.float32).swapaxes(1, 0)
-        mb_dones = np.asarray(mb_dones, dtype=np.bool).swapaxes(1, 0)
+            self.storage.write(n, rewards=rewards)
+        self.storage.write(self.nsteps, dones=self.dones)
+        last_values = self.model.value(self.obs, S=self.states, M=self.dones) if self.gamma > 0.0 else None
+        return self._batch(mb_states, last_values, epinfos)
+
+    def _batch(self, mb_states, last_values, epinfos):
+        # the storage is env-major, a batch of rollouts is a view of it
+        mb_obs = self.storage['obs'].reshape(self.batch_ob_shape)
+        mb_rewards = self.storage['rewards']
+        mb_actions = self.storage['actions']
+        mb_values = self.storage['values']
+        mb_dones = self.storage['dones']
         mb_masks = mb_dones[:, :-1]
         mb_dones = mb_dones[:, 1:]
 
 
         if self.gamma > 0.0:
             # Discount/bootstrap off value fn
-            last_values = self.model.value(self.obs, S=self.states, M=self.dones).tolist()
-            for n, (rewards, dones, value) in enumerate(zip(mb_rewards, mb_dones, last_values)):
-                rewards = rewards.tolist()
-                dones = dones.tolist()
-                if dones[-1] == 0:
-                    rewards = discount_with_dones(rewards+[value], dones+[0], self.gamma)[:-1]
-                else:
-                    rewards = discount_with_dones(rewards, dones, self.gamma)
-
-                mb_rewards[n] = rewards
+            mb_rewards[...] = discounted_returns(mb_rewards.T, mb_dones.T, self.gamma, last_values).T
 
         mb_actions = mb_actions.reshape(self.batch_action_shape)
 
@@ -74,3 +68,39 @@ class Runner(AbstractEnvRunner):
         mb_values = mb_values.flatten()
         mb_masks = mb_masks.flatten()
         return mb_obs, mb_states, mb_rewards, mb_masks, mb_actions, mb_values, epinfos
+
+
+class DoubleBufferedRunner(Runner):
+    """
+    Runner for an AsyncVecEnv that steps the two halves of the envs in turns, computing
+    the actions of one half while the other half is stepping, so that the envs are not idle
+    during inference. The mini batch has the same layout as with Runner.
+
+    The model must act on batches of env.num_envs // 2 envs, the env must not be wrapped,
+    and recurrent policies are not supported.
+    """
+    def __init__(self, env, model, nsteps=5, gamma=0.99):
+        super().__init__(env, model, nsteps=nsteps, gamma=gamma)
+        assert isinstance(env, AsyncVecEnv), 'DoubleBufferedRunner needs an unwrapped AsyncVecEnv'
+        assert self.states is None, 'DoubleBufferedRunner does not support recurrent policies'
+        self.dones = np.array(self.dones)
+
+    def run(self):
+        nsteps, nenv = self.nsteps, self.nenv
+        # the dones at step t are the ones before step t, and at step nsteps the ones after the last step
+        self.storage.write(0, dones=self.dones)
+        epinfos = []
+        for t, env_ids, obs, _, (actions, values, _, _), rewards, infos in double_buffered_steps(
+                self.env, self.model, nsteps, self.obs, self.dones):
+            self.storage.write(t, env_ids, obs=obs, actions=actions, values=values, rewards=rewards)
+            self.storage.write(t + 1, env_ids, dones=self.dones[env_ids])
+            for info in infos:
+                maybeepinfo = info.get('episode')
+                if maybeepinfo: epinfos.append(maybeepinfo)
+
+        last_values = None
+        if self.gamma > 0.0:
+            half = nenv // 2
+            last_values = np.concatenate([self.model.value(self.obs[:half], S=None, M=self.dones[:half]),
+                                          self.model.value(self.obs[half:], S=None, M=self.dones[half:])])
+        return self._batch(self.states, last_values, epinfos)
@@ -2,6 +2,7 @@ import os
 import numpy as np
 import tensorflow as tf
 from collections import deque
+from baselines.common.returns import discounted_returns
 
 def sample(logits):
     noise = tf.random_uniform(tf.shape(logits))
@@ -145,12 +146,8 @@ def conv_to_fc(x):
     return x
 
 def discount_with_dones(rewards, dones, gamma):
-    discounted = []
-    r = 0
-    for reward, done in zip(rewards[::-1], dones[::-1]):
-        r = reward + gamma*r*(1.-done) # fixed off by one bug
-        discounted.append(r)
-    return discounted[::-1]
+    # kept for compatibility, see baselines.common.returns.discounted_returns
+    return discounted_returns(np.asarray(rewards, dtype=np.float64), dones, gamma).tolist()
 
 def find_trainable_variables(key):
     return tf.trainable_variables(key)
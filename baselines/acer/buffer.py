@@ -22,6 +22,7 @@ class Buffer(object):
         self.mus = None
         self.dones = None
         self.masks = None
+        self.obs = None  # stacked obs returned by get, reused across calls
 
         # Size indexes
         self.next_idx = 0
@@ -36,13 +37,13 @@ class Buffer(object):
         return self.num_in_buffer > 0
 
     # Generate stacked frames
-    def decode(self, enc_obs, dones):
+    def decode(self, enc_obs, dones, out=None):
         # enc_obs has shape [nenvs, nsteps + nstack, nh, nw, nc]
         # dones has shape [nenvs, nsteps]
-        # returns stacked obs of shape [nenv, (nsteps + 1), nh, nw, nstack*nc]
+        # returns stacked obs of shape [nenv, (nsteps + 1), nh, nw, nstack*nc], written into out if given
 
         return _stack_obs(enc_obs, dones,
-                          nsteps=self.nsteps)
+                          nsteps=self.nsteps, out=out)
 
     def put(self, enc_obs, actions, rewards, mus, dones, masks):
         # enc_obs [nenv, (nsteps + nstack), nh, nw, nc]
@@ -68,15 +69,11 @@ class Buffer(object):
         self.num_in_buffer = min(self.size, self.num_in_buffer + 1)
 
     def take(self, x, idx, envx):
-        nenv = self.nenv
-        out = np.empty([nenv] + list(x.shape[2:]), dtype=x.dtype)
-        for i in range(nenv):
-            out[i] = x[idx[i], envx[i]]
-        return out
+        return x[idx, envx]
 
     def get(self):
         # returns
-        # obs [nenv, (nsteps + 1), nh, nw, nstack*nc]
+        # obs [nenv, (nsteps + 1), nh, nw, nstack*nc], only valid until the next call
         # actions, rewards, dones [nenv, nsteps]
         # mus [nenv, nsteps, nact]
         nenv = self.nenv
@@ -89,7 +86,7 @@ class Buffer(object):
         take = lambda x: self.take(x, idx, envx)  # for i in range(nenv)], axis = 0)
         dones = take(self.dones)
         enc_obs = take(self.enc_obs)
-        obs = self.decode(enc_obs, dones)
+        self.obs = obs = self.decode(enc_obs, dones, out=self.obs)
         actions = take(self.actions)
         rewards = take(self.rewards)
         mus = take(self.mus)
@@ -121,21 +118,26 @@ def _stack_obs_ref(enc_obs, dones, nsteps):
 
     return np.reshape(obs[:, (nstack-1):].transpose((2, 1, 3, 4, 0, 5)), (nenv, (nsteps + 1)) + obs_shape)
 
-def _stack_obs(enc_obs, dones, nsteps):
+def _stack_obs(enc_obs, dones, nsteps, out=None):
     nenv = enc_obs.shape[0]
     nstack = enc_obs.shape[1] - nsteps
     nc = enc_obs.shape[-1]
 
-    obs_ = np.zeros((nenv, nsteps + 1) + enc_obs.shape[2:-1] + (enc_obs.shape[-1] * nstack, ), dtype=enc_obs.dtype)
-    mask = np.ones((nenv, nsteps+1), dtype=enc_obs.dtype)
-    mask[:, 1:] = 1.0 - dones
-    mask = mask.reshape(mask.shape + tuple(np.ones(len(enc_obs.shape)-2, dtype=np.uint8)))
+    # every channel is written below, so out does not need to be cleared
+    shape = (nenv, nsteps + 1) + enc_obs.shape[2:-1] + (enc_obs.shape[-1] * nstack, )
+    if out is None or out.shape != shape or out.dtype != enc_obs.dtype:
+        out = np.empty(shape, dtype=enc_obs.dtype)
+    obs_ = out
+    # keep[:, t] is False if frames older than the newest one at step t belong to a previous episode
+    keep = np.ones((nenv, nsteps+1), dtype=bool)
+    keep[:, 1:] = np.logical_not(dones)
 
     for i in range(nstack-1, -1, -1):
         obs_[..., i * nc : (i + 1) * nc] = enc_obs[:, i : i + nsteps + 1, :]
         if i < nstack-1:
-            obs_[..., i * nc : (i + 1) * nc] *= mask
-            mask[:, 1:, ...] *= mask[:, :-1, ...]
+            # zero the frames of previous episodes, only a few (env, step) pairs have any
+            obs_[..., i * nc : (i + 1) * nc][~keep] = 0
+            keep[:, 1:] &= keep[:, :-1]
 
     return obs_
 
@@ -0,0 +1,101 @@
+import time
+
+import gym
+import numpy as np
+
+from baselines.acer.buffer import Buffer, _stack_obs
+from baselines.common.tests import mark_slow
+
+
+class _Env(object):
+    def __init__(self, num_envs, nstack, frame_shape=(84, 84)):
+        self.num_envs = num_envs
+        self.nstack = nstack
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=frame_shape + (nstack,), dtype=np.uint8)
+        self.action_space = gym.spaces.Discrete(4)
+
+
+def _fill(buffer, env, n, seed=0):
+    rng = np.random.RandomState(seed)
+    nenv, nsteps, nstack = env.num_envs, buffer.nsteps, env.nstack
+    frame_shape = env.observation_space.shape[:-1]
+    for _ in range(n):
+        enc_obs = rng.randint(0, 255, size=(nenv, nsteps + nstack) + frame_shape + (1,), dtype=np.uint8)
+        actions = rng.randint(0, 4, size=(nenv, nsteps))
+        rewards = rng.randn(nenv, nsteps)
+        mus = rng.rand(nenv, nsteps, 4)
+        dones = rng.rand(nenv, nsteps) < 0.1
+        masks = np.zeros((nenv, nsteps + 1), dtype=bool)
+        buffer.put(enc_obs, actions, rewards, mus, dones, masks)
+
+
+def _take_loop(x, idx, envx):
+    # Buffer.take as it was before gathering with one advanced index
+    out = np.empty([len(idx)] + list(x.shape[2:]), dtype=x.dtype)
+    for i in range(len(idx)):
+        out[i] = x[idx[i], envx[i]]
+    return out
+
+
+def _stack_obs_multiply(enc_obs, dones, nsteps):
+    # _stack_obs as it was before zeroing only the frames of previous episodes
+    nenv = enc_obs.shape[0]
+    nstack = enc_obs.shape[1] - nsteps
+    nc = enc_obs.shape[-1]
+    obs = np.zeros((nenv, nsteps + 1) + enc_obs.shape[2:-1] + (nc * nstack, ), dtype=enc_obs.dtype)
+    mask = np.ones((nenv, nsteps + 1), dtype=enc_obs.dtype)
+    mask[:, 1:] = 1.0 - dones
+    mask = mask.reshape(mask.shape + (1,) * (len(enc_obs.shape) - 2))
+    for i in range(nstack - 1, -1, -1):
+        obs[..., i * nc:(i + 1) * nc] = enc_obs[:, i:i + nsteps + 1, :]
+        if i < nstack - 1:
+            obs[..., i * nc:(i + 1) * nc] *= mask
+            mask[:, 1:, ...] *= mask[:, :-1, ...]
+    return obs
+
+
+def test_take_matches_loop():
+    env = _Env(num_envs=3, nstack=4, frame_shape=(6, 6))
+    buffer = Buffer(env, nsteps=5, size=50)
+    _fill(buffer, env, 12)
+
+    idx = np.random.randint(0, buffer.num_in_buffer, env.num_envs)
+    envx = np.arange(env.num_envs)
+    for x in (buffer.enc_obs, buffer.actions, buffer.mus, buffer.dones):
+        assert np.array_equal(buffer.take(x, idx, envx), _take_loop(x, idx, envx))
+
+
+def test_stack_obs_out():
+    enc_obs = np.random.randint(0, 255, size=(2, 9, 3, 3, 1), dtype=np.uint8)
+    dones = np.random.rand(2, 5) < 0.3
+    expected = _stack_obs_multiply(enc_obs, dones, nsteps=5)
+    out = np.full_like(expected, 7)
+    assert _stack_obs(enc_obs, dones, nsteps=5, out=out) is out
+    assert np.array_equal(out, expected)
+
+
+@mark_slow
+def test_buffer_get_throughput():
+    nenv, nsteps, nstack, nget = 16, 20, 4, 50
+    env = _Env(num_envs=nenv, nstack=nstack)
+    buffer = Buffer(env, nsteps=nsteps, size=50 * nsteps)
+    _fill(buffer, env, 50)
+    envx = np.arange(nenv)
+
+    def get_before():
+        idx = np.random.randint(0, buffer.num_in_buffer, nenv)
+        dones = _take_loop(buffer.dones, idx, envx)
+        obs = _stack_obs_multiply(_take_loop(buffer.enc_obs, idx, envx), dones, nsteps)
+        return [obs, dones] + [_take_loop(x, idx, envx) for x in (buffer.actions, buffer.rewards, buffer.mus, buffer.masks)]
+
+    for name, get in [('before', get_before), ('vectorized', buffer.get)]:
+        tstart = time.time()
+        for _ in range(nget):
+            get()
+        print('{}: {:.1f} ms per get ({} envs, {} steps)'.format(name, (time.time() - tstart) / nget * 1000, nenv, nsteps))
+
+
+if __name__ == '__main__':
+    test_take_matches_loop()
+    test_stack_obs_out()
+    test_buffer_get_throughput()
@@ -15,6 +15,8 @@ from baselines.bench import Monitor
 from baselines.common import set_global_seeds
 from baselines.common.atari_wrappers import make_atari, wrap_deepmind
 from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
+from baselines.common.vec_env.shmem_vec_env import ShmemVecEnv
+from baselines.common.vec_env.threaded_vec_env import ThreadedVecEnv
 from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
 from baselines.common import retro_wrappers
 from baselines.common.wrappers import ClipActionsWrapper
@@ -27,9 +29,16 @@ def make_vec_env(env_id, env_type, num_env, seed,
                  flatten_dict_observations=True,
                  gamestate=None,
                  initializer=None,
-                 force_dummy=False):
+                 force_dummy=False,
+                 in_series=1,
+                 vec_env_type='subproc'):
     """
     Create a wrapped, monitored SubprocVecEnv for Atari and MuJoCo.
+
+    in_series: number of envs run in series in each subprocess, or 'auto' to run as many as
+    needed to have at most one subprocess per cpu.
+    vec_env_type: 'subproc' for a SubprocVecEnv, 'shmem' for a ShmemVecEnv, or 'threaded' for a
+    ThreadedVecEnv, which steps the envs on threads (in_series envs per thread).
     """
     wrapper_kwargs = wrapper_kwargs or {}
     env_kwargs = env_kwargs or {}
@@ -53,12 +62,36 @@ def make_vec_env(env_id, env_type, num_env, seed,
         )
 
     set_global_seeds(seed)
+    if in_series == 'auto':
+        in_series = _auto_in_series(num_env)
     if not force_dummy and num_env > 1:
-        return SubprocVecEnv([make_thunk(i + start_index, initializer=initializer) for i in range(num_env)])
+        env_fns = [make_thunk(i + start_index, initializer=initializer) for i in range(num_env)]
+        if vec_env_type == 'threaded':
+            return ThreadedVecEnv(env_fns, nthreads=num_env // in_series)
+        elif vec_env_type == 'shmem':
+            return ShmemVecEnv(env_fns, in_series=in_series)
+        else:
+            assert vec_env_type == 'subproc', 'unknown vec_env_type {}'.format(vec_env_type)
+            return SubprocVecEnv(env_fns, in_series=in_series)
     else:
         return DummyVecEnv([make_thunk(i + start_index, initializer=None) for i in range(num_env)])
 
 
+def _auto_in_series(num_env):
+    """
+    Smallest number of envs per subprocess that divides num_env
+    and keeps the subprocesses within the cpu count, or 1 (one subprocess per env)
+    if there is none that uses at least half of the cpus.
+    """
+    ncpu = os.cpu_count() or 1
+    for in_series in range(1, num_env + 1):
+        if num_env % in_series == 0 and num_env // in_series <= ncpu:
+            if 2 * (num_env // in_series) < min(num_env, ncpu):
+                # e.g. 13 envs on 8 cpus would all run in a single subprocess
+                return 1
+            return in_series
+
+
 def make_env(env_id, env_type, mpi_rank=0, subrank=0, seed=None, reward_scale=1.0, gamestate=None, flatten_dict_observations=True, wrapper_kwargs=None, env_kwargs=None, logger_dir=None, initializer=None):
     if initializer is not None:
         initializer(mpi_rank=mpi_rank, subrank=subrank)
@@ -166,6 +199,10 @@ def common_arg_parser():
     parser.add_argument('--gamestate', help='game state to load (so far only used in retro games)', default=None)
     parser.add_argument('--num_env', help='Number of environment copies being run in parallel. When not specified, set to number of cpus for Atari, and to 1 for Mujoco', default=None, type=int)
     parser.add_argument('--reward_scale', help='Reward scale factor. Default: 1.0', default=1.0, type=float)
+    parser.add_argument('--in_series', help='Number of envs run in series in each subprocess, or auto for at most one subprocess per cpu. Default: 1',
+                        default=1, type=lambda s: s if s == 'auto' else int(s))
+    parser.add_argument('--vec_env_type', help='subproc, shmem or threaded. Default: subproc', default='subproc',
+                        choices=['subproc', 'shmem', 'threaded'])
     parser.add_argument('--save_path', help='Path to save trained model to', default=None, type=str)
     parser.add_argument('--save_video_interval', help='Save video every x steps (0 = disabled)', default=0, type=int)
     parser.add_argument('--save_video_length', help='Length of recorded video. Default: 200', default=200, type=int)
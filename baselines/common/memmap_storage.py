@@ -0,0 +1,198 @@
+import copy
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+# rows copied at a time by MemmapStorage.save, so that saving doesn't load a whole column
+_SAVE_CHUNK_ROWS = 4096
+
+
+class MemmapArray(object):
+    def __init__(self, data, cache_size=0, saved=False):
+        """Disk-backed array used as a replay buffer column.
+
+        Rows are indexed like a numpy array. Gathering rows with an integer
+        array reads them from disk in increasing order, so that nearby rows share
+        page reads, and rows written most recently can be served from an
+        in-memory cache of `cache_size` rows instead of the disk.
+
+        Parameters
+        ----------
+        data: np.memmap
+            array that rows are read from and written to
+        cache_size: int
+            number of most recently written rows to keep in memory as well
+        saved: bool
+            whether data matches the saved copy of the column, so that only the rows
+            written from now on have to be copied by the next MemmapStorage.save
+        """
+        self.data = data
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.cache_size = cache_size
+        if cache_size > 0:
+            self._cache = np.empty((cache_size,) + data.shape[1:], dtype=data.dtype)
+            self._cached_rows = np.full(cache_size, -1, dtype=np.int64)
+        # rows written since the last save, None if the whole column has to be saved
+        self._written = np.zeros(len(data), dtype=bool) if saved else None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __setitem__(self, idx, value):
+        self.data[idx] = value
+        if self._written is not None:
+            self._written[idx] = True
+        if self.cache_size > 0:
+            if isinstance(idx, slice):
+                rows = np.arange(*idx.indices(len(self.data)))
+            else:
+                rows = np.asarray(idx)
+            slots = rows % self.cache_size
+            self._cache[slots] = value
+            self._cached_rows[slots] = rows
+
+    def __getitem__(self, idx):
+        if isinstance(idx, np.ndarray) and idx.ndim == 1 and idx.dtype.kind in 'iu':
+            return self.take(idx)
+        return self.data[idx]
+
+    def take(self, idxes, cols=None):
+        """Gathers the rows idxes, or the elements [idxes, cols] of the first two axes if cols is given."""
+        idxes = np.asarray(idxes)
+        shape = self.shape[1:] if cols is None else self.shape[2:]
+        out = np.empty((len(idxes),) + shape, dtype=self.dtype)
+        if self.cache_size > 0:
+            slots = idxes % self.cache_size
+            hit = self._cached_rows[slots] == idxes
+            if cols is None:
+                out[hit] = self._cache[slots[hit]]
+            else:
+                out[hit] = self._cache[slots[hit], cols[hit]]
+            missed = np.flatnonzero(~hit)
+        else:
+            missed = np.arange(len(idxes))
+        if cols is None:
+            missed = missed[np.argsort(idxes[missed], kind='stable')]
+            out[missed] = self.data[idxes[missed]]
+        else:
+            missed = missed[np.argsort(idxes[missed] * self.shape[1] + cols[missed], kind='stable')]
+            out[missed] = self.data[idxes[missed], cols[missed]]
+        return out
+
+    def head(self, n):
+        """Returns the first n rows as a MemmapArray sharing the file and the cache."""
+        view = copy.copy(self)
+        view.data = self.data[:n]
+        view.shape = view.data.shape
+        return view
+
+    def touch(self):
+        """Marks all rows as written, for columns that are modified through `data`."""
+        self._written = None
+
+    def flush(self):
+        self.data.flush()
+
+
+class MemmapStorage(object):
+    def __init__(self, path, cache_size=0, resume=True):
+        """Directory of np.memmap files holding replay buffer columns.
+
+        Each column is an .npy file, so it can be opened with np.load(mmap_mode='r')
+        for inspection. `save` copies the rows written since the previous save to
+        the files of the saved/ subdirectory and records a small state file, so the
+        directory is also a checkpoint of the buffer as it was at the last save: a
+        buffer created on a directory that holds a saved state starts from the saved
+        copies of the columns instead of empty.
+
+        Parameters
+        ----------
+        path: str
+            directory to keep the files in, created if missing
+        cache_size: int
+            number of most recently written rows of each column to also keep
+            in memory (see MemmapArray)
+        resume: bool
+            if False, a state saved in the directory is discarded and the buffer starts empty
+        """
+        self.path = path
+        self.cache_size = cache_size
+        os.makedirs(os.path.join(path, 'saved'), exist_ok=True)
+        self.arrays = {}
+        self._state_path = os.path.join(path, 'state.json')
+        if not resume and os.path.exists(self._state_path):
+            os.remove(self._state_path)
+
+    def load(self):
+        """Returns the state passed to the last `save` call, or None if nothing was saved."""
+        if not os.path.exists(self._state_path):
+            return None
+        with open(self._state_path) as f:
+            return json.load(f)
+
+    def _filenames(self, name):
+        return os.path.join(self.path, name + '.npy'), os.path.join(self.path, 'saved', name + '.npy')
+
+    def _open_saved(self, name, shape=None, dtype=None):
+        # copies the saved column over the one being written, if there is a saved one
+        # of the given shape and dtype, and opens it
+        filename, saved_filename = self._filenames(name)
+        if self.load() is None or not os.path.exists(saved_filename):
+            return None
+        saved = np.lib.format.open_memmap(saved_filename, mode='r')
+        if shape is not None and (saved.shape != shape or saved.dtype != dtype):
+            return None
+        shutil.copyfile(saved_filename, filename)
+        data = np.lib.format.open_memmap(filename, mode='r+')
+        self.arrays[name] = MemmapArray(data, cache_size=self.cache_size, saved=True)
+        return self.arrays[name]
+
+    def array(self, name, shape, dtype):
+        """Returns a column of the given shape and dtype.
+
+        If a state was saved, the column starts from its saved copy, provided its shape
+        and dtype match; otherwise a new zero-filled file is created.
+        """
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        array = self._open_saved(name, shape, dtype)
+        if array is None:
+            data = np.lib.format.open_memmap(self._filenames(name)[0], mode='w+', shape=shape, dtype=dtype)
+            array = self.arrays[name] = MemmapArray(data, cache_size=self.cache_size)
+        return array
+
+    def open(self, name):
+        """Returns the saved column called `name`, or None if there is no such column."""
+        return self._open_saved(name)
+
+    def save(self, **state):
+        """Saves all columns and records `state` (json-serializable values).
+
+        Only the rows written since the previous save are copied, except for columns
+        created or touched since then, which are copied whole.
+        """
+        # the saved columns are inconsistent until they are all updated
+        if os.path.exists(self._state_path):
+            os.remove(self._state_path)
+        for name, array in self.arrays.items():
+            array.flush()
+            filename, saved_filename = self._filenames(name)
+            if array._written is None:
+                shutil.copyfile(filename, saved_filename)
+            else:
+                saved = np.lib.format.open_memmap(saved_filename, mode='r+')
+                rows = np.flatnonzero(array._written)
+                for start in range(0, len(rows), _SAVE_CHUNK_ROWS):
+                    chunk = rows[start:start + _SAVE_CHUNK_ROWS]
+                    saved[chunk] = array.data[chunk]
+                saved.flush()
+                del saved
+            array._written = np.zeros(len(array), dtype=bool)
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            # numpy scalars are stored as the matching python numbers
+            json.dump(state, f, default=lambda x: x.item())
+        os.replace(tmp_path, self._state_path)
@@ -0,0 +1,115 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class PrefetchingSampler(object):
+    def __init__(self, sample_fn, nprefetch=2, max_staleness=None):
+        """Samples replay batches ahead of time in a background thread.
+
+        While the learner is busy in sess.run, the next `nprefetch` batches are drawn
+        from the replay buffer and copied into preallocated arrays, so that `get`
+        usually returns without waiting. The replay buffers of this repository lock
+        themselves while adding and sampling, so they can keep being filled by the
+        learner thread.
+
+        With prioritized replay, prefetched batches were sampled with the priorities
+        as they were before the most recent updates. Call `priorities_updated` after
+        every priority update; batches that missed more than `max_staleness` updates
+        are dropped and sampled again.
+
+        Parameters
+        ----------
+        sample_fn: () -> batch
+            draws one batch from the replay buffer. A batch is a tuple, list or dict
+            of arrays, with the same shapes every time.
+        nprefetch: int
+            number of batches sampled ahead of the one being used.
+        max_staleness: int or None
+            max number of priority updates a batch may miss. None never drops batches.
+        """
+        self.sample_fn = sample_fn
+        self.nprefetch = nprefetch
+        self.max_staleness = max_staleness
+
+        # batches are written into nprefetch + 1 slots: the one being used
+        # by the learner, plus the ones being filled or waiting in line
+        self._slots = [None] * (nprefetch + 1)
+        self._free = queue.Queue()
+        for slot in range(nprefetch + 1):
+            self._free.put(slot)
+        self._ready = queue.Queue()
+        self._in_use = None
+        self._version = 0
+        self._wait_time = 0.
+        self._closed = False
+        self._thread = None
+
+    def _run(self):
+        while True:
+            slot = self._free.get()
+            if self._closed:
+                return
+            version = self._version
+            try:
+                self._slots[slot] = _copy_into(self._slots[slot], self.sample_fn())
+            except Exception as e:
+                self._ready.put((slot, version, e))
+                return
+            self._ready.put((slot, version, None))
+
+    def get(self):
+        """Returns the next batch.
+
+        The arrays are reused for later batches, so they are only valid until the next call.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        if self._in_use is not None:
+            self._free.put(self._in_use)
+            self._in_use = None
+
+        tstart = time.time()
+        while True:
+            slot, version, error = self._ready.get()
+            if error is not None:
+                raise error
+            if self.max_staleness is None or self._version - version <= self.max_staleness:
+                break
+            self._free.put(slot)
+        self._wait_time += time.time() - tstart
+
+        self._in_use = slot
+        return self._slots[slot]
+
+    def priorities_updated(self):
+        """Marks the batches sampled so far as stale by one more priority update."""
+        self._version += 1
+
+    def pop_wait_time(self):
+        """Returns the time spent waiting for batches in `get` since the last call, in seconds."""
+        wait_time, self._wait_time = self._wait_time, 0.
+        return wait_time
+
+    def close(self):
+        self._closed = True
+        self._free.put(None)
+
+
+def _copy_into(out, batch):
+    if isinstance(batch, dict):
+        out = out or {}
+        return {key: _copy_array(out.get(key), value) for key, value in batch.items()}
+    out = out or [None] * len(batch)
+    return type(batch)(_copy_array(o, value) for o, value in zip(out, batch))
+
+
+def _copy_array(out, value):
+    value = np.asarray(value)
+    if out is None or out.shape != value.shape or out.dtype != value.dtype:
+        return value.copy()
+    np.copyto(out, value)
+    return out
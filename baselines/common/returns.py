@@ -0,0 +1,113 @@
+"""
+Discounted returns, n-step returns and generalized advantage estimates of rollouts with
+episode boundaries, computed for whole [nsteps, nenv] arrays (or [nsteps] arrays of a single env)
+instead of one env and one step at a time.
+"""
+
+import numpy as np
+import scipy.signal
+
+# number of sequences up to which discount_with_cuts filters them whole rather than stepping through them
+_MAX_FILTER_WIDTH = 32
+
+
+def discounted_returns(rewards, dones, gamma, last_values=None):
+    """
+    Discounted returns of rewards, restarting after the steps where an episode ended.
+
+    rewards: [nsteps, ...] array
+    dones: [nsteps, ...] array, dones[t] is true if the episode ended at step t
+    last_values: values of the observations after the last step to bootstrap from, if any
+
+    returns R of the shape of rewards, with R[t] = rewards[t] + gamma * (1 - dones[t]) * R[t+1]
+    and R[nsteps] = last_values (or 0)
+    """
+    dones = np.asarray(dones, dtype=bool)
+    x = np.array(rewards, dtype=np.float64)
+    if last_values is not None:
+        x[-1] += gamma * np.where(dones[-1], 0, last_values)
+    return discount_with_cuts(x, gamma, dones).astype(_float_type(rewards))
+
+
+def gae(rewards, values, dones, last_values, last_dones, gamma, lam):
+    """
+    Generalized advantage estimates, GAE(gamma, lambda), of a rollout.
+
+    rewards, values: [nsteps, ...] arrays of the rewards and value estimates of every step
+    dones: [nsteps, ...] array, dones[t] is true if the observation of step t starts a new episode
+    last_values, last_dones: value estimates and dones of the observations after the last step,
+                             last_dones may be a scalar shared by all envs
+
+    returns the advantages, of the shape of rewards; add values to get the TD(lambda) returns
+    """
+    values = np.asarray(values)
+    dones = np.asarray(dones, dtype=bool)
+    nextvalues = np.concatenate([values[1:], np.reshape(last_values, (1,) + values.shape[1:])])
+    nextdones = np.concatenate([dones[1:], np.broadcast_to(last_dones, (1,) + dones.shape[1:]).astype(bool)])
+    deltas = rewards + gamma * np.where(nextdones, 0, nextvalues) - values.astype(np.float64)
+    return discount_with_cuts(deltas, gamma * lam, nextdones).astype(_float_type(rewards, values))
+
+
+def nstep_returns(rewards, values, dones, last_values, gamma, nstep):
+    """
+    n-step returns of a rollout, bootstrapped from the value estimates nstep steps later,
+    or after the last step, and truncated where an episode ended.
+
+    rewards, values: [nsteps, ...] arrays of the rewards and value estimates of every step
+    dones: [nsteps, ...] array, dones[t] is true if the episode ended at step t
+    last_values: value estimates of the observations after the last step
+
+    returns R of the shape of rewards, with R[t] = sum_k<n gamma^k rewards[t+k] + gamma^n values[t+n],
+    where n = min(nstep, nsteps - t) and the sum stops at the end of the episode
+    """
+    values = np.asarray(values)
+    dones = np.asarray(dones, dtype=bool)
+    nsteps = len(values)
+    returns = np.zeros(values.shape, dtype=np.float64)
+    # discount of step t+k from step t, 0 once the episode ended
+    discounts = np.ones(values.shape, dtype=np.float64)
+    for k in range(min(nstep, nsteps)):
+        returns[:nsteps - k] += discounts[:nsteps - k] * rewards[k:]
+        discounts[:nsteps - k] *= gamma * ~dones[k:]
+    values = np.concatenate([values, np.reshape(last_values, (1,) + values.shape[1:])])
+    returns += discounts * values[np.minimum(np.arange(nsteps) + nstep, nsteps)]
+    return returns.astype(_float_type(rewards, values))
+
+
+def discount_with_cuts(x, gamma, cuts):
+    """
+    Discounted sums along the 0th dimension of x, that do not carry over the steps where cuts is true:
+    y[t] = x[t] + gamma * (1 - cuts[t]) * y[t+1], with y[len(x)] = 0.
+
+    For a few sequences (a single env, or a few envs), the sums are computed over all steps
+    with scipy.signal.lfilter, and the part carried over every cut is subtracted:
+    y[t] = z[t] - gamma^(s-t) * z[s], where z are the sums without cuts and s is the step
+    after the first cut from t on. Many sequences are instead summed one step at a time,
+    which costs less per element once a step handles enough of them.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    cuts = np.asarray(cuts, dtype=bool)
+    if gamma == 0:
+        return x.copy()
+    nsteps = len(x)
+    if x[:1].size > _MAX_FILTER_WIDTH:
+        y = np.empty_like(x)
+        decay = gamma * ~cuts
+        last = 0
+        for t in reversed(range(nsteps)):
+            y[t] = last = x[t] + decay[t] * last
+        return y
+    # lfilter runs along the last, contiguous axis
+    z = scipy.signal.lfilter([1], [1, -gamma], np.ascontiguousarray(np.moveaxis(x[::-1], 0, -1)), axis=-1)
+    z = np.moveaxis(z, -1, 0)[::-1]
+    steps = np.arange(nsteps).reshape((nsteps,) + (1,) * (x.ndim - 1))
+    # step after the first cut from t on, or nsteps if there is none
+    after_cut = np.where(cuts, steps + 1, nsteps)
+    after_cut = np.minimum.accumulate(after_cut[::-1], axis=0)[::-1]
+    z_after_cut = np.take_along_axis(np.concatenate([z, np.zeros((1,) + x.shape[1:])]), after_cut, axis=0)
+    powers = gamma ** np.arange(nsteps + 1)
+    return z - powers[after_cut - steps] * z_after_cut
+
+
+def _float_type(*arrays):
+    return np.result_type(np.float32, *(np.asarray(a).dtype for a in arrays))
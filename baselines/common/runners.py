@@ -1,5 +1,8 @@
-import numpy as np
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 class AbstractEnvRunner(ABC):
     def __init__(self, *, env, model, nsteps):
@@ -17,3 +20,134 @@ class AbstractEnvRunner(ABC):
     def run(self):
         raise NotImplementedError
 
+
+class RolloutStorage(object):
+    """
+    Preallocated storage of the steps of a rollout, reused from one rollout to the next.
+    Arrays are env-major, of shape (nenv, nsteps) + value shape, so that flat returns the
+    batch the runners used to build with sf01, without copying it.
+
+    The array of a name is allocated on its first write, with the dtype of the values written
+    unless dtypes[name] is given, and with steps[name] steps instead of nsteps if given.
+    """
+    def __init__(self, nenv, nsteps, dtypes=None, steps=None):
+        self.nenv = nenv
+        self.nsteps = nsteps
+        self.dtypes = dtypes or {}
+        self.steps = steps or {}
+        self.arrays = {}
+
+    def write(self, t, env_ids=slice(None), **values):
+        """
+        Write values[name][i] at step t of env env_ids[i], for all envs by default.
+        t can also be an array with one step per env.
+        """
+        for name, value in values.items():
+            value = np.asarray(value)
+            arr = self.arrays.get(name)
+            if arr is None:
+                arr = self.arrays[name] = np.zeros((self.nenv, self.steps.get(name, self.nsteps)) + value.shape[1:],
+                                                   dtype=self.dtypes.get(name, value.dtype))
+            arr[env_ids, t] = value
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def flat(self, name):
+        """
+        The array of name with the env and step axes flattened, as a view.
+        """
+        arr = self.arrays[name]
+        return arr.reshape((-1,) + arr.shape[2:])
+
+
+class BackgroundRunner(object):
+    """
+    Collects the rollouts of a runner in a background thread, the next one while the
+    caller trains on the current one, so that the envs are not idle during training.
+    The policy the rollout is collected with is the one of the moment, which may be updated
+    during the rollout: it lags behind the policy trained on it by at most one update.
+
+    The runner must keep its rollout in a RolloutStorage at runner.storage; two storages
+    are used in turns, so that the batch returned by run stays valid during the next rollout.
+    """
+    def __init__(self, runner):
+        self.runner = runner
+        storage = runner.storage
+        self.storages = [storage, RolloutStorage(storage.nenv, storage.nsteps, dtypes=storage.dtypes, steps=storage.steps)]
+        self.nruns = 0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.future = None
+        # duration of the last rollout, and how long run waited for it
+        self.collect_time = 0.
+        self.wait_time = 0.
+
+    def run(self, start_next=True):
+        """
+        Return the batch of the rollout in progress, starting it first if there is none,
+        and start the next rollout unless start_next is False.
+        """
+        if self.future is None:
+            self._start()
+        tstart = time.perf_counter()
+        batch, self.collect_time = self.future.result()
+        self.wait_time = time.perf_counter() - tstart
+        self.future = None
+        if start_next:
+            self._start()
+        return batch
+
+    @property
+    def overlap(self):
+        """
+        Fraction of the last rollout that was collected while the caller was busy.
+        """
+        return max(0., 1. - self.wait_time / self.collect_time) if self.collect_time > 0 else 0.
+
+    def close(self):
+        if self.future is not None:
+            self.future.result()
+            self.future = None
+        self.executor.shutdown()
+
+    def _start(self):
+        self.runner.storage = self.storages[self.nruns % 2]
+        self.nruns += 1
+        self.future = self.executor.submit(self._run)
+
+    def _run(self):
+        tstart = time.perf_counter()
+        batch = self.runner.run()
+        return batch, time.perf_counter() - tstart
+
+
+def double_buffered_steps(env, model, nsteps, obs, dones):
+    """
+    Step the two halves of an AsyncVecEnv for nsteps steps, computing the actions of
+    one half with model.step while the other half is stepping.
+
+    obs and dones are the current observations and dones of all envs, and are updated in place.
+    Yields (t, env_ids, obs, dones, model_outputs, rewards, infos) every time a half has finished
+    step t, where obs and dones are the ones the actions were computed from, and model_outputs is
+    what model.step returned for them. The model acts on batches of env.num_envs // 2 envs.
+    """
+    nenv = env.num_envs
+    assert nenv % 2 == 0, 'double buffering needs an even number of envs'
+    halves = [np.arange(nenv // 2), np.arange(nenv // 2, nenv)]
+    steps = [None, None]
+
+    def send(half):
+        env_ids = halves[half]
+        outputs = model.step(obs[env_ids], S=None, M=dones[env_ids])
+        steps[half] = (obs[env_ids].copy(), dones[env_ids].copy(), outputs)
+        env.step_send(outputs[0], env_ids)
+
+    send(0)
+    send(1)
+    for t in range(nsteps):
+        for half in (0, 1):
+            env_ids = halves[half]
+            obs[env_ids], rewards, dones[env_ids], infos, _ = env.step_recv(len(env_ids), env_ids=env_ids)
+            yield (t, env_ids) + steps[half] + (rewards, infos)
+            if t + 1 < nsteps:
+                send(half)
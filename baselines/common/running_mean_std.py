@@ -10,8 +10,7 @@ class RunningMeanStd(object):
         self.count = epsilon
 
     def update(self, x):
-        batch_mean = np.mean(x, axis=0)
-        batch_var = np.var(x, axis=0)
+        batch_mean, batch_var = batch_moments(x)
         batch_count = x.shape[0]
         self.update_from_moments(batch_mean, batch_var, batch_count)
 
@@ -19,6 +18,20 @@ class RunningMeanStd(object):
         self.mean, self.var, self.count = update_mean_var_count_from_moments(
             self.mean, self.var, self.count, batch_mean, batch_var, batch_count)
 
+def batch_moments(x):
+    """
+    np.mean(x, axis=0) and np.var(x, axis=0), without computing the mean twice.
+    """
+    batch_mean = np.mean(x, axis=0)
+    if x.ndim == 1:
+        # np.var rounds a scalar mean differently
+        return batch_mean, np.var(x, axis=0)
+    deviations = np.subtract(x, batch_mean)
+    np.multiply(deviations, deviations, out=deviations)
+    batch_var = np.sum(deviations, axis=0)
+    batch_var /= x.shape[0]
+    return batch_mean, batch_var
+
 def update_mean_var_count_from_moments(mean, var, count, batch_mean, batch_var, batch_count):
     delta = batch_mean - mean
     tot_count = count + batch_count
@@ -66,8 +79,7 @@ class TfRunningMeanStd(object):
         self.mean, self.var, self.count = self.sess.run([self._mean, self._var, self._count])
 
     def update(self, x):
-        batch_mean = np.mean(x, axis=0)
-        batch_var = np.var(x, axis=0)
+        batch_mean, batch_var = batch_moments(x)
         batch_count = x.shape[0]
 
         new_mean, new_var, new_count = update_mean_var_count_from_moments(self.mean, self.var, self.count, batch_mean, batch_var, batch_count)
@@ -0,0 +1,108 @@
+"""
+Trajectory segments of the envs of a VecEnv, for trpo_mpi, ppo1 and gail.
+"""
+
+import numpy as np
+
+from baselines.common.vec_env import VecEnv
+from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+
+# keys of the segment arrays with one element per step and env
+STEP_KEYS = ('ob', 'rew', 'vpred', 'new', 'ac', 'prevac', 'adv', 'tdlamret')
+
+
+def traj_segment_generator(act, env, horizon, reward_giver=None):
+    """
+    Generate segments of horizon steps of every env of env, computing the actions of all envs
+    with a single call to act every step.
+
+    act: function from the observations of all envs to their actions and value predictions
+    env: VecEnv, or gym.Env run as a VecEnv of one env
+    reward_giver: if given, its rewards for the observations and actions (get_reward)
+                  replace the rewards of the env, which are only used for ep_true_rets
+
+    Yields dicts with arrays of shape [horizon, nenv, ...], which the next segment overwrites:
+    ob, rew, vpred, new (1 if the observation starts an episode), ac and prevac (the previous actions,
+    samples of the action space before the first step);
+    nextvpred, the value predictions after the last step (0 where an episode starts);
+    and ep_rets, ep_lens (and ep_true_rets with a reward_giver) of the episodes finished during the segment.
+    """
+    if not isinstance(env, VecEnv):
+        single_env = env
+        env = DummyVecEnv([lambda: single_env])
+    nenv = env.num_envs
+    ob = env.reset()
+    new = np.ones(nenv, dtype=bool)
+
+    cur_ep_ret = np.zeros(nenv)
+    cur_ep_true_ret = np.zeros(nenv)
+    cur_ep_len = np.zeros(nenv, dtype=np.int64)
+    ep_rets = []
+    ep_true_rets = []
+    ep_lens = []
+
+    # Initialize history arrays, the ones of the actions once their shape is known
+    obs = np.zeros((horizon,) + ob.shape, dtype=ob.dtype)
+    rews = np.zeros((horizon, nenv), 'float32')
+    vpreds = np.zeros((horizon, nenv), 'float32')
+    news = np.zeros((horizon, nenv), 'int32')
+    acs = prevacs = prevac = None
+
+    while True:
+        for t in range(horizon):
+            ac, vpred = act(ob)
+            ac = np.asarray(ac)
+            if acs is None:
+                acs = np.zeros((horizon,) + ac.shape, dtype=ac.dtype)
+                prevacs = acs.copy()
+                # like the single env generators, the first actions follow random ones
+                prevac = np.reshape([env.action_space.sample() for _ in range(nenv)], ac.shape).astype(ac.dtype)
+            obs[t] = ob
+            vpreds[t] = vpred
+            news[t] = new
+            acs[t] = ac
+            prevacs[t] = prevac
+            prevac = ac
+
+            if reward_giver is not None:
+                rews[t] = np.reshape(reward_giver.get_reward(ob, ac), nenv)
+            ob, true_rew, new, _ = env.step(ac)
+            if reward_giver is None:
+                rews[t] = true_rew
+
+            cur_ep_ret += rews[t]
+            cur_ep_true_ret += true_rew
+            cur_ep_len += 1
+            for d in np.flatnonzero(new):
+                ep_rets.append(cur_ep_ret[d])
+                ep_true_rets.append(cur_ep_true_ret[d])
+                ep_lens.append(cur_ep_len[d])
+            cur_ep_ret[new] = 0
+            cur_ep_true_ret[new] = 0
+            cur_ep_len[new] = 0
+
+        # we need the value function after the last step to estimate returns, the actions
+        # of the next segment are computed again with the policy updated on this one
+        _, vpred = act(ob)
+        seg = {"ob": obs, "rew": rews, "vpred": vpreds, "new": news,
+               "ac": acs, "prevac": prevacs, "nextvpred": vpred * (1 - new),
+               "ep_rets": ep_rets, "ep_lens": ep_lens}
+        if reward_giver is not None:
+            seg["ep_true_rets"] = ep_true_rets
+        yield seg
+        # Be careful!!! if you change the downstream algorithm to aggregate
+        # several of these batches, then be sure to do a deepcopy
+        ep_rets = []
+        ep_true_rets = []
+        ep_lens = []
+
+
+def flatten_segment(seg):
+    """
+    Flatten the [horizon, nenv] arrays of a segment in place to batches of horizon * nenv steps,
+    where the steps of every env are consecutive, as they are with a single env.
+    """
+    for key in STEP_KEYS:
+        if key in seg:
+            arr = np.swapaxes(seg[key], 0, 1)
+            seg[key] = arr.reshape((-1,) + arr.shape[2:])
@@ -1,4 +1,4 @@
-import operator
+import numpy as np
 
 
 class SegmentTree(object):
@@ -16,6 +16,9 @@ class SegmentTree(object):
                `reduce` operation which reduces `operation` over
                a contiguous subsequence of items in the array.
 
+        Values are stored in a float64 numpy array. Items can also be
+        read and written in bulk by indexing with an array of indices.
+
         Paramters
         ---------
         capacity: int
@@ -23,30 +26,18 @@ class SegmentTree(object):
         operation: lambda obj, obj -> obj
             and operation for combining elements (eg. sum, max)
             must form a mathematical group together with the set of
-            possible values for array elements (i.e. be associative)
+            possible values for array elements (i.e. be associative).
+            It is also applied elementwise to arrays of nodes, so it has
+            to broadcast like a numpy ufunc (eg. np.add, np.minimum).
         neutral_element: obj
             neutral element for the operation above. eg. float('-inf')
             for max and 0 for sum.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
-
-    def _reduce_helper(self, start, end, node, node_start, node_end):
-        if start == node_start and end == node_end:
-            return self._value[node]
-        mid = (node_start + node_end) // 2
-        if end <= mid:
-            return self._reduce_helper(start, end, 2 * node, node_start, mid)
-        else:
-            if mid + 1 <= start:
-                return self._reduce_helper(start, end, 2 * node + 1, mid + 1, node_end)
-            else:
-                return self._operation(
-                    self._reduce_helper(start, mid, 2 * node, node_start, mid),
-                    self._reduce_helper(mid + 1, end, 2 * node + 1, mid + 1, node_end)
-                )
+        self._neutral_element = neutral_element
 
     def reduce(self, start=0, end=None):
         """Returns result of applying `self.operation`
@@ -70,10 +61,27 @@ class SegmentTree(object):
             end = self._capacity
         if end < 0:
             end += self._capacity
-        end -= 1
-        return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
+        # walk up from the leaves of the half-open range [start, end), folding in
+        # the nodes that stick out on either side; the two partial results keep
+        # the left-to-right order of the operands
+        start += self._capacity
+        end += self._capacity
+        left = right = self._neutral_element
+        while start < end:
+            if start & 1:
+                left = self._operation(left, self._value[start])
+                start += 1
+            if end & 1:
+                end -= 1
+                right = self._operation(self._value[end], right)
+            start //= 2
+            end //= 2
+        return self._operation(left, right)
 
     def __setitem__(self, idx, val):
+        if np.ndim(idx) > 0:
+            self._set_batch(idx, val)
+            return
         # index of the leaf
         idx += self._capacity
         self._value[idx] = val
@@ -85,16 +93,31 @@ class SegmentTree(object):
             )
             idx //= 2
 
+    def _set_batch(self, idxes, vals):
+        # all leaves are at the same depth, so the ancestors that need
+        # recomputing can be updated together one level at a time
+        idxes = np.asarray(idxes) + self._capacity
+        if idxes.size == 0:
+            return
+        self._value[idxes] = vals
+        idxes = np.unique(idxes // 2)
+        while idxes[0] >= 1:
+            self._value[idxes] = self._operation(
+                self._value[2 * idxes],
+                self._value[2 * idxes + 1]
+            )
+            idxes = np.unique(idxes // 2)
+
     def __getitem__(self, idx):
-        assert 0 <= idx < self._capacity
-        return self._value[self._capacity + idx]
+        assert np.all(0 <= idx) and np.all(idx < self._capacity)
+        return self._value[self._capacity + np.asarray(idx)]
 
 
 class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
-            operation=operator.add,
+            operation=np.add,
             neutral_element=0.0
         )
 
@@ -112,14 +135,18 @@ class SumSegmentTree(SegmentTree):
 
         Parameters
         ----------
-        perfixsum: float
-            upperbound on the sum of array prefix
+        perfixsum: float or np.array
+            upperbound on the sum of array prefix. An array of
+            upperbounds is searched for all at once, descending the
+            tree one level at a time for the whole batch.
 
         Returns
         -------
-        idx: int
+        idx: int or np.array
             highest index satisfying the prefixsum constraint
         """
+        if np.ndim(prefixsum) > 0:
+            return self._find_prefixsum_idx_batch(prefixsum)
         assert 0 <= prefixsum <= self.sum() + 1e-5
         idx = 1
         while idx < self._capacity:  # while non-leaf
@@ -130,12 +157,23 @@ class SumSegmentTree(SegmentTree):
                 idx = 2 * idx + 1
         return idx - self._capacity
 
+    def _find_prefixsum_idx_batch(self, prefixsum):
+        prefixsum = np.array(prefixsum, dtype=np.float64)
+        assert np.all(0 <= prefixsum) and np.all(prefixsum <= self.sum() + 1e-5)
+        idx = np.ones(prefixsum.shape, dtype=np.int64)
+        while idx.size and idx[0] < self._capacity:  # while non-leaf
+            left = self._value[2 * idx]
+            go_right = left <= prefixsum
+            prefixsum -= np.where(go_right, left, 0.0)
+            idx = 2 * idx + go_right
+        return idx - self._capacity
+
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
-            operation=min,
+            operation=np.minimum,
             neutral_element=float('inf')
         )
 
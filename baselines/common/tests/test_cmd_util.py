@@ -0,0 +1,20 @@
+import os
+
+import pytest
+
+from baselines.common.cmd_util import _auto_in_series, common_arg_parser
+
+
+@pytest.mark.parametrize('num_env,ncpu,expected', ((4, 8, 1), (16, 8, 2), (14, 8, 2), (32, 8, 4),
+                                                   (13, 8, 1), (26, 8, 1), (1, 1, 1)))
+def test_auto_in_series(monkeypatch, num_env, ncpu, expected):
+    monkeypatch.setattr(os, 'cpu_count', lambda: ncpu)
+    assert _auto_in_series(num_env) == expected
+
+
+def test_vec_env_args():
+    args = common_arg_parser().parse_args([])
+    assert (args.in_series, args.vec_env_type) == (1, 'subproc')
+    args = common_arg_parser().parse_args(['--in_series=auto', '--vec_env_type=shmem'])
+    assert (args.in_series, args.vec_env_type) == ('auto', 'shmem')
+    assert common_arg_parser().parse_args(['--in_series=3']).in_series == 3
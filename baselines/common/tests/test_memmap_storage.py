@@ -0,0 +1,62 @@
+import numpy as np
+
+from baselines.common.memmap_storage import MemmapStorage
+
+
+def test_memmap_array_gather(tmpdir):
+    for cache_size in (0, 8):
+        storage = MemmapStorage(str(tmpdir.join(str(cache_size))), cache_size=cache_size)
+        array = storage.array('x', (32, 3), np.float32)
+        expected = np.random.randn(32, 3).astype(np.float32)
+        for i in range(32):
+            array[i] = expected[i]
+        array[np.arange(4)] = expected[:4]
+
+        idxes = np.random.randint(0, 32, size=50)
+        assert np.array_equal(array[idxes], expected[idxes])
+        assert np.array_equal(array[:10], expected[:10])
+
+
+def test_memmap_storage_resume(tmpdir):
+    storage = MemmapStorage(str(tmpdir))
+    assert storage.load() is None
+    array = storage.array('x', (10,), np.int64)
+    array[np.arange(10)] = np.arange(10)
+    storage.save(length=10)
+
+    resumed = MemmapStorage(str(tmpdir))
+    assert resumed.load() == {'length': 10}
+    assert np.array_equal(resumed.array('x', (10,), np.int64)[np.arange(10)], np.arange(10))
+    # a column with a different shape starts from scratch
+    assert not resumed.array('x', (5,), np.int64)[np.arange(5)].any()
+
+
+def test_memmap_storage_resume_saved_rows(tmpdir):
+    storage = MemmapStorage(str(tmpdir), cache_size=4)
+    array = storage.array('x', (10, 2), np.float32)
+    array[np.arange(10)] = np.arange(20).reshape(10, 2)
+    storage.save(length=10)
+    array[3] = -1
+    storage.save(length=10)
+    # rows written after the last save are not part of the checkpoint
+    array[5:8] = -2
+
+    resumed = MemmapStorage(str(tmpdir))
+    expected = np.arange(20, dtype=np.float32).reshape(10, 2)
+    expected[3] = -1
+    assert np.array_equal(resumed.array('x', (10, 2), np.float32).data, expected)
+    assert np.array_equal(resumed.open('x').data, expected)
+    assert MemmapStorage(str(tmpdir), resume=False).load() is None
+
+
+def test_memmap_array_take_elements(tmpdir):
+    for cache_size in (0, 3):
+        storage = MemmapStorage(str(tmpdir.join(str(cache_size))), cache_size=cache_size)
+        array = storage.array('x', (10, 4, 2), np.float32)
+        expected = np.random.randn(10, 4, 2).astype(np.float32)
+        array[np.arange(10)] = expected
+        rows, cols = np.random.randint(0, 10, size=30), np.random.randint(0, 4, size=30)
+        assert np.array_equal(array.take(rows, cols), expected[rows, cols])
+        head = array.head(6)
+        assert head.shape == (6, 4, 2)
+        assert np.array_equal(head.take(rows % 6, cols), expected[rows % 6, cols])
@@ -0,0 +1,43 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from baselines.common.prefetching_sampler import PrefetchingSampler
+
+
+def test_prefetching_sampler_batches():
+    counter = itertools.count()
+
+    def sample_fn():
+        i = next(counter)
+        return {'obs': np.full((4, 2), i), 'idxes': np.arange(4) + i}
+
+    sampler = PrefetchingSampler(sample_fn, nprefetch=3)
+    for i in range(20):
+        batch = sampler.get()
+        assert np.array_equal(batch['obs'], np.full((4, 2), i))
+        assert np.array_equal(batch['idxes'], np.arange(4) + i)
+    assert sampler.pop_wait_time() >= 0
+    sampler.close()
+
+
+def test_prefetching_sampler_staleness():
+    counter = itertools.count()
+    sampler = PrefetchingSampler(lambda: (np.array([next(counter)]),), nprefetch=2, max_staleness=0)
+    first, = sampler.get()
+    assert first[0] == 0
+    sampler.priorities_updated()
+    # batches sampled before the update are dropped
+    second, = sampler.get()
+    assert second[0] > 0
+    sampler.close()
+
+
+def test_prefetching_sampler_error():
+    def sample_fn():
+        raise ValueError('empty buffer')
+
+    sampler = PrefetchingSampler(sample_fn)
+    with pytest.raises(ValueError):
+        sampler.get()
@@ -0,0 +1,156 @@
+import time
+
+import numpy as np
+import pytest
+
+from baselines.common.returns import discounted_returns, gae, nstep_returns
+from baselines.common.tests import mark_slow
+
+
+def _gae_loop(rewards, values, dones, last_values, last_dones, gamma, lam):
+    # the GAE loop of ppo2.Runner
+    advs = np.zeros_like(rewards)
+    lastgaelam = 0
+    nsteps = len(rewards)
+    for t in reversed(range(nsteps)):
+        if t == nsteps - 1:
+            nextnonterminal = 1.0 - last_dones
+            nextvalues = last_values
+        else:
+            nextnonterminal = 1.0 - dones[t+1]
+            nextvalues = values[t+1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advs[t] = lastgaelam = delta + gamma * lam * nextnonterminal * lastgaelam
+    return advs
+
+
+def _add_vtarg_and_adv_loop(seg, gamma, lam):
+    # add_vtarg_and_adv of trpo_mpi, ppo1 and gail
+    new = np.append(seg["new"], 0)
+    vpred = np.append(seg["vpred"], seg["nextvpred"])
+    T = len(seg["rew"])
+    seg["adv"] = gaelam = np.empty(T, 'float32')
+    rew = seg["rew"]
+    lastgaelam = 0
+    for t in reversed(range(T)):
+        nonterminal = 1-new[t+1]
+        delta = rew[t] + gamma * vpred[t+1] * nonterminal - vpred[t]
+        gaelam[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
+    seg["tdlamret"] = seg["adv"] + seg["vpred"]
+
+
+def _discount_with_dones(rewards, dones, gamma):
+    # a2c.utils.discount_with_dones
+    discounted = []
+    r = 0
+    for reward, done in zip(rewards[::-1], dones[::-1]):
+        r = reward + gamma*r*(1.-done)
+        discounted.append(r)
+    return discounted[::-1]
+
+
+def _a2c_returns_loop(rewards, dones, last_values, gamma):
+    # the discounting of a2c.Runner, over env-major lists
+    rewards = rewards.copy()
+    for n, (env_rewards, env_dones, value) in enumerate(zip(rewards, dones, last_values.tolist())):
+        env_rewards = env_rewards.tolist()
+        env_dones = env_dones.tolist()
+        if env_dones[-1] == 0:
+            env_rewards = _discount_with_dones(env_rewards+[value], env_dones+[0], gamma)[:-1]
+        else:
+            env_rewards = _discount_with_dones(env_rewards, env_dones, gamma)
+        rewards[n] = env_rewards
+    return rewards
+
+
+def _rollout(nsteps, nenv, done_prob, seed=0):
+    rng = np.random.RandomState(seed)
+    rewards = rng.randn(nsteps, nenv).astype(np.float32)
+    values = rng.randn(nsteps, nenv).astype(np.float32)
+    dones = rng.rand(nsteps, nenv) < done_prob
+    last_values = rng.randn(nenv).astype(np.float32)
+    last_dones = rng.rand(nenv) < done_prob
+    return rewards, values, dones, last_values, last_dones
+
+
+@pytest.mark.parametrize('nenv', (5, 64))
+@pytest.mark.parametrize('done_prob', (0.0, 0.05, 0.5))
+@pytest.mark.parametrize('gamma,lam', ((0.99, 0.95), (0.99, 1.0), (0.9, 0.0)))
+def test_gae_matches_loop(nenv, done_prob, gamma, lam):
+    rewards, values, dones, last_values, last_dones = _rollout(200, nenv, done_prob)
+    expected = _gae_loop(rewards, values, dones, last_values, last_dones, gamma, lam)
+    actual = gae(rewards, values, dones, last_values, last_dones, gamma, lam)
+    assert actual.dtype == expected.dtype
+    np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('nenv', (1, 4))
+@pytest.mark.parametrize('done_prob', (0.0, 0.05, 0.5))
+def test_gae_matches_add_vtarg_and_adv(nenv, done_prob):
+    """
+    Test the advantages add_vtarg_and_adv of trpo_mpi, ppo1 and gail computes with gae
+    for the [horizon, nenv] segments of traj_segment_generator against the loop over every env.
+    """
+    rewards, values, dones, last_values, _ = _rollout(300, nenv, done_prob)
+    adv = gae(rewards, values, dones, last_values, 0, 0.99, 0.97)
+    assert adv.shape == (300, nenv)
+    for e in range(nenv):
+        seg = {'rew': rewards[:, e], 'vpred': values[:, e], 'new': dones[:, e], 'nextvpred': last_values[e]}
+        _add_vtarg_and_adv_loop(seg, 0.99, 0.97)
+        np.testing.assert_allclose(adv[:, e], seg['adv'], rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('nenv', (6, 64))
+@pytest.mark.parametrize('done_prob', (0.0, 0.2, 1.0))
+def test_discounted_returns_matches_loop(nenv, done_prob):
+    rewards, _, dones, last_values, _ = _rollout(20, nenv, done_prob)
+    expected = _a2c_returns_loop(rewards.T, dones.T, last_values, 0.99).T
+    actual = discounted_returns(rewards, dones, 0.99, last_values)
+    assert actual.dtype == np.float32
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-5)
+    expected = np.array(_discount_with_dones(rewards[:, 0].tolist(), dones[:, 0].tolist(), 0.99))
+    np.testing.assert_allclose(discounted_returns(rewards[:, 0], dones[:, 0], 0.99), expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('nstep', (1, 3, 50))
+def test_nstep_returns(nstep):
+    rewards, values, dones, last_values, _ = _rollout(30, 4, 0.1)
+    gamma = 0.9
+    nsteps = len(rewards)
+    all_values = np.concatenate([values, last_values[None]])
+    expected = np.zeros_like(rewards)
+    for e in range(rewards.shape[1]):
+        for t in range(nsteps):
+            ret, discount = 0.0, 1.0
+            for k in range(t, min(t + nstep, nsteps)):
+                ret += discount * rewards[k, e]
+                discount *= gamma
+                if dones[k, e]:
+                    discount = 0.0
+                    break
+            expected[t, e] = ret + discount * all_values[min(t + nstep, nsteps), e]
+    np.testing.assert_allclose(nstep_returns(rewards, values, dones, last_values, gamma, nstep), expected, rtol=1e-5, atol=1e-5)
+    if nstep >= nsteps:
+        # without truncation, n-step returns are the discounted returns
+        np.testing.assert_allclose(nstep_returns(rewards, values, dones, last_values, gamma, nstep),
+                                   discounted_returns(rewards, dones, gamma, last_values), rtol=1e-5, atol=1e-5)
+
+
+@mark_slow
+def test_returns_throughput():
+    nsteps, nenv = 2048, 256
+    rewards, values, dones, last_values, last_dones = _rollout(nsteps, nenv, 0.01)
+    for name, fn in [('GAE loop', lambda: _gae_loop(rewards, values, dones, last_values, last_dones, 0.99, 0.95)),
+                     ('gae', lambda: gae(rewards, values, dones, last_values, last_dones, 0.99, 0.95)),
+                     ('a2c discount loop', lambda: _a2c_returns_loop(rewards.T, dones.T, last_values, 0.99)),
+                     ('discounted_returns', lambda: discounted_returns(rewards, dones, 0.99, last_values))]:
+        tstart = time.time()
+        fn()
+        print('{}: {:.1f} ms ({} steps, {} envs)'.format(name, (time.time() - tstart) * 1e3, nsteps, nenv))
+    seg = {'rew': rewards[:, 0], 'vpred': values[:, 0], 'new': dones[:, 0], 'nextvpred': last_values[0]}
+    for name, fn in [('add_vtarg_and_adv loop', lambda: _add_vtarg_and_adv_loop(seg, 0.99, 0.95)),
+                     ('gae', lambda: gae(seg['rew'], seg['vpred'], seg['new'], seg['nextvpred'], 0, 0.99, 0.95))]:
+        tstart = time.time()
+        for _ in range(10):
+            fn()
+        print('{}: {:.2f} ms ({} steps, 1 env)'.format(name, (time.time() - tstart) * 100, nsteps))
@@ -0,0 +1,12 @@
+from baselines.run import get_learn_function_defaults
+
+
+def test_deepq_atari_vec_env_replay_storage():
+    """
+    Test that deepq on several Atari envs, which build_env runs as a VecEnv,
+    defaults to a replay buffer storage that supports VecEnvs.
+    """
+    assert get_learn_function_defaults('deepq', 'atari')['replay_storage'] == 'frames'
+    assert get_learn_function_defaults('deepq', 'atari', num_env=1)['replay_storage'] == 'frames'
+    assert get_learn_function_defaults('deepq', 'atari', num_env=4)['replay_storage'] == 'array'
+    assert get_learn_function_defaults('deepq', 'retro', num_env=4)['replay_storage'] == 'list'
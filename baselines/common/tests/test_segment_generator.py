@@ -0,0 +1,171 @@
+import time
+
+import gym
+import numpy as np
+
+from baselines.common.segment_generator import traj_segment_generator, flatten_segment
+from baselines.common.tests import mark_slow
+from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+
+
+class DriftEnv(gym.Env):
+    """
+    A deterministic env with episodes of seed + 3 steps.
+    """
+
+    def __init__(self, seed):
+        self.observation_space = gym.spaces.Box(low=-np.inf, high=np.inf, shape=(2,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+        self._episode_len = seed + 3
+        self._start_obs = np.array([seed, -seed], dtype=np.float32)
+        self._obs = None
+        self._t = 0
+
+    def reset(self):
+        self._obs = self._start_obs.copy()
+        self._t = 0
+        return self._obs.copy()
+
+    def step(self, action):
+        self._obs = self._obs * 0.9 + (action - 0.5)
+        self._t += 1
+        return self._obs.copy(), float(action) + self._obs[0], self._t >= self._episode_len, {}
+
+
+def _act(obs):
+    obs = np.asarray(obs, dtype=np.float32)
+    return (obs[..., 0] > obs[..., 1]).astype(np.int64), obs.sum(axis=-1)
+
+
+def _single_env_segments(env, horizon):
+    # the segment generator of trpo_mpi before it drove VecEnvs
+    t = 0
+    ac = env.action_space.sample()
+    new = True
+    ob = env.reset()
+    cur_ep_ret = 0
+    cur_ep_len = 0
+    ep_rets = []
+    ep_lens = []
+    obs = np.array([ob for _ in range(horizon)])
+    rews = np.zeros(horizon, 'float32')
+    vpreds = np.zeros(horizon, 'float32')
+    news = np.zeros(horizon, 'int32')
+    acs = np.array([ac for _ in range(horizon)])
+    while True:
+        ac, vpred = _act(ob)
+        if t > 0 and t % horizon == 0:
+            yield {"ob": obs, "rew": rews, "vpred": vpreds, "new": news, "ac": acs,
+                   "nextvpred": vpred * (1 - new), "ep_rets": ep_rets, "ep_lens": ep_lens}
+            ep_rets = []
+            ep_lens = []
+        i = t % horizon
+        obs[i] = ob
+        vpreds[i] = vpred
+        news[i] = new
+        acs[i] = ac
+        ob, rew, new, _ = env.step(ac)
+        rews[i] = rew
+        cur_ep_ret += rew
+        cur_ep_len += 1
+        if new:
+            ep_rets.append(cur_ep_ret)
+            ep_lens.append(cur_ep_len)
+            cur_ep_ret = 0
+            cur_ep_len = 0
+            ob = env.reset()
+        t += 1
+
+
+def _assert_segments_equal(expected, actual):
+    for key in ('ob', 'rew', 'vpred', 'new', 'ac', 'nextvpred'):
+        assert np.allclose(expected[key], actual[key]), key
+    for key in ('ep_rets', 'ep_lens'):
+        assert np.allclose(expected[key], actual[key]), key
+
+
+def test_single_env_matches_reference():
+    horizon = 10
+    expected_gen = _single_env_segments(DriftEnv(2), horizon)
+    actual_gen = traj_segment_generator(_act, DriftEnv(2), horizon)
+    for _ in range(4):
+        expected = next(expected_gen)
+        actual = next(actual_gen)
+        assert actual['ob'].shape == (horizon, 1, 2)
+        flatten_segment(actual)
+        _assert_segments_equal(expected, actual)
+
+
+def test_vec_env_matches_single_envs():
+    """
+    Test that every env of a VecEnv gets the segments it would get on its own,
+    and that flatten_segment lays them out one env after the other.
+    """
+    nenv, horizon = 3, 8
+    actual_gen = traj_segment_generator(_act, DummyVecEnv([lambda seed=seed: DriftEnv(seed) for seed in range(nenv)]), horizon)
+    expected_gens = [_single_env_segments(DriftEnv(seed), horizon) for seed in range(nenv)]
+    for _ in range(3):
+        actual = next(actual_gen)
+        assert actual['rew'].shape == (horizon, nenv)
+        expected = [next(gen) for gen in expected_gens]
+        for e, env_expected in enumerate(expected):
+            for key in ('ob', 'rew', 'vpred', 'new', 'ac'):
+                assert np.allclose(actual[key][:, e], env_expected[key]), key
+            assert np.allclose(actual['nextvpred'][e], env_expected['nextvpred'])
+            assert np.array_equal(actual['prevac'][1:, e], actual['ac'][:-1, e])
+        assert sorted(actual['ep_lens']) == sorted(sum((e['ep_lens'] for e in expected), []))
+        flatten_segment(actual)
+        assert np.allclose(actual['ob'], np.concatenate([e['ob'] for e in expected]))
+        assert np.allclose(actual['rew'], np.concatenate([e['rew'] for e in expected]))
+
+
+def test_first_prevac_is_sampled():
+    nenv = 5
+    env = DummyVecEnv([lambda seed=seed: DriftEnv(seed) for seed in range(nenv)])
+    env.action_space.seed(3)
+    seg = next(traj_segment_generator(_act, env, 4))
+    space = gym.spaces.Discrete(2)
+    space.seed(3)
+    assert np.array_equal(seg['prevac'][0], [space.sample() for _ in range(nenv)])
+    assert seg['prevac'].dtype == seg['ac'].dtype
+
+
+class _ObsRewardGiver(object):
+    def get_reward(self, obs, acs):
+        return obs[:, :1] * 2
+
+
+def test_reward_giver():
+    horizon = 12
+    seg = next(traj_segment_generator(_act, DriftEnv(0), horizon, reward_giver=_ObsRewardGiver()))
+    assert np.allclose(seg['rew'], seg['ob'][..., 0] * 2)
+    expected = next(_single_env_segments(DriftEnv(0), horizon))
+    # the env rewards are only kept for the true returns
+    assert np.allclose(seg['ep_true_rets'], expected['ep_rets'])
+    assert np.allclose(seg['ep_rets'], [seg['rew'][start:start + 3].sum() for start in (0, 3, 6, 9)])
+
+
+@mark_slow
+def test_segment_generator_throughput():
+    """
+    Print the steps per second of collecting segments one env at a time
+    and with all envs at once, when a call to the policy costs 0.5ms.
+    """
+    nenv, horizon = 16, 256
+
+    def slow_act(obs):
+        time.sleep(5e-4)
+        return _act(obs)
+
+    def single_env_act(ob):
+        ac, vpred = slow_act(np.asarray(ob)[None])
+        return ac[0], vpred[0]
+
+    for name, make_gen, nsteps in [
+            ('one env', lambda: traj_segment_generator(single_env_act, DriftEnv(0), horizon * nenv), horizon * nenv),
+            ('{} envs'.format(nenv), lambda: traj_segment_generator(
+                slow_act, DummyVecEnv([lambda seed=seed: DriftEnv(seed) for seed in range(nenv)]), horizon), horizon * nenv)]:
+        gen = make_gen()
+        tstart = time.time()
+        next(gen)
+        print('{}: {:.0f} steps/s'.format(name, nsteps / (time.time() - tstart)))
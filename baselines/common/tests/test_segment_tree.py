@@ -95,9 +95,54 @@ def test_max_interval_tree():
     assert np.isclose(tree.min(3, 4), 3.0)
 
 
+def test_reduce_matches_brute_force():
+    rng = np.random.RandomState(0)
+    values = rng.rand(16)
+    sum_tree = SumSegmentTree(16)
+    min_tree = MinSegmentTree(16)
+    for i, v in enumerate(values):
+        sum_tree[i] = v
+        min_tree[i] = v
+
+    for start in range(16):
+        for end in range(start + 1, 17):
+            assert np.isclose(sum_tree.sum(start, end), values[start:end].sum())
+            assert np.isclose(min_tree.min(start, end), values[start:end].min())
+
+
+def test_set_batch():
+    rng = np.random.RandomState(0)
+    idxes = rng.randint(0, 32, size=20)
+    values = rng.rand(20)
+
+    batched = SumSegmentTree(32)
+    sequential = SumSegmentTree(32)
+    batched[idxes] = values
+    for idx, v in zip(idxes, values):
+        sequential[idx] = v
+    assert np.allclose(batched._value, sequential._value)
+    assert np.allclose(batched[idxes], [sequential[idx] for idx in idxes])
+
+    batched_min = MinSegmentTree(32)
+    batched_min[idxes] = values
+    assert np.isclose(batched_min.min(), values.min())
+
+
+def test_prefixsum_idx_batch():
+    tree = SumSegmentTree(4)
+
+    tree[np.arange(4)] = [0.5, 1.0, 1.0, 3.0]
+
+    prefixsums = np.array([0.00, 0.55, 0.99, 1.51, 3.00, 5.50])
+    assert np.array_equal(tree.find_prefixsum_idx(prefixsums), [0, 1, 1, 2, 3, 3])
+
+
 if __name__ == '__main__':
     test_tree_set()
     test_tree_set_overlap()
     test_prefixsum_idx()
     test_prefixsum_idx2()
     test_max_interval_tree()
+    test_reduce_matches_brute_force()
+    test_set_batch()
+    test_prefixsum_idx_batch()
@@ -1,10 +1,13 @@
 from .vec_env import AlreadySteppingError, NotSteppingError, VecEnv, VecEnvWrapper, VecEnvObservationWrapper, CloudpickleWrapper
+from .async_vec_env import AsyncVecEnv
 from .dummy_vec_env import DummyVecEnv
 from .shmem_vec_env import ShmemVecEnv
+from .remote_vec_env import RemoteVecEnv
 from .subproc_vec_env import SubprocVecEnv
+from .threaded_vec_env import ThreadedVecEnv
 from .vec_frame_stack import VecFrameStack
 from .vec_monitor import VecMonitor
 from .vec_normalize import VecNormalize
 from .vec_remove_dict_obs import VecExtractDictObs
 
-__all__ = ['AlreadySteppingError', 'NotSteppingError', 'VecEnv', 'VecEnvWrapper', 'VecEnvObservationWrapper', 'CloudpickleWrapper', 'DummyVecEnv', 'ShmemVecEnv', 'SubprocVecEnv', 'VecFrameStack', 'VecMonitor', 'VecNormalize', 'VecExtractDictObs']
+__all__ = ['AlreadySteppingError', 'NotSteppingError', 'VecEnv', 'VecEnvWrapper', 'VecEnvObservationWrapper', 'CloudpickleWrapper', 'AsyncVecEnv', 'DummyVecEnv', 'RemoteVecEnv', 'ShmemVecEnv', 'SubprocVecEnv', 'ThreadedVecEnv', 'VecFrameStack', 'VecMonitor', 'VecNormalize', 'VecExtractDictObs']
@@ -0,0 +1,75 @@
+from multiprocessing.connection import wait
+
+import numpy as np
+from .subproc_vec_env import SubprocVecEnv, _flatten_obs
+
+
+class AsyncVecEnv(SubprocVecEnv):
+    """
+    SubprocVecEnv whose envs can be stepped independently of each other: step_send starts a step
+    in some of the envs, and step_recv returns the results of the envs that are done first.
+    Useful when step times vary a lot, so that the fast envs need not wait for the slowest one.
+    step_async and step_wait step all envs together, like SubprocVecEnv.
+    """
+    def __init__(self, env_fns, spaces=None, context='spawn'):
+        """
+        Arguments:
+
+        env_fns: iterable of callables -  functions that create environments to run in subprocesses. Need to be cloud-pickleable
+        """
+        super().__init__(env_fns, spaces=spaces, context=context)
+        self.remote_ids = {remote: env_id for env_id, remote in enumerate(self.remotes)}
+        self.pending = set()
+
+    def step_send(self, actions, env_ids):
+        """
+        Start a step in the envs env_ids, which must not have a step in progress.
+        """
+        self._assert_not_closed()
+        for action, env_id in zip(actions, env_ids):
+            assert env_id not in self.pending, "env {} is already stepping".format(env_id)
+            self.remotes[env_id].send(('step', [action]))
+            self.pending.add(env_id)
+        self.waiting = bool(self.pending)
+
+    def step_recv(self, k, env_ids=None):
+        """
+        Wait until at least k of the envs with a step in progress are done (all of them if
+        fewer are in progress), and return the results of all the envs done so far.
+        If env_ids is given, only these envs are waited for and returned.
+
+        returns (observation, reward, done, infos, env_ids), where env_ids are the envs
+        the results belong to.
+        """
+        self._assert_not_closed()
+        pending = self.pending if env_ids is None else self.pending.intersection(env_ids)
+        k = min(k, len(pending))
+        ready = set()
+        while len(ready) < k:
+            remotes = wait([self.remotes[env_id] for env_id in pending - ready])
+            ready.update(self.remote_ids[remote] for remote in remotes)
+        env_ids = np.array(sorted(ready), dtype=np.int64)
+        results = [self.remotes[env_id].recv()[0] for env_id in env_ids]
+        self.pending.difference_update(ready)
+        self.waiting = bool(self.pending)
+        obs, rews, dones, infos = zip(*results)
+        return _flatten_obs(obs), np.stack(rews), np.stack(dones), infos, env_ids
+
+    def step_async(self, actions):
+        self.step_send(actions, range(self.num_envs))
+
+    def step_wait(self):
+        obs, rews, dones, infos, env_ids = self.step_recv(self.num_envs)
+        assert np.array_equal(env_ids, np.arange(self.num_envs))
+        return obs, rews, dones, infos
+
+    def reset(self):
+        assert not self.pending, "cannot reset while envs are stepping"
+        return super().reset()
+
+    def close_extras(self):
+        for env_id in self.pending:
+            self.remotes[env_id].recv()
+        self.pending.clear()
+        self.waiting = False
+        super().close_extras()
@@ -0,0 +1,269 @@
+"""
+Vectorized environments stepped by env servers over TCP, possibly on other machines.
+
+Messages are length-prefixed: a header with the payload size and a command code,
+followed by the payload. Steps only carry raw NumPy buffers (actions one way;
+observations, rewards and dones the other way), and the pickled infos when they are
+not all empty. Every server runs several envs, which are stepped by a single request.
+
+The spaces, infos and rendered images are unpickled by the client, so a server, or anyone
+able to answer in its place, can run arbitrary code in the client: only connect to servers
+you trust, over a trusted network. Servers listen on localhost unless told otherwise.
+"""
+
+import multiprocessing as mp
+import pickle
+import socket
+import struct
+
+import numpy as np
+from .vec_env import VecEnv, CloudpickleWrapper, clear_mpi_env_vars
+from .util import dict_to_obs, obs_space_info, obs_to_dict
+
+_HEADER = struct.Struct('!IB')
+_CMD_STEP, _CMD_RESET, _CMD_RENDER, _CMD_CLOSE, _CMD_GET_SPACES_SPEC = range(5)
+
+
+def _send_msg(sock, cmd, *buffers):
+    buffers = [memoryview(np.ascontiguousarray(b)).cast('B') if isinstance(b, np.ndarray) else b for b in buffers]
+    sock.sendall(b''.join([_HEADER.pack(sum(len(b) for b in buffers), cmd)] + buffers))
+
+
+def _recv_exactly(sock, view):
+    while len(view):
+        nbytes = sock.recv_into(view)
+        if nbytes == 0:
+            raise EOFError('connection closed')
+        view = view[nbytes:]
+
+
+def _recv_msg(sock, buf):
+    """
+    Receive a message into the bytearray buf, or a larger one if it is too small.
+    Return the command, a memoryview of the payload and the buffer holding it,
+    to be passed to the next call; the payload is overwritten by the next call.
+    """
+    header = bytearray(_HEADER.size)
+    _recv_exactly(sock, memoryview(header))
+    size, cmd = _HEADER.unpack(header)
+    if len(buf) < size:
+        buf = bytearray(max(size, 2 * len(buf)))
+    view = memoryview(buf)[:size]
+    _recv_exactly(sock, view)
+    return cmd, view, buf
+
+
+def env_server(listener, env_fn_wrappers):
+    """
+    Serve a client connecting to the socket listener with the envs built by env_fn_wrappers,
+    until it sends a close command.
+    """
+    envs = [env_fn_wrapper() for env_fn_wrapper in env_fn_wrappers.x]
+    keys, shapes, dtypes = obs_space_info(envs[0].observation_space)
+    action_space = envs[0].action_space
+    obs_bufs = {k: np.empty((len(envs),) + shapes[k], dtype=dtypes[k]) for k in keys}
+    rews = np.empty(len(envs), dtype=np.float32)
+    dones = np.empty(len(envs), dtype=np.bool_)
+
+    def write_obs(i, obs):
+        obs = obs_to_dict(obs)
+        for k in keys:
+            obs_bufs[k][i] = obs[k]
+
+    conn, _ = listener.accept()
+    listener.close()
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    buf = bytearray()
+    try:
+        while True:
+            cmd, payload, buf = _recv_msg(conn, buf)
+            if cmd == _CMD_STEP:
+                # copy the actions, the envs may keep them around after buf is overwritten
+                actions = np.frombuffer(payload, dtype=action_space.dtype).reshape((len(envs),) + action_space.shape).copy()
+                infos = []
+                for i, (env, action) in enumerate(zip(envs, actions)):
+                    obs, rews[i], dones[i], info = env.step(action)
+                    if dones[i]:
+                        obs = env.reset()
+                    write_obs(i, obs)
+                    infos.append(info)
+                infos = pickle.dumps(infos) if any(infos) or dones.any() else b''
+                _send_msg(conn, cmd, *[obs_bufs[k] for k in keys], rews, dones, infos)
+            elif cmd == _CMD_RESET:
+                for i, env in enumerate(envs):
+                    write_obs(i, env.reset())
+                _send_msg(conn, cmd, *[obs_bufs[k] for k in keys])
+            elif cmd == _CMD_RENDER:
+                _send_msg(conn, cmd, pickle.dumps([env.render(mode='rgb_array') for env in envs]))
+            elif cmd == _CMD_CLOSE:
+                _send_msg(conn, cmd)
+                break
+            elif cmd == _CMD_GET_SPACES_SPEC:
+                import cloudpickle
+                _send_msg(conn, cmd, cloudpickle.dumps((len(envs), envs[0].observation_space, action_space, envs[0].spec)))
+            else:
+                raise NotImplementedError
+    except KeyboardInterrupt:
+        print('RemoteVecEnv server: got KeyboardInterrupt')
+    finally:
+        conn.close()
+        for env in envs:
+            env.close()
+
+
+def _env_server_process(env_fn_wrappers, host, port, port_remote):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1)
+    port_remote.send(listener.getsockname()[1])
+    port_remote.close()
+    env_server(listener, env_fn_wrappers)
+
+
+def start_env_server(env_fns, host='localhost', port=0, context='spawn'):
+    """
+    Start an env server in a subprocess, listening on (host, port); port=0 picks a free port.
+
+    returns (process, address) where address is the (host, port) to connect to.
+    """
+    ctx = mp.get_context(context)
+    port_remote, work_port_remote = ctx.Pipe()
+    p = ctx.Process(target=_env_server_process, args=(CloudpickleWrapper(env_fns), host, port, work_port_remote))
+    p.daemon = True
+    with clear_mpi_env_vars():
+        p.start()
+    work_port_remote.close()
+    return p, (host, port_remote.recv())
+
+
+class RemoteVecEnv(VecEnv):
+    """
+    VecEnv whose environments run in env servers (see env_server and start_env_server), possibly on other
+    machines, and communicates with them via TCP. The steps of all servers run concurrently.
+
+    The replies of the servers are unpickled, which runs code they choose: the servers must be trusted.
+    """
+    def __init__(self, addresses, timeout=None):
+        """
+        Arguments:
+
+        addresses: list of (host, port) of the env servers; the envs of the first server come first, and so on
+        timeout: timeout of socket operations in seconds, None to block forever
+        """
+        self.waiting = False
+        self.closed = False
+        self.socks = []
+        for address in addresses:
+            sock = socket.create_connection(address, timeout=timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socks.append(sock)
+        self.bufs = [bytearray() for _ in self.socks]
+        self.nenvs = []
+        for sock_idx, sock in enumerate(self.socks):
+            _send_msg(sock, _CMD_GET_SPACES_SPEC)
+            nenvs, observation_space, action_space, self.spec = pickle.loads(self._recv(sock_idx, _CMD_GET_SPACES_SPEC))
+            self.nenvs.append(nenvs)
+        self.obs_keys, self.obs_shapes, self.obs_dtypes = obs_space_info(observation_space)
+        assert action_space.dtype is not None, 'RemoteVecEnv needs actions that fit in an array'
+        self.viewer = None
+        VecEnv.__init__(self, sum(self.nenvs), observation_space, action_space)
+
+    def step_async(self, actions):
+        self._assert_not_closed()
+        actions = np.asarray(actions, dtype=self.action_space.dtype)
+        start = 0
+        for sock, nenvs in zip(self.socks, self.nenvs):
+            _send_msg(sock, _CMD_STEP, actions[start:start + nenvs])
+            start += nenvs
+        self.waiting = True
+
+    def step_wait(self):
+        self._assert_not_closed()
+        obs = {k: [] for k in self.obs_keys}
+        rews, dones, infos = [], [], []
+        for sock_idx, nenvs in enumerate(self.nenvs):
+            payload = self._recv(sock_idx, _CMD_STEP)
+            offset = self._read_obs(payload, nenvs, obs)
+            rews.append(np.frombuffer(payload, dtype=np.float32, count=nenvs, offset=offset))
+            offset += 4 * nenvs
+            dones.append(np.frombuffer(payload, dtype=np.bool_, count=nenvs, offset=offset))
+            offset += nenvs
+            infos.extend(pickle.loads(payload[offset:]) if len(payload) > offset else [{}] * nenvs)
+        self.waiting = False
+        return self._concat_obs(obs), np.concatenate(rews), np.concatenate(dones), tuple(infos)
+
+    def reset(self):
+        self._assert_not_closed()
+        for sock in self.socks:
+            _send_msg(sock, _CMD_RESET)
+        obs = {k: [] for k in self.obs_keys}
+        for sock_idx, nenvs in enumerate(self.nenvs):
+            self._read_obs(self._recv(sock_idx, _CMD_RESET), nenvs, obs)
+        return self._concat_obs(obs)
+
+    def close_extras(self):
+        self.closed = True
+        if self.waiting:
+            for sock_idx in range(len(self.socks)):
+                self._recv(sock_idx, _CMD_STEP)
+        for sock in self.socks:
+            _send_msg(sock, _CMD_CLOSE)
+        for sock_idx, sock in enumerate(self.socks):
+            self._recv(sock_idx, _CMD_CLOSE)
+            sock.close()
+
+    def get_images(self):
+        self._assert_not_closed()
+        for sock in self.socks:
+            _send_msg(sock, _CMD_RENDER)
+        return [img for sock_idx in range(len(self.socks)) for img in pickle.loads(self._recv(sock_idx, _CMD_RENDER))]
+
+    def _recv(self, sock_idx, expected_cmd):
+        cmd, payload, self.bufs[sock_idx] = _recv_msg(self.socks[sock_idx], self.bufs[sock_idx])
+        assert cmd == expected_cmd, 'expected a reply to command {}, got {}'.format(expected_cmd, cmd)
+        return payload
+
+    def _read_obs(self, payload, nenvs, obs):
+        """
+        Append the observations at the start of payload to the lists in obs, and return their size in bytes.
+        """
+        offset = 0
+        for k in self.obs_keys:
+            count = nenvs * int(np.prod(self.obs_shapes[k]))
+            obs[k].append(np.frombuffer(payload, dtype=self.obs_dtypes[k], count=count, offset=offset)
+                          .reshape((nenvs,) + self.obs_shapes[k]))
+            offset += count * self.obs_dtypes[k].itemsize
+        return offset
+
+    def _concat_obs(self, obs):
+        # concatenate copies out of the receive buffers, which are reused by the next message
+        return dict_to_obs({k: np.concatenate(v) for k, v in obs.items()})
+
+    def _assert_not_closed(self):
+        assert not self.closed, "Trying to operate on a RemoteVecEnv after calling close()"
+
+    def __del__(self):
+        if not self.closed:
+            self.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    from baselines.common.cmd_util import make_env
+    parser = argparse.ArgumentParser(description='Serve envs to a RemoteVecEnv')
+    parser.add_argument('--env', help='environment ID', type=str, default='PongNoFrameskip-v4')
+    parser.add_argument('--env_type', help='type of environment, e.g. atari', type=str, default=None)
+    parser.add_argument('--num_env', help='number of envs served', type=int, default=1)
+    parser.add_argument('--seed', help='seed of the first env', type=int, default=0)
+    parser.add_argument('--host', help='address to listen on, e.g. 0.0.0.0 for all interfaces; '
+                        'clients unpickle the replies, so only listen where clients trust the server',
+                        type=str, default='localhost')
+    parser.add_argument('--port', type=int, default=7000)
+    args = parser.parse_args()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(1)
+    env_fns = [lambda i=i: make_env(args.env, args.env_type, seed=args.seed, subrank=i) for i in range(args.num_env)]
+    env_server(listener, CloudpickleWrapper(env_fns))
@@ -3,6 +3,9 @@ An interface for asynchronous vectorized environments.
 """
 
 import multiprocessing as mp
+import os
+import pickle
+import time
 import numpy as np
 from .vec_env import VecEnv, CloudpickleWrapper, clear_mpi_env_vars
 import ctypes
@@ -11,23 +14,43 @@ from baselines import logger
 from .util import dict_to_obs, obs_space_info, obs_to_dict
 
 _NP_TO_CT = {np.float32: ctypes.c_float,
+             np.float64: ctypes.c_double,
+             np.int64: ctypes.c_int64,
              np.int32: ctypes.c_int32,
              np.int8: ctypes.c_int8,
              np.uint8: ctypes.c_char,
              np.bool: ctypes.c_bool}
 
+# with sync='spin', how long a semaphore is polled before blocking on it, in seconds
+_SPIN_TIME = 1e-4
+# commands posted through the shared command array with sync='spin'
+_CMD_PIPE, _CMD_STEP = 0, 1
+# how often a blocked wait on a worker checks that it is still alive, in seconds
+_LIVENESS_CHECK_TIME = 0.1
+
 
 class ShmemVecEnv(VecEnv):
     """
-    Optimized version of SubprocVecEnv that uses shared variables to communicate observations.
+    Optimized version of SubprocVecEnv that uses shared variables to communicate observations,
+    actions, rewards and dones. The pipes only carry commands, and infos when they are not empty.
     """
 
-    def __init__(self, env_fns, spaces=None, context='spawn'):
+    def __init__(self, env_fns, spaces=None, context='spawn', sync='pipe', in_series=1, restart_on_crash=False):
         """
         If you don't specify observation_space, we'll have to create a dummy
         environment to get it.
+
+        sync: how workers are woken up for a step and report it done. 'pipe' sends messages
+        through the pipes. 'spin' releases semaphores instead, which are polled for a short
+        while before blocking; this saves tens of microseconds per step round trip when envs
+        are cheap and every worker has a core to itself.
+        in_series: number of environments to run in series in a single process
+        (e.g. when len(env_fns) == 12 and in_series == 3, it will run 4 processes, each running 3 envs in series)
+        restart_on_crash: if True, a subprocess that dies (e.g. segfault or OOM in the env) is started again
+        with fresh envs, which are reported as done with info['worker_restarted'] = True
         """
-        ctx = mp.get_context(context)
+        assert sync in ('pipe', 'spin'), sync
+        ctx = self.ctx = mp.get_context(context)
         if spaces:
             observation_space, action_space = spaces
         else:
@@ -38,98 +61,270 @@ class ShmemVecEnv(VecEnv):
                 dummy.close()
                 del dummy
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+        assert self.num_envs % in_series == 0, "Number of envs must be divisible by number of envs to run in series"
+        self.in_series = in_series
+        nworkers = self.num_envs // in_series
+        # each key has one block for all envs, every worker writes the slice of its envs
         self.obs_keys, self.obs_shapes, self.obs_dtypes = obs_space_info(observation_space)
-        self.obs_bufs = [
-            {k: ctx.Array(_NP_TO_CT[self.obs_dtypes[k].type], int(np.prod(self.obs_shapes[k]))) for k in self.obs_keys}
-            for _ in env_fns]
-        self.parent_pipes = []
-        self.procs = []
-        with clear_mpi_env_vars():
-            for env_fn, obs_buf in zip(env_fns, self.obs_bufs):
-                wrapped_fn = CloudpickleWrapper(env_fn)
-                parent_pipe, child_pipe = ctx.Pipe()
-                proc = ctx.Process(target=_subproc_worker,
-                            args=(child_pipe, parent_pipe, wrapped_fn, obs_buf, self.obs_shapes, self.obs_dtypes, self.obs_keys))
-                proc.daemon = True
-                self.procs.append(proc)
-                self.parent_pipes.append(parent_pipe)
-                proc.start()
-                child_pipe.close()
+        self.obs_bufs = {k: ctx.Array(_NP_TO_CT[self.obs_dtypes[k].type], self.num_envs * int(np.prod(self.obs_shapes[k])))
+                         for k in self.obs_keys}
+        # actions are pickled down the pipes if they do not fit in a shared array (e.g. Tuple spaces)
+        self.act_buf = None
+        if action_space.dtype is not None and action_space.dtype.type in _NP_TO_CT:
+            self.act_buf = ctx.Array(_NP_TO_CT[action_space.dtype.type], int(np.prod(action_space.shape)) * self.num_envs)
+        self.rew_buf = ctx.Array(ctypes.c_float, self.num_envs)
+        self.done_buf = ctx.Array(ctypes.c_bool, self.num_envs)
+        self.step_bufs = (self.act_buf, action_space.shape, action_space.dtype, self.rew_buf, self.done_buf)
+        self.sync_bufs = None
+        if sync == 'spin':
+            # per worker: the posted command, whether infos follow in the pipe,
+            # and the semaphores signaling a command and the end of a step
+            self.sync_bufs = (ctx.Array(ctypes.c_int8, nworkers, lock=False),
+                              ctx.Array(ctypes.c_bool, nworkers, lock=False),
+                              [ctx.Semaphore(0) for _ in range(nworkers)], [ctx.Semaphore(0) for _ in range(nworkers)])
+        self.restart_on_crash = restart_on_crash
+        self.crashed = set()
+        self.restarts = [0] * nworkers
+        self.env_fns = [CloudpickleWrapper(env_fns[self._env_slice(worker_idx)]) for worker_idx in range(nworkers)]
+        self.parent_pipes = [None] * nworkers
+        self.procs = [None] * nworkers
+        for worker_idx in range(nworkers):
+            self._start_worker(worker_idx)
         self.waiting_step = False
         self.viewer = None
 
+    def _env_slice(self, worker_idx):
+        return slice(worker_idx * self.in_series, (worker_idx + 1) * self.in_series)
+
+    def _start_worker(self, worker_idx):
+        parent_pipe, child_pipe = self.ctx.Pipe()
+        proc = self.ctx.Process(target=_subproc_worker,
+                    args=(child_pipe, parent_pipe, self.env_fns[worker_idx], self.obs_bufs, self.obs_shapes, self.obs_dtypes,
+                          self.obs_keys, worker_idx, self._env_slice(worker_idx), self.step_bufs, self.sync_bufs))
+        proc.daemon = True
+        with clear_mpi_env_vars():
+            proc.start()
+        child_pipe.close()
+        self.parent_pipes[worker_idx], self.procs[worker_idx] = parent_pipe, proc
+
+    def _restart_worker(self, worker_idx):
+        """
+        Replace a dead worker by a new one, which resets its envs and reports them done.
+        """
+        self.parent_pipes[worker_idx].close()
+        self.procs[worker_idx].join()
+        self.restarts[worker_idx] += 1
+        logger.warn('ShmemVecEnv: worker {} died with exit code {}, restarting it ({} restarts in total)'.format(
+            worker_idx, self.procs[worker_idx].exitcode, sum(self.restarts)))
+        if self.sync_bufs is not None:
+            # the dead worker may have left the semaphores released
+            _, _, cmd_sems, done_sems = self.sync_bufs
+            cmd_sems[worker_idx], done_sems[worker_idx] = self.ctx.Semaphore(0), self.ctx.Semaphore(0)
+        self._start_worker(worker_idx)
+        self._send(worker_idx, 'reset', None)
+        self.parent_pipes[worker_idx].recv()
+        env_slice = self._env_slice(worker_idx)
+        _shared_np(self.rew_buf, np.float32, (self.num_envs,))[env_slice] = 0
+        _shared_np(self.done_buf, np.bool_, (self.num_envs,))[env_slice] = True
+
     def reset(self):
         if self.waiting_step:
             logger.warn('Called reset() while waiting for the step to complete')
             self.step_wait()
-        for pipe in self.parent_pipes:
-            pipe.send(('reset', None))
-        return self._decode_obses([pipe.recv() for pipe in self.parent_pipes])
+        for worker_idx in range(len(self.parent_pipes)):
+            self._send(worker_idx, 'reset', None)
+        for worker_idx in range(len(self.parent_pipes)):
+            if not self._recv(worker_idx)[0]:
+                self._restart_worker(worker_idx)
+        return self._decode_obses()
 
     def step_async(self, actions):
-        assert len(actions) == len(self.parent_pipes)
-        for pipe, act in zip(self.parent_pipes, actions):
-            pipe.send(('step', act))
+        assert len(actions) == self.num_envs
+        if self.act_buf is not None:
+            act_np = _shared_np(self.act_buf, self.action_space.dtype, (self.num_envs,) + self.action_space.shape)
+            act_np[...] = actions
+            actions = None
+        for worker_idx in range(len(self.parent_pipes)):
+            if actions is None and self.sync_bufs is not None:
+                cmd_buf, _, cmd_sems, _ = self.sync_bufs
+                cmd_buf[worker_idx] = _CMD_STEP
+                cmd_sems[worker_idx].release()
+            else:
+                act = None if actions is None else actions[worker_idx * self.in_series:(worker_idx + 1) * self.in_series]
+                self._send(worker_idx, 'step', act)
         self.waiting_step = True
 
     def step_wait(self):
-        outs = [pipe.recv() for pipe in self.parent_pipes]
+        # workers send the pickled infos of their envs, or nothing if they are all empty
+        infos = []
+        for worker_idx in range(len(self.parent_pipes)):
+            received, worker_infos = self._recv(worker_idx, self._recv_step)
+            if not received:
+                self._restart_worker(worker_idx)
+                infos.extend({'worker_restarted': True} for _ in range(self.in_series))
+            else:
+                infos.extend(pickle.loads(worker_infos) if worker_infos else [{}] * self.in_series)
         self.waiting_step = False
-        obs, rews, dones, infos = zip(*outs)
-        return self._decode_obses(obs), np.array(rews), np.array(dones), infos
+        infos = tuple(infos)
+        rews = _shared_np(self.rew_buf, np.float32, (self.num_envs,)).copy()
+        dones = _shared_np(self.done_buf, np.bool_, (self.num_envs,)).copy()
+        return self._decode_obses(), rews, dones, infos
 
     def close_extras(self):
         if self.waiting_step:
             self.step_wait()
-        for pipe in self.parent_pipes:
-            pipe.send(('close', None))
-        for pipe in self.parent_pipes:
-            pipe.recv()
+        for worker_idx in range(len(self.parent_pipes)):
+            self._send(worker_idx, 'close', None)
+        for worker_idx, pipe in enumerate(self.parent_pipes):
+            self._recv(worker_idx)
             pipe.close()
         for proc in self.procs:
             proc.join()
 
     def get_images(self, mode='human'):
-        for pipe in self.parent_pipes:
-            pipe.send(('render', None))
-        return [pipe.recv() for pipe in self.parent_pipes]
+        for worker_idx in range(len(self.parent_pipes)):
+            self._send(worker_idx, 'render', None)
+        return [img for pipe in self.parent_pipes for img in pipe.recv()]
+
+    def _send(self, worker_idx, cmd, data):
+        try:
+            self.parent_pipes[worker_idx].send((cmd, data))
+        except ConnectionError:
+            if not self.restart_on_crash:
+                raise
+            self.crashed.add(worker_idx)
+            return
+        if self.sync_bufs is not None:
+            cmd_buf, _, cmd_sems, _ = self.sync_bufs
+            cmd_buf[worker_idx] = _CMD_PIPE
+            cmd_sems[worker_idx].release()
+
+    def _recv(self, worker_idx, recv=None):
+        """
+        Receive a reply from a worker, with recv(worker_idx) if given.
+        Return (True, reply), or (False, None) if the worker died and restart_on_crash is set.
+        """
+        try:
+            if worker_idx in self.crashed:
+                raise EOFError
+            return True, self.parent_pipes[worker_idx].recv() if recv is None else recv(worker_idx)
+        except (EOFError, ConnectionError):
+            if not self.restart_on_crash:
+                raise
+            self.crashed.discard(worker_idx)
+            return False, None
+
+    def _recv_step(self, worker_idx):
+        pipe = self.parent_pipes[worker_idx]
+        if self.sync_bufs is None:
+            return pipe.recv_bytes()
+        _, info_buf, _, done_sems = self.sync_bufs
+        if not _spin_acquire(done_sems[worker_idx], self.procs[worker_idx]):
+            raise EOFError('ShmemVecEnv worker {} died'.format(worker_idx))
+        return pipe.recv_bytes() if info_buf[worker_idx] else b''
 
-    def _decode_obses(self, obs):
+    def _decode_obses(self):
         result = {}
         for k in self.obs_keys:
-
-            bufs = [b[k] for b in self.obs_bufs]
-            o = [np.frombuffer(b.get_obj(), dtype=self.obs_dtypes[k]).reshape(self.obs_shapes[k]) for b in bufs]
-            result[k] = np.array(o)
+            result[k] = _shared_np(self.obs_bufs[k], self.obs_dtypes[k], (self.num_envs,) + self.obs_shapes[k]).copy()
         return dict_to_obs(result)
 
 
-def _subproc_worker(pipe, parent_pipe, env_fn_wrapper, obs_bufs, obs_shapes, obs_dtypes, keys):
+def _shared_np(buf, dtype, shape):
+    return np.frombuffer(buf.get_obj(), dtype=dtype).reshape(shape)
+
+
+def _spin_acquire(sem, proc=None):
+    """
+    Acquire a semaphore, polling it for _SPIN_TIME seconds
+    before blocking on it. If proc is given, return False
+    instead of blocking forever when proc dies.
+    """
+    deadline = time.perf_counter() + _SPIN_TIME
+    while time.perf_counter() < deadline:
+        if sem.acquire(False):
+            return True
+    if proc is None:
+        sem.acquire()
+        return True
+    while not sem.acquire(timeout=_LIVENESS_CHECK_TIME):
+        if not proc.is_alive():
+            # the worker may have released the semaphore right before exiting
+            return sem.acquire(False)
+    return True
+
+
+class _ParentProcess(object):
+    """
+    The process that started a worker, which a worker
+    waiting with _spin_acquire checks to be alive.
+    """
+
+    def __init__(self):
+        self._pid = os.getppid()
+
+    def is_alive(self):
+        # orphans are adopted by another process
+        return os.getppid() == self._pid
+
+
+def _subproc_worker(pipe, parent_pipe, env_fn_wrappers, obs_bufs, obs_shapes, obs_dtypes, keys, worker_idx, env_slice,
+                    step_bufs, sync_bufs):
     """
-    Control a single environment instance using IPC and
-    shared memory.
+    Control the environment instances env_slice, in series,
+    using IPC and shared memory.
     """
-    def _write_obs(maybe_dict_obs):
+    act_buf, act_shape, act_dtype, rew_buf, done_buf = step_bufs
+    if act_buf is not None:
+        act_np = _shared_np(act_buf, act_dtype, (-1,) + act_shape)[env_slice]
+    rew_np = _shared_np(rew_buf, np.float32, (-1,))[env_slice]
+    done_np = _shared_np(done_buf, np.bool_, (-1,))[env_slice]
+    obs_nps = {k: _shared_np(obs_bufs[k], obs_dtypes[k], (-1,) + obs_shapes[k])[env_slice] for k in keys}
+
+    def _write_obs(i, maybe_dict_obs):
         flatdict = obs_to_dict(maybe_dict_obs)
         for k in keys:
-            dst = obs_bufs[k].get_obj()
-            dst_np = np.frombuffer(dst, dtype=obs_dtypes[k]).reshape(obs_shapes[k])  # pylint: disable=W0212
-            np.copyto(dst_np, flatdict[k])
+            np.copyto(obs_nps[k][i, ...], flatdict[k])
 
-    env = env_fn_wrapper.x()
+    envs = [env_fn() for env_fn in env_fn_wrappers.x]
     parent_pipe.close()
+    parent = _ParentProcess()
     try:
         while True:
-            cmd, data = pipe.recv()
+            if sync_bufs is None:
+                cmd, data = pipe.recv()
+            else:
+                cmd_buf, info_buf, cmd_sems, done_sems = sync_bufs
+                if not _spin_acquire(cmd_sems[worker_idx], parent):
+                    # the parent died without closing the envs, don't wait for it forever
+                    break
+                cmd, data = ('step', None) if cmd_buf[worker_idx] == _CMD_STEP else pipe.recv()
             if cmd == 'reset':
-                pipe.send(_write_obs(env.reset()))
+                for i, env in enumerate(envs):
+                    _write_obs(i, env.reset())
+                pipe.send(None)
             elif cmd == 'step':
-                obs, reward, done, info = env.step(data)
-                if done:
-                    obs = env.reset()
-                pipe.send((_write_obs(obs), reward, done, info))
+                infos = []
+                for i, env in enumerate(envs):
+                    # copy the action, the env may keep it around after the shared array is overwritten
+                    action = act_np[i].copy() if data is None else data[i]
+                    obs, reward, done, info = env.step(action)
+                    if done:
+                        obs = env.reset()
+                    _write_obs(i, obs)
+                    rew_np[i] = reward
+                    done_np[i] = done
+                    infos.append(info)
+                infos = pickle.dumps(infos) if any(infos) or done_np.any() else b''
+                if sync_bufs is None:
+                    pipe.send_bytes(infos)
+                else:
+                    info_buf[worker_idx] = bool(infos)
+                    if infos:
+                        pipe.send_bytes(infos)
+                    done_sems[worker_idx].release()
             elif cmd == 'render':
-                pipe.send(env.render(mode='rgb_array'))
+                pipe.send([env.render(mode='rgb_array') for env in envs])
             elif cmd == 'close':
                 pipe.send(None)
                 break
@@ -138,4 +333,5 @@ def _subproc_worker(pipe, parent_pipe, env_fn_wrapper, obs_bufs, obs_shapes, obs
     except KeyboardInterrupt:
         print('ShmemVecEnv worker: got KeyboardInterrupt')
     finally:
-        env.close()
+        for env in envs:
+            env.close()
@@ -2,6 +2,7 @@ import multiprocessing as mp
 
 import numpy as np
 from .vec_env import VecEnv, CloudpickleWrapper, clear_mpi_env_vars
+from baselines import logger
 
 
 def worker(remote, parent_remote, env_fn_wrappers):
@@ -41,47 +42,95 @@ class SubprocVecEnv(VecEnv):
     VecEnv that runs multiple environments in parallel in subproceses and communicates with them via pipes.
     Recommended to use when num_envs > 1 and step() can be a bottleneck.
     """
-    def __init__(self, env_fns, spaces=None, context='spawn', in_series=1):
+    def __init__(self, env_fns, spaces=None, context='spawn', in_series=1, restart_on_crash=False):
         """
         Arguments:
 
         env_fns: iterable of callables -  functions that create environments to run in subprocesses. Need to be cloud-pickleable
         in_series: number of environments to run in series in a single process
         (e.g. when len(env_fns) == 12 and in_series == 3, it will run 4 processes, each running 3 envs in series)
+        restart_on_crash: if True, a subprocess that dies (e.g. segfault or OOM in the env) is started again
+        with fresh envs, which are reported as done with info['worker_restarted'] = True
         """
         self.waiting = False
         self.closed = False
         self.in_series = in_series
+        self.restart_on_crash = restart_on_crash
         nenvs = len(env_fns)
         assert nenvs % in_series == 0, "Number of envs must be divisible by number of envs to run in series"
         self.nremotes = nenvs // in_series
-        env_fns = np.array_split(env_fns, self.nremotes)
-        ctx = mp.get_context(context)
-        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(self.nremotes)])
-        self.ps = [ctx.Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
-                   for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)]
-        for p in self.ps:
-            p.daemon = True  # if the main process crashes, we should not cause things to hang
-            with clear_mpi_env_vars():
-                p.start()
-        for remote in self.work_remotes:
-            remote.close()
+        self.env_fns = [CloudpickleWrapper(env_fn) for env_fn in np.array_split(env_fns, self.nremotes)]
+        self.ctx = mp.get_context(context)
+        self.remotes = [None] * self.nremotes
+        self.ps = [None] * self.nremotes
+        for remote_idx in range(self.nremotes):
+            self._start_worker(remote_idx)
+        self.crashed = set()
+        self.restarts = [0] * self.nremotes
 
         self.remotes[0].send(('get_spaces_spec', None))
         observation_space, action_space, self.spec = self.remotes[0].recv().x
         self.viewer = None
         VecEnv.__init__(self, nenvs, observation_space, action_space)
 
+    def _start_worker(self, remote_idx):
+        remote, work_remote = self.ctx.Pipe()
+        p = self.ctx.Process(target=worker, args=(work_remote, remote, self.env_fns[remote_idx]))
+        p.daemon = True  # if the main process crashes, we should not cause things to hang
+        with clear_mpi_env_vars():
+            p.start()
+        work_remote.close()
+        self.remotes[remote_idx], self.ps[remote_idx] = remote, p
+
+    def _restart_worker(self, remote_idx):
+        """
+        Replace a dead subprocess by a new one, and return the observations of its reset envs.
+        """
+        self.remotes[remote_idx].close()
+        self.ps[remote_idx].join()
+        self.restarts[remote_idx] += 1
+        logger.warn('SubprocVecEnv: worker {} died with exit code {}, restarting it ({} restarts in total)'.format(
+            remote_idx, self.ps[remote_idx].exitcode, sum(self.restarts)))
+        self._start_worker(remote_idx)
+        self.remotes[remote_idx].send(('reset', None))
+        return self.remotes[remote_idx].recv()
+
+    def _send(self, remote_idx, msg):
+        try:
+            self.remotes[remote_idx].send(msg)
+        except ConnectionError:
+            if not self.restart_on_crash:
+                raise
+            self.crashed.add(remote_idx)
+
+    def _recv(self, remote_idx):
+        """
+        Receive the reply of a subprocess, or None if it died and was restarted.
+        """
+        if remote_idx not in self.crashed:
+            try:
+                return self.remotes[remote_idx].recv()
+            except (EOFError, ConnectionError):
+                if not self.restart_on_crash:
+                    raise
+        self.crashed.discard(remote_idx)
+        return None
+
     def step_async(self, actions):
         self._assert_not_closed()
         actions = np.array_split(actions, self.nremotes)
-        for remote, action in zip(self.remotes, actions):
-            remote.send(('step', action))
+        for remote_idx, action in enumerate(actions):
+            self._send(remote_idx, ('step', action))
         self.waiting = True
 
     def step_wait(self):
         self._assert_not_closed()
-        results = [remote.recv() for remote in self.remotes]
+        results = []
+        for remote_idx in range(self.nremotes):
+            result = self._recv(remote_idx)
+            if result is None:
+                result = [(ob, 0.0, True, {'worker_restarted': True}) for ob in self._restart_worker(remote_idx)]
+            results.append(result)
         results = _flatten_list(results)
         self.waiting = False
         obs, rews, dones, infos = zip(*results)
@@ -89,19 +138,22 @@ class SubprocVecEnv(VecEnv):
 
     def reset(self):
         self._assert_not_closed()
-        for remote in self.remotes:
-            remote.send(('reset', None))
-        obs = [remote.recv() for remote in self.remotes]
+        for remote_idx in range(self.nremotes):
+            self._send(remote_idx, ('reset', None))
+        obs = []
+        for remote_idx in range(self.nremotes):
+            ob = self._recv(remote_idx)
+            obs.append(self._restart_worker(remote_idx) if ob is None else ob)
         obs = _flatten_list(obs)
         return _flatten_obs(obs)
 
     def close_extras(self):
         self.closed = True
         if self.waiting:
-            for remote in self.remotes:
-                remote.recv()
-        for remote in self.remotes:
-            remote.send(('close', None))
+            for remote_idx in range(self.nremotes):
+                self._recv(remote_idx)
+        for remote_idx in range(self.nremotes):
+            self._send(remote_idx, ('close', None))
         for p in self.ps:
             p.join()
 
@@ -2,12 +2,21 @@
 Tests for asynchronous vectorized environments.
 """
 
+import multiprocessing as mp
+import os
+import time
+
 import gym
 import numpy as np
 import pytest
+from .async_vec_env import AsyncVecEnv
 from .dummy_vec_env import DummyVecEnv
+from .remote_vec_env import RemoteVecEnv, start_env_server
 from .shmem_vec_env import ShmemVecEnv
 from .subproc_vec_env import SubprocVecEnv
+from .threaded_vec_env import ThreadedVecEnv
+from .vec_frame_stack import VecFrameStack
+from baselines.common.tests import mark_slow
 from baselines.common.tests.test_with_mpi import with_mpi
 
 
@@ -44,7 +53,7 @@ def assert_venvs_equal(venv1, venv2, num_steps):
         venv2.close()
 
 
-@pytest.mark.parametrize('klass', (ShmemVecEnv, SubprocVecEnv))
+@pytest.mark.parametrize('klass', (AsyncVecEnv, ShmemVecEnv, SubprocVecEnv, ThreadedVecEnv))
 @pytest.mark.parametrize('dtype', ('uint8', 'float32'))
 def test_vec_env(klass, dtype):  # pylint: disable=R0914
     """
@@ -67,12 +76,13 @@ def test_vec_env(klass, dtype):  # pylint: disable=R0914
     assert_venvs_equal(env1, env2, num_steps=num_steps)
 
 
+@pytest.mark.parametrize('klass', (ShmemVecEnv, SubprocVecEnv))
 @pytest.mark.parametrize('dtype', ('uint8', 'float32'))
 @pytest.mark.parametrize('num_envs_in_series', (3, 4, 6))
-def test_sync_sampling(dtype, num_envs_in_series):
+def test_sync_sampling(klass, dtype, num_envs_in_series):
     """
-    Test that a SubprocVecEnv running with envs in series
-    outputs the same as DummyVecEnv.
+    Test that a SubprocVecEnv or ShmemVecEnv running with envs
+    in series outputs the same as DummyVecEnv.
     """
     num_envs = 12
     num_steps = 100
@@ -85,7 +95,7 @@ def test_sync_sampling(dtype, num_envs_in_series):
         return lambda: SimpleEnv(seed, shape, dtype)
     fns = [make_fn(i) for i in range(num_envs)]
     env1 = DummyVecEnv(fns)
-    env2 = SubprocVecEnv(fns, in_series=num_envs_in_series)
+    env2 = klass(fns, in_series=num_envs_in_series)
     assert_venvs_equal(env1, env2, num_steps=num_steps)
 
 
@@ -111,6 +121,357 @@ def test_sync_sampling_sanity(dtype, num_envs_in_series):
     assert_venvs_equal(env1, env2, num_steps=num_steps)
 
 
+@pytest.mark.parametrize('dtype', ('uint8', 'float32'))
+def test_shmem_spin_sync(dtype):
+    """
+    Test that ShmemVecEnv signaling through semaphores
+    is equivalent to DummyVecEnv.
+    """
+    shape = (3, 8)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, dtype) for seed in range(3)]
+    assert_venvs_equal(DummyVecEnv(fns), ShmemVecEnv(fns, sync='spin'), num_steps=100)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, dtype) for seed in range(6)]
+    assert_venvs_equal(DummyVecEnv(fns), ShmemVecEnv(fns, sync='spin', in_series=2), num_steps=100)
+
+
+@mark_slow
+def test_vec_env_throughput():
+    """
+    Print the steps per second of the vectorized environments
+    on SimpleEnv, where the step round trip dominates.
+    """
+    num_envs = 32
+    num_steps = 500
+    shape = (4,)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, 'float32') for seed in range(num_envs)]
+    actions = np.zeros((num_envs,) + shape, dtype='float32')
+    for name, make_venv in [('DummyVecEnv', lambda: DummyVecEnv(fns)),
+                            ('SubprocVecEnv', lambda: SubprocVecEnv(fns)),
+                            ('ShmemVecEnv pipe', lambda: ShmemVecEnv(fns)),
+                            ('ShmemVecEnv spin', lambda: ShmemVecEnv(fns, sync='spin'))]:
+        venv = make_venv()
+        try:
+            venv.reset()
+            tstart = time.time()
+            for _ in range(num_steps):
+                venv.step(actions)
+            print('{}: {:.0f} steps/s ({} envs)'.format(name, num_steps * num_envs / (time.time() - tstart), num_envs))
+        finally:
+            venv.close()
+
+
+@pytest.mark.parametrize('nthreads', (1, 2, 5))
+def test_threaded_vec_env_nthreads(nthreads):
+    """
+    Test that ThreadedVecEnv matches DummyVecEnv when several
+    envs are stepped in series by each thread.
+    """
+    shape = (3, 8)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, 'float32') for seed in range(5)]
+    assert_venvs_equal(DummyVecEnv(fns), ThreadedVecEnv(fns, nthreads=nthreads), num_steps=20)
+
+
+@mark_slow
+def test_threaded_vec_env_throughput():
+    """
+    Print the steps per second of the vectorized environments
+    on an env whose step releases the GIL.
+    """
+    num_envs = 16
+    num_steps = 200
+    shape = (4,)
+    fns = [lambda seed=seed: GilReleasingEnv(seed, shape, 'float32') for seed in range(num_envs)]
+    actions = np.zeros((num_envs,) + shape, dtype='float32')
+    for name, make_venv in [('DummyVecEnv', lambda: DummyVecEnv(fns)),
+                            ('SubprocVecEnv', lambda: SubprocVecEnv(fns)),
+                            ('ThreadedVecEnv', lambda: ThreadedVecEnv(fns))]:
+        venv = make_venv()
+        try:
+            venv.reset()
+            tstart = time.time()
+            for _ in range(num_steps):
+                venv.step(actions)
+            print('{}: {:.0f} steps/s ({} envs)'.format(name, num_steps * num_envs / (time.time() - tstart), num_envs))
+        finally:
+            venv.close()
+
+
+@pytest.mark.parametrize('make_venv', (lambda fns, **kwargs: SubprocVecEnv(fns, in_series=2, **kwargs),
+                                       lambda fns, **kwargs: ShmemVecEnv(fns, in_series=2, **kwargs),
+                                       lambda fns, **kwargs: ShmemVecEnv(fns, in_series=2, sync='spin', **kwargs)))
+def test_restart_on_crash(make_venv):
+    """
+    Test that the envs of a worker that dies are restarted
+    and reported as done, while the other envs keep going.
+    """
+    num_envs = 4
+    shape = (3, 8)
+    fns = [lambda seed=seed: CrashingEnv(seed, shape, 'float32') for seed in range(num_envs)]
+    env1 = DummyVecEnv(fns)
+    env2 = make_venv(fns, restart_on_crash=True)
+    try:
+        env1.reset()
+        env2.reset()
+        actions = np.ones((num_envs,) + shape, dtype='float32')
+        env1.step(actions)
+        env2.step(actions)
+        expected = env1.step(actions)
+        actions[1] = -1
+        obs, rews, dones, infos = env2.step(actions)
+        assert list(dones[:2]) == [True, True]
+        assert all(info.get('worker_restarted') for info in infos[:2])
+        assert not any('worker_restarted' in info for info in infos[2:])
+        for seed in range(2):
+            assert np.array_equal(obs[seed], CrashingEnv(seed, shape, 'float32').reset())
+        assert np.array_equal(obs[2:], expected[0][2:])
+        assert env2.restarts == [1, 0]
+        actions[1] = 1
+        env2.step(actions)
+    finally:
+        env1.close()
+        env2.close()
+
+
+def test_crash_without_restart():
+    """
+    Test that a worker dying fails the step when restart_on_crash is not set.
+    """
+    shape = (3, 8)
+    env = SubprocVecEnv([lambda seed=seed: CrashingEnv(seed, shape, 'float32') for seed in range(2)])
+    env.reset()
+    actions = -np.ones((2,) + shape, dtype='float32')
+    env.step_async(actions)
+    with pytest.raises(EOFError):
+        env.step_wait()
+    # the workers are gone, there is nothing left to close
+    env.closed = True
+
+
+def _orphan_spin_workers(path):
+    venv = ShmemVecEnv([lambda seed=seed: ClosedFileEnv(seed, path) for seed in range(2)], sync='spin')
+    venv.reset()
+    os._exit(0)
+
+
+def test_shmem_spin_orphaned_workers(tmpdir):
+    """
+    Test that spinning workers exit when their parent dies without closing them.
+    """
+    parent = mp.get_context('spawn').Process(target=_orphan_spin_workers, args=(str(tmpdir),))
+    parent.start()
+    parent.join()
+    deadline = time.time() + 30
+    while len(tmpdir.listdir()) < 2 and time.time() < deadline:
+        time.sleep(0.1)
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['0', '1']
+
+
+@pytest.mark.parametrize('dtype', ('uint8', 'float32'))
+def test_remote_vec_env(dtype):
+    """
+    Test that a RemoteVecEnv with env servers on localhost
+    outputs the same as DummyVecEnv.
+    """
+    num_envs = 6
+    shape = (3, 8)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, dtype) for seed in range(num_envs)]
+    servers = [start_env_server(fns[i:i + 3]) for i in range(0, num_envs, 3)]
+    try:
+        assert_venvs_equal(DummyVecEnv(fns), RemoteVecEnv([address for _, address in servers]), num_steps=100)
+    finally:
+        for p, _ in servers:
+            p.join()
+
+
+@mark_slow
+def test_remote_vec_env_throughput():
+    """
+    Print the steps per second of SubprocVecEnv and RemoteVecEnv
+    with env servers on localhost.
+    """
+    num_envs = 16
+    num_steps = 500
+    shape = (84, 84)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, 'uint8') for seed in range(num_envs)]
+    actions = np.zeros((num_envs,) + shape, dtype='uint8')
+    for name, nservers in [('SubprocVecEnv', None), ('RemoteVecEnv 1 server', 1), ('RemoteVecEnv 4 servers', 4)]:
+        servers = []
+        if nservers is None:
+            venv = SubprocVecEnv(fns)
+        else:
+            per_server = num_envs // nservers
+            servers = [start_env_server(fns[i:i + per_server]) for i in range(0, num_envs, per_server)]
+            venv = RemoteVecEnv([address for _, address in servers])
+        try:
+            venv.reset()
+            tstart = time.time()
+            for _ in range(num_steps):
+                venv.step(actions)
+            print('{}: {:.0f} steps/s ({} envs)'.format(name, num_steps * num_envs / (time.time() - tstart), num_envs))
+        finally:
+            venv.close()
+            for p, _ in servers:
+                p.join()
+
+
+class _RollFrameStack(object):
+    """
+    VecFrameStack as it was before keeping the frames in a ring buffer.
+    """
+
+    def __init__(self, venv, nstack):
+        self.venv = venv
+        self.stackedobs = np.zeros((venv.num_envs,) + venv.observation_space.shape[:-1] +
+                                   (venv.observation_space.shape[-1] * nstack,), venv.observation_space.dtype)
+
+    def step(self, actions):
+        obs, rews, news, infos = self.venv.step(actions)
+        # roll by a whole frame, the original rolled by one channel
+        self.stackedobs = np.roll(self.stackedobs, shift=-obs.shape[-1], axis=-1)
+        for (i, new) in enumerate(news):
+            if new:
+                self.stackedobs[i] = 0
+        self.stackedobs[..., -obs.shape[-1]:] = obs
+        return self.stackedobs, rews, news, infos
+
+    def reset(self):
+        obs = self.venv.reset()
+        self.stackedobs[...] = 0
+        self.stackedobs[..., -obs.shape[-1]:] = obs
+        return self.stackedobs
+
+
+@pytest.mark.parametrize('shape', ((3, 8), (5, 4, 2)))
+def test_vec_frame_stack(shape):
+    """
+    Test that VecFrameStack matches stacking with np.roll,
+    and that the observations it returns are not modified later.
+    """
+    num_envs, nstack = 4, 3
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, 'float32') for seed in range(num_envs)]
+    expected_env = _RollFrameStack(DummyVecEnv(fns), nstack)
+    env = VecFrameStack(DummyVecEnv(fns), nstack)
+    assert np.array_equal(expected_env.reset(), env.reset())
+    assert np.array_equal(env.stackedobs, expected_env.stackedobs)
+    history = []
+    for _ in range(10):
+        actions = np.random.randint(0, 3, size=(num_envs,) + shape).astype('float32')
+        expected = expected_env.step(actions)[0]
+        obs = env.step(actions)[0]
+        assert np.array_equal(obs, expected)
+        assert env.stackedobs is obs
+        view, order = env.stacked_view()
+        assert np.array_equal(np.concatenate([view[..., slot, :] for slot in order], axis=-1), expected)
+        history.append((obs, expected.copy()))
+    for obs, expected in history:
+        assert np.array_equal(obs, expected)
+
+
+@mark_slow
+def test_vec_frame_stack_throughput():
+    """
+    Print the time of stacking Atari frames with np.roll
+    and with VecFrameStack.
+    """
+    num_envs, nstack, num_steps = 16, 4, 200
+    fns = [lambda seed=seed: SimpleEnv(seed, (84, 84, 1), 'uint8') for seed in range(num_envs)]
+    actions = np.zeros((num_envs, 84, 84, 1), dtype='uint8')
+    venv = DummyVecEnv(fns)
+    venv.reset()
+    tstart = time.time()
+    for _ in range(num_steps):
+        venv.step(actions)
+    env_time = time.time() - tstart
+    for name, env in [('np.roll', _RollFrameStack(DummyVecEnv(fns), nstack)),
+                      ('VecFrameStack', VecFrameStack(DummyVecEnv(fns), nstack))]:
+        env.reset()
+        tstart = time.time()
+        for _ in range(num_steps):
+            env.step(actions)
+        print('{}: {:.1f} us per step ({} envs)'.format(name, (time.time() - tstart - env_time) / num_steps * 1e6, num_envs))
+
+
+def test_async_step_recv():
+    """
+    Test that the envs of an AsyncVecEnv stepped separately
+    produce the same results as DummyVecEnv.
+    """
+    num_envs = 4
+    shape = (3, 8)
+    fns = [lambda seed=seed: SimpleEnv(seed, shape, 'float32') for seed in range(num_envs)]
+    env1 = DummyVecEnv(fns)
+    env2 = AsyncVecEnv(fns)
+    try:
+        env1.reset()
+        env2.reset()
+        actions = np.ones((num_envs,) + shape, dtype='float32')
+        expected = env1.step(actions)
+        env2.step_send(actions[[3, 1]], [3, 1])
+        env2.step_send(actions[[0, 2]], [0, 2])
+        results = {}
+        while len(results) < num_envs:
+            obs, rews, dones, infos, env_ids = env2.step_recv(1)
+            assert len(env_ids) >= 1
+            for i, env_id in enumerate(env_ids):
+                results[env_id] = (obs[i], rews[i], dones[i], infos[i])
+        for env_id in range(num_envs):
+            for out1, out2 in zip(expected[:3], results[env_id][:3]):
+                assert np.allclose(out1[env_id], out2)
+            assert expected[3][env_id] == results[env_id][3]
+    finally:
+        env1.close()
+        env2.close()
+
+
+@mark_slow
+def test_async_vec_env_throughput():
+    """
+    Print the steps per second of SubprocVecEnv and AsyncVecEnv
+    with step times that have a long tail.
+    """
+    num_envs = 8
+    duration = 3.0
+    shape = (4,)
+    fns = [lambda seed=seed: LongTailEnv(seed, shape, 'float32') for seed in range(num_envs)]
+    actions = np.zeros((num_envs,) + shape, dtype='float32')
+
+    venv = SubprocVecEnv(fns)
+    try:
+        venv.reset()
+        nsteps, tstart = 0, time.time()
+        while time.time() - tstart < duration:
+            venv.step(actions)
+            nsteps += num_envs
+        print('SubprocVecEnv: {:.0f} steps/s ({} envs)'.format(nsteps / (time.time() - tstart), num_envs))
+    finally:
+        venv.close()
+
+    for ready_k in (1, num_envs // 2):
+        venv = AsyncVecEnv(fns)
+        try:
+            venv.reset()
+            ready = np.arange(num_envs)
+            nsteps, tstart = 0, time.time()
+            while time.time() - tstart < duration:
+                venv.step_send(actions[ready], ready)
+                ready = venv.step_recv(ready_k)[-1]
+                nsteps += len(ready)
+            print('AsyncVecEnv ready_k={}: {:.0f} steps/s ({} envs)'.format(
+                ready_k, nsteps / (time.time() - tstart), num_envs))
+        finally:
+            venv.close()
+
+
+def test_shmem_empty_infos():
+    """
+    Test that ShmemVecEnv matches DummyVecEnv when infos are
+    only returned at the end of episodes.
+    """
+    shape = (3, 8)
+    fns = [lambda seed=seed: EpisodeInfoEnv(seed, shape, 'float32') for seed in range(3)]
+    assert_venvs_equal(DummyVecEnv(fns), ShmemVecEnv(fns), num_steps=20)
+
+
 class SimpleEnv(gym.Env):
     """
     An environment with a pre-determined observation space
@@ -146,6 +507,63 @@ class SimpleEnv(gym.Env):
         raise NotImplementedError
 
 
+class LongTailEnv(SimpleEnv):
+    """
+    A SimpleEnv whose steps usually take 1ms,
+    but take 30ms 5% of the time.
+    """
+
+    def step(self, action):
+        time.sleep(0.03 if np.random.rand() < 0.05 else 0.001)
+        return SimpleEnv.step(self, action)
+
+
+class GilReleasingEnv(SimpleEnv):
+    """
+    A SimpleEnv whose steps spend 1ms outside of the GIL,
+    like an env running a simulator in a C extension.
+    """
+
+    def step(self, action):
+        time.sleep(0.001)
+        return SimpleEnv.step(self, action)
+
+
+class CrashingEnv(SimpleEnv):
+    """
+    A SimpleEnv that kills its process when given negative
+    actions, like an env hitting a segfault.
+    """
+
+    def step(self, action):
+        if np.any(np.asarray(action) < 0):
+            os._exit(1)
+        return SimpleEnv.step(self, action)
+
+
+class EpisodeInfoEnv(SimpleEnv):
+    """
+    A SimpleEnv that only returns an info at the end of episodes.
+    """
+
+    def step(self, action):
+        obs, reward, done, info = SimpleEnv.step(self, action)
+        return obs, reward, done, info if done else {}
+
+
+class ClosedFileEnv(SimpleEnv):
+    """
+    A SimpleEnv that creates a file named after its seed in path when it is closed.
+    """
+
+    def __init__(self, seed, path):
+        SimpleEnv.__init__(self, seed, (2,), 'float32')
+        self._seed = seed
+        self._path = path
+
+    def close(self):
+        open(os.path.join(self._path, str(self._seed)), 'w').close()
+
 
 @with_mpi()
 def test_mpi_with_subprocvecenv():
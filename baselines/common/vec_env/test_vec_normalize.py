@@ -0,0 +1,118 @@
+"""
+Tests for VecNormalize.
+"""
+
+import time
+
+import gym
+import numpy as np
+import pytest
+from .dummy_vec_env import DummyVecEnv
+from .vec_normalize import VecNormalize
+from baselines.common.running_mean_std import RunningMeanStd
+from baselines.common.tests import mark_slow
+
+
+class RandomObsEnv(gym.Env):
+    """
+    An env with random observations and rewards,
+    and episodes of random length.
+    """
+
+    def __init__(self, seed, shape):
+        self.rng = np.random.RandomState(seed)
+        self.observation_space = gym.spaces.Box(low=-np.inf, high=np.inf, shape=shape, dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+
+    def reset(self):
+        return self._obs()
+
+    def step(self, action):
+        return self._obs(), self.rng.randn() * 5 + 1, self.rng.rand() < 0.05, {}
+
+    def _obs(self):
+        return (self.rng.randn(*self.observation_space.shape) * 3 + 2).astype(np.float32)
+
+
+class _ReferenceVecNormalize(object):
+    """
+    VecNormalize as it was before normalizing in place,
+    updating the statistics every update_every steps.
+    """
+
+    def __init__(self, venv, update_every=1, clipob=10., cliprew=10., gamma=0.99, epsilon=1e-8):
+        self.venv = venv
+        self.ob_rms = RunningMeanStd(shape=venv.observation_space.shape)
+        self.ret_rms = RunningMeanStd(shape=())
+        self.clipob, self.cliprew, self.gamma, self.epsilon = clipob, cliprew, gamma, epsilon
+        self.update_every = update_every
+        self.nsteps = 0
+        self.ret = np.zeros(venv.num_envs)
+
+    def step(self, actions):
+        obs, rews, news, infos = self.venv.step(actions)
+        self.ret = self.ret * self.gamma + rews
+        self.nsteps += 1
+        update = self.update_every > 0 and self.nsteps % self.update_every == 0
+        obs = self._obfilt(obs, update)
+        if update:
+            self.ret_rms.update_from_moments(np.mean(self.ret), np.var(self.ret), len(self.ret))
+        rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew, self.cliprew)
+        self.ret[news] = 0.
+        return obs, rews, news, infos
+
+    def _obfilt(self, obs, update):
+        if update:
+            self.ob_rms.update_from_moments(np.mean(obs, axis=0), np.var(obs, axis=0), obs.shape[0])
+        return np.clip((obs - self.ob_rms.mean) / np.sqrt(self.ob_rms.var + self.epsilon), -self.clipob, self.clipob)
+
+    def reset(self):
+        self.ret = np.zeros(self.venv.num_envs)
+        return self._obfilt(self.venv.reset(), self.update_every > 0)
+
+
+@pytest.mark.parametrize('update_every', (1, 3, 0))
+def test_vec_normalize_matches_reference(update_every):
+    """
+    Test that VecNormalize outputs exactly the same
+    as normalizing with temporaries.
+    """
+    num_envs, shape = 4, (5, 3)
+    fns = [lambda seed=seed: RandomObsEnv(seed, shape) for seed in range(num_envs)]
+    expected_env = _ReferenceVecNormalize(DummyVecEnv(fns), update_every=update_every)
+    env = VecNormalize(DummyVecEnv(fns), update_every=update_every)
+    assert np.array_equal(expected_env.reset(), env.reset())
+    actions = np.zeros(num_envs, dtype=np.int64)
+    for _ in range(50):
+        expected = expected_env.step(actions)
+        actual = env.step(actions)
+        for e, a in zip(expected[:3], actual[:3]):
+            assert e.dtype == a.dtype
+            assert np.array_equal(e, a)
+    assert np.array_equal(expected_env.ob_rms.var, env.ob_rms.var)
+    assert np.array_equal(expected_env.ret_rms.var, env.ret_rms.var)
+
+
+@mark_slow
+def test_vec_normalize_throughput():
+    """
+    Print the time VecNormalize takes per step
+    on high-dimensional observations.
+    """
+    num_envs, shape, num_steps = 16, (84 * 84,), 500
+    fns = [lambda seed=seed: RandomObsEnv(seed, shape) for seed in range(num_envs)]
+    actions = np.zeros(num_envs, dtype=np.int64)
+    for name, make_env in [('temporaries', lambda: _ReferenceVecNormalize(DummyVecEnv(fns))),
+                           ('in place', lambda: VecNormalize(DummyVecEnv(fns))),
+                           ('in place, update_every=10', lambda: VecNormalize(DummyVecEnv(fns), update_every=10))]:
+        env = make_env()
+        venv = env.venv
+        env.reset()
+        obs, rews, news, infos = venv.step(actions)
+        # time the normalization only, on the same step results
+        venv.step = lambda actions: (obs, rews, news, infos)
+        venv.step_wait = lambda: (obs, rews, news, infos)
+        tstart = time.time()
+        for _ in range(num_steps):
+            env.step(actions)
+        print('{}: {:.1f} us per step ({} envs, shape {})'.format(name, (time.time() - tstart) / num_steps * 1e6, num_envs, shape))
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from .dummy_vec_env import DummyVecEnv
+
+
+class ThreadedVecEnv(DummyVecEnv):
+    """
+    VecEnv that steps the environments on a pool of threads, in the same process.
+    The observations are written straight into the batched buffers of DummyVecEnv.
+    Useful when env.step releases the GIL (C extension simulators, Atari, NumPy heavy envs),
+    since it avoids both the serial stepping of DummyVecEnv and the inter-process
+    communication of SubprocVecEnv.
+    """
+    def __init__(self, env_fns, nthreads=None):
+        """
+        Arguments:
+
+        env_fns: iterable of callables      functions that build environments
+        nthreads: number of threads stepping the environments, one per env by default.
+        The envs are split in nthreads contiguous chunks, each stepped in series by one thread.
+        """
+        super().__init__(env_fns)
+        self.nthreads = min(nthreads or self.num_envs, self.num_envs)
+        self.chunks = np.array_split(np.arange(self.num_envs), self.nthreads)
+        self.pool = ThreadPoolExecutor(max_workers=self.nthreads)
+        self.futures = None
+
+    def step_async(self, actions):
+        super().step_async(actions)
+        self.futures = [self.pool.submit(self._step_chunk, chunk) for chunk in self.chunks]
+
+    def step_wait(self):
+        futures, self.futures = self.futures, None
+        for future in futures:
+            future.result()
+        return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones),
+                self.buf_infos.copy())
+
+    def reset(self):
+        for future in [self.pool.submit(self._reset_chunk, chunk) for chunk in self.chunks]:
+            future.result()
+        return self._obs_from_buf()
+
+    def close_extras(self):
+        if self.futures is not None:
+            self.step_wait()
+        self.pool.shutdown()
+
+    def _step_chunk(self, chunk):
+        for e in chunk:
+            obs, self.buf_rews[e], self.buf_dones[e], self.buf_infos[e] = self.envs[e].step(self.actions[e])
+            if self.buf_dones[e]:
+                obs = self.envs[e].reset()
+            self._save_obs(e, obs)
+
+    def _reset_chunk(self, chunk):
+        for e in chunk:
+            self._save_obs(e, self.envs[e].reset())
@@ -4,6 +4,11 @@ from gym import spaces
 
 
 class VecFrameStack(VecEnvWrapper):
+    """
+    Stacks the last nstack observations of each env along the last axis.
+    The frames are kept in a ring buffer, so that a step only writes the newest frame,
+    and the stacked observations are assembled from it by a single concatenation.
+    """
     def __init__(self, venv, nstack):
         self.venv = venv
         self.nstack = nstack
@@ -11,20 +16,42 @@ class VecFrameStack(VecEnvWrapper):
         low = np.repeat(wos.low, self.nstack, axis=-1)
         high = np.repeat(wos.high, self.nstack, axis=-1)
         self.stackedobs = np.zeros((venv.num_envs,) + low.shape, low.dtype)
+        # frames[slot] holds one frame of each env, the newest one is in slot head
+        self.frames = np.zeros((nstack, venv.num_envs) + wos.shape, low.dtype)
+        self.head = nstack - 1
         observation_space = spaces.Box(low=low, high=high, dtype=venv.observation_space.dtype)
         VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
 
     def step_wait(self):
         obs, rews, news, infos = self.venv.step_wait()
-        self.stackedobs = np.roll(self.stackedobs, shift=-1, axis=-1)
-        for (i, new) in enumerate(news):
-            if new:
-                self.stackedobs[i] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
-        return self.stackedobs, rews, news, infos
+        self.head = (self.head + 1) % self.nstack
+        self.frames[:, np.asarray(news, dtype=bool)] = 0
+        self.frames[self.head] = obs
+        return self._stack(), rews, news, infos
 
     def reset(self):
         obs = self.venv.reset()
-        self.stackedobs[...] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
+        self.frames[...] = 0
+        self.head = self.nstack - 1
+        self.frames[self.head] = obs
+        return self._stack()
+
+    def frame_order(self):
+        """
+        Slots of the ring buffer from the oldest frame to the newest one.
+        """
+        return (np.arange(1, self.nstack + 1) + self.head) % self.nstack
+
+    def stacked_view(self):
+        """
+        Return the stacked observations without copying them, for consumers that accept frames
+        out of order: (obs, order), where obs[..., slot, :] is the frame in ring buffer slot slot,
+        and order lists the slots from the oldest frame to the newest one.
+        obs is overwritten by the next steps.
+        """
+        return np.moveaxis(self.frames, 0, -2), self.frame_order()
+
+    def _stack(self):
+        # a new array every step, consumers may keep views of the previous observations
+        self.stackedobs = np.concatenate([self.frames[slot] for slot in self.frame_order()], axis=-1)
         return self.stackedobs
@@ -5,9 +5,13 @@ class VecNormalize(VecEnvWrapper):
     """
     A vectorized wrapper that normalizes the observations
     and returns from an environment.
+
+    update_every: the statistics are updated every update_every steps, or never if 0
+    (e.g. set it to 0 to freeze them for evaluation).
     """
 
-    def __init__(self, venv, ob=True, ret=True, clipob=10., cliprew=10., gamma=0.99, epsilon=1e-8, use_tf=False):
+    def __init__(self, venv, ob=True, ret=True, clipob=10., cliprew=10., gamma=0.99, epsilon=1e-8, use_tf=False,
+                 update_every=1):
         VecEnvWrapper.__init__(self, venv)
         if use_tf:
             from baselines.common.running_mean_std import TfRunningMeanStd
@@ -22,26 +26,50 @@ class VecNormalize(VecEnvWrapper):
         self.ret = np.zeros(self.num_envs)
         self.gamma = gamma
         self.epsilon = epsilon
+        self.update_every = update_every
+        self.nsteps = 0
+        # the variance each std was computed from, by running mean std
+        self._stds = {}
 
     def step_wait(self):
         obs, rews, news, infos = self.venv.step_wait()
-        self.ret = self.ret * self.gamma + rews
-        obs = self._obfilt(obs)
+        self.ret *= self.gamma
+        self.ret += rews
+        self.nsteps += 1
+        update = self.update_every > 0 and self.nsteps % self.update_every == 0
+        obs = self._obfilt(obs, update)
         if self.ret_rms:
-            self.ret_rms.update(self.ret)
-            rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew, self.cliprew)
+            if update:
+                self.ret_rms.update(self.ret)
+            rews = rews / self._std(self.ret_rms)
+            np.clip(rews, -self.cliprew, self.cliprew, out=rews)
         self.ret[news] = 0.
         return obs, rews, news, infos
 
-    def _obfilt(self, obs):
+    def _obfilt(self, obs, update=True):
         if self.ob_rms:
-            self.ob_rms.update(obs)
-            obs = np.clip((obs - self.ob_rms.mean) / np.sqrt(self.ob_rms.var + self.epsilon), -self.clipob, self.clipob)
-            return obs
+            if update:
+                self.ob_rms.update(obs)
+            # one new array for the result, the rest is done in place
+            out = np.subtract(obs, self.ob_rms.mean)
+            np.divide(out, self._std(self.ob_rms), out=out)
+            np.clip(out, -self.clipob, self.clipob, out=out)
+            return out
         else:
             return obs
 
+    def _std(self, rms):
+        """
+        sqrt(rms.var + epsilon), computed again only when rms.var is replaced,
+        which running mean stds do when they are updated.
+        """
+        var, std = self._stds.get(id(rms), (None, None))
+        if var is not rms.var:
+            var, std = rms.var, np.sqrt(rms.var + self.epsilon)
+            self._stds[id(rms)] = var, std
+        return std
+
     def reset(self):
         self.ret = np.zeros(self.num_envs)
         obs = self.venv.reset()
-        return self._obfilt(obs)
+        return self._obfilt(obs, self.update_every > 0)
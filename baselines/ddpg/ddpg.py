@@ -8,6 +8,8 @@ from baselines.ddpg.models import Actor, Critic
 from baselines.ddpg.memory import Memory
 from baselines.ddpg.noise import AdaptiveParamNoiseSpec, NormalActionNoise, OrnsteinUhlenbeckActionNoise
 from baselines.common import set_global_seeds
+from baselines.common.memmap_storage import MemmapStorage
+from baselines.common.prefetching_sampler import PrefetchingSampler
 import baselines.common.tf_util as U
 
 from baselines import logger
@@ -42,6 +44,9 @@ def learn(network, env,
           tau=0.01,
           eval_env=None,
           param_noise_adaption_interval=50,
+          replay_memmap=False, # keep the replay memory in np.memmap files under the logger dir
+          replay_memmap_cache=0, # number of most recently added transitions to also keep in memory
+          replay_prefetch=0, # number of batches to sample ahead in a background thread
           **network_kwargs):
 
     set_global_seeds(seed)
@@ -60,7 +65,10 @@ def learn(network, env,
     nb_actions = env.action_space.shape[-1]
     assert (np.abs(env.action_space.low) == env.action_space.high).all()  # we assume symmetric actions.
 
-    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape)
+    memmap = None
+    if replay_memmap:
+        memmap = MemmapStorage(os.path.join(logger.get_dir(), 'replay_buffer_{}'.format(rank)), cache_size=replay_memmap_cache)
+    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape, memmap=memmap)
     critic = Critic(network=network, **network_kwargs)
     actor = Actor(nb_actions, network=network, **network_kwargs)
 
@@ -91,6 +99,8 @@ def learn(network, env,
         batch_size=batch_size, action_noise=action_noise, param_noise=param_noise, critic_l2_reg=critic_l2_reg,
         actor_lr=actor_lr, critic_lr=critic_lr, enable_popart=popart, clip_norm=clip_norm,
         reward_scale=reward_scale)
+    if replay_prefetch > 0:
+        agent.sampler = PrefetchingSampler(lambda: memory.sample(batch_size=batch_size), nprefetch=replay_prefetch)
     logger.info('Using agent with the following configuration:')
     logger.info(str(agent.__dict__.items()))
 
@@ -152,7 +162,7 @@ def learn(network, env,
                 # Book-keeping.
                 epoch_actions.append(action)
                 epoch_qs.append(q)
-                agent.store_transition(obs, action, r, new_obs, done) #the batched data will be unrolled in memory.py's append.
+                agent.store_transition(obs, action, r, new_obs, done) #the batched data is appended to memory in one go by memory.py's append_batch.
 
                 obs = new_obs
 
@@ -229,6 +239,8 @@ def learn(network, env,
         combined_stats['total/duration'] = duration
         combined_stats['total/steps_per_second'] = float(t) / float(duration)
         combined_stats['total/episodes'] = episodes
+        if agent.sampler is not None:
+            combined_stats['train/sample_wait_time'] = agent.sampler.pop_wait_time()
         combined_stats['rollout/episodes'] = epoch_episodes
         combined_stats['rollout/actions_std'] = np.std(epoch_actions)
         # Evaluation statistics.
@@ -262,6 +274,8 @@ def learn(network, env,
         if rank == 0:
             logger.dump_tabular()
         logger.info('')
+        if memmap is not None:
+            memory.save()
         logdir = logger.get_dir()
         if rank == 0 and logdir:
             if hasattr(env, 'get_state'):
@@ -271,5 +285,7 @@ def learn(network, env,
                 with open(os.path.join(logdir, 'eval_env_state.pkl'), 'wb') as f:
                     pickle.dump(eval_env.get_state(), f)
 
+    if agent.sampler is not None:
+        agent.sampler.close()
 
     return agent
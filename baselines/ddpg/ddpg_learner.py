@@ -81,6 +81,8 @@ class DDPG(object):
         self.gamma = gamma
         self.tau = tau
         self.memory = memory
+        # optional PrefetchingSampler drawing training batches from memory in the background
+        self.sampler = None
         self.normalize_observations = normalize_observations
         self.normalize_returns = normalize_returns
         self.action_noise = action_noise
@@ -280,15 +282,16 @@ class DDPG(object):
     def store_transition(self, obs0, action, reward, obs1, terminal1):
         reward *= self.reward_scale
 
-        B = obs0.shape[0]
-        for b in range(B):
-            self.memory.append(obs0[b], action[b], reward[b], obs1[b], terminal1[b])
-            if self.normalize_observations:
-                self.obs_rms.update(np.array([obs0[b]]))
+        self.memory.append_batch(obs0, action, reward, obs1, terminal1)
+        if self.normalize_observations:
+            self.obs_rms.update(obs0)
 
     def train(self):
         # Get a batch.
-        batch = self.memory.sample(batch_size=self.batch_size)
+        if self.sampler is not None:
+            batch = self.sampler.get()
+        else:
+            batch = self.memory.sample(batch_size=self.batch_size)
 
         if self.normalize_returns and self.enable_popart:
             old_mean, old_std, target_Q = self.sess.run([self.ret_rms.mean, self.ret_rms.std, self.target_Q], feed_dict={
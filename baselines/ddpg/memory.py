@@ -1,12 +1,16 @@
+import threading
+
 import numpy as np
 
 
 class RingBuffer(object):
-    def __init__(self, maxlen, shape, dtype='float32'):
+    def __init__(self, maxlen, shape, dtype='float32', data=None):
         self.maxlen = maxlen
         self.start = 0
         self.length = 0
-        self.data = np.zeros((maxlen,) + shape).astype(dtype)
+        if data is None:
+            data = np.zeros((maxlen,) + shape).astype(dtype)
+        self.data = data
 
     def __len__(self):
         return self.length
@@ -31,6 +35,24 @@ class RingBuffer(object):
             raise RuntimeError()
         self.data[(self.start + self.length - 1) % self.maxlen] = v
 
+    def extend(self, vs):
+        """Appends a batch of values, with at most two slice assignments."""
+        vs = np.asarray(vs).reshape((-1,) + self.data.shape[1:])
+        total = len(vs)
+        # only the last maxlen values survive, at the positions sequential appends would put them
+        vs = vs[-self.maxlen:]
+        n = len(vs)
+        end = (self.start + self.length + total - n) % self.maxlen
+        first = min(n, self.maxlen - end)
+        self.data[end:end + first] = vs[:first]
+        if first < n:
+            # wrap around to the beginning of the buffer
+            self.data[:n - first] = vs[first:]
+
+        overflow = max(0, self.length + total - self.maxlen)
+        self.length = min(self.maxlen, self.length + total)
+        self.start = (self.start + overflow) % self.maxlen
+
 
 def array_min2d(x):
     x = np.array(x)
@@ -40,24 +62,55 @@ def array_min2d(x):
 
 
 class Memory(object):
-    def __init__(self, limit, action_shape, observation_shape):
+    def __init__(self, limit, action_shape, observation_shape, memmap=None):
+        """Replay memory for DDPG.
+
+        If `memmap` (a baselines.common.memmap_storage.MemmapStorage) is given, the
+        ring buffers are kept in np.memmap files in its directory, and a memory
+        saved there with `save` is loaded back.
+        """
         self.limit = limit
+        self.memmap = memmap
+        # appending and sampling may happen on different threads (see PrefetchingSampler)
+        self.lock = threading.Lock()
+
+        def ring_buffer(name, shape):
+            data = None
+            if memmap is not None:
+                data = memmap.array(name, (limit,) + shape, 'float32')
+            return RingBuffer(limit, shape=shape, data=data)
+
+        self.observations0 = ring_buffer('observations0', observation_shape)
+        self.actions = ring_buffer('actions', action_shape)
+        self.rewards = ring_buffer('rewards', (1,))
+        self.terminals1 = ring_buffer('terminals1', (1,))
+        self.observations1 = ring_buffer('observations1', observation_shape)
+
+        state = memmap.load() if memmap is not None else None
+        if state is not None:
+            for buf in self._ring_buffers:
+                buf.start, buf.length = state['start'], state['length']
+
+    @property
+    def _ring_buffers(self):
+        return [self.observations0, self.actions, self.rewards, self.terminals1, self.observations1]
 
-        self.observations0 = RingBuffer(limit, shape=observation_shape)
-        self.actions = RingBuffer(limit, shape=action_shape)
-        self.rewards = RingBuffer(limit, shape=(1,))
-        self.terminals1 = RingBuffer(limit, shape=(1,))
-        self.observations1 = RingBuffer(limit, shape=observation_shape)
+    def save(self):
+        """Flush a memory-mapped memory to disk, so that it can be resumed from its directory."""
+        assert self.memmap is not None, 'only memory-mapped memories can be saved'
+        with self.lock:
+            self.memmap.save(start=self.observations0.start, length=self.observations0.length)
 
     def sample(self, batch_size):
-        # Draw such that we always have a proceeding element.
-        batch_idxs = np.random.randint(self.nb_entries - 2, size=batch_size)
+        with self.lock:
+            # Draw such that we always have a proceeding element.
+            batch_idxs = np.random.randint(self.nb_entries - 2, size=batch_size)
 
-        obs0_batch = self.observations0.get_batch(batch_idxs)
-        obs1_batch = self.observations1.get_batch(batch_idxs)
-        action_batch = self.actions.get_batch(batch_idxs)
-        reward_batch = self.rewards.get_batch(batch_idxs)
-        terminal1_batch = self.terminals1.get_batch(batch_idxs)
+            obs0_batch = self.observations0.get_batch(batch_idxs)
+            obs1_batch = self.observations1.get_batch(batch_idxs)
+            action_batch = self.actions.get_batch(batch_idxs)
+            reward_batch = self.rewards.get_batch(batch_idxs)
+            terminal1_batch = self.terminals1.get_batch(batch_idxs)
 
         result = {
             'obs0': array_min2d(obs0_batch),
@@ -72,11 +125,24 @@ class Memory(object):
         if not training:
             return
 
-        self.observations0.append(obs0)
-        self.actions.append(action)
-        self.rewards.append(reward)
-        self.observations1.append(obs1)
-        self.terminals1.append(terminal1)
+        with self.lock:
+            self.observations0.append(obs0)
+            self.actions.append(action)
+            self.rewards.append(reward)
+            self.observations1.append(obs1)
+            self.terminals1.append(terminal1)
+
+    def append_batch(self, obs0, action, reward, obs1, terminal1, training=True):
+        """Appends a batch of transitions, given as arrays with the batch on the first axis."""
+        if not training:
+            return
+
+        with self.lock:
+            self.observations0.extend(obs0)
+            self.actions.extend(action)
+            self.rewards.extend(reward)
+            self.observations1.extend(obs1)
+            self.terminals1.extend(terminal1)
 
     @property
     def nb_entries(self):
@@ -0,0 +1,32 @@
+import numpy as np
+
+from baselines.ddpg.memory import Memory, RingBuffer
+
+
+def test_ring_buffer_extend():
+    for batch_size in (1, 3, 7, 12):
+        appended = RingBuffer(10, shape=(2,))
+        extended = RingBuffer(10, shape=(2,))
+        for i in range(5):
+            batch = np.random.randn(batch_size, 2)
+            for v in batch:
+                appended.append(v)
+            extended.extend(batch)
+            assert (appended.start, appended.length) == (extended.start, extended.length)
+            assert np.array_equal(appended.data, extended.data)
+
+
+def test_memory_append_batch():
+    appended = Memory(20, action_shape=(2,), observation_shape=(3,))
+    batched = Memory(20, action_shape=(2,), observation_shape=(3,))
+    for _ in range(5):
+        obs0, obs1 = np.random.randn(8, 3), np.random.randn(8, 3)
+        action, reward, done = np.random.randn(8, 2), np.random.randn(8), np.random.rand(8) < 0.5
+        for b in range(8):
+            appended.append(obs0[b], action[b], reward[b], obs1[b], done[b])
+        batched.append_batch(obs0, action, reward, obs1, done)
+
+    assert appended.nb_entries == batched.nb_entries == 20
+    for name in ('observations0', 'actions', 'rewards', 'terminals1', 'observations1'):
+        a, b = getattr(appended, name), getattr(batched, name)
+        assert np.array_equal(a.get_batch(np.arange(20)), b.get_batch(np.arange(20)))
@@ -11,6 +11,9 @@ from baselines.common.tf_util import load_variables, save_variables
 from baselines import logger
 from baselines.common.schedules import LinearSchedule
 from baselines.common import set_global_seeds
+from baselines.common.memmap_storage import MemmapStorage
+from baselines.common.prefetching_sampler import PrefetchingSampler
+from baselines.common.vec_env import VecEnv
 
 from baselines import deepq
 from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
@@ -113,6 +116,11 @@ def learn(env,
           prioritized_replay_beta0=0.4,
           prioritized_replay_beta_iters=None,
           prioritized_replay_eps=1e-6,
+          replay_storage='list',
+          replay_memmap=False,
+          replay_memmap_cache=0,
+          replay_prefetch=0,
+          replay_max_staleness=None,
           param_noise=False,
           callback=None,
           load_path=None,
@@ -122,8 +130,9 @@ def learn(env,
 
     Parameters
     -------
-    env: gym.Env
-        environment to train on
+    env: gym.Env or VecEnv
+        environment to train on. With a VecEnv, the actions of all its envs are computed
+        by one call to act, and their transitions added to the replay buffer together.
     network: string or a function
         neural network to use as a q function approximator. If string, has to be one of the names of registered models in baselines.common.models
         (mlp, cnn, conv_only). If a function, should take an observation tensor and return a latent variable tensor, which
@@ -133,7 +142,7 @@ def learn(env,
     lr: float
         learning rate for adam optimizer
     total_timesteps: int
-        number of env steps to optimizer for
+        number of env steps to optimizer for, summed over the envs of a VecEnv
     buffer_size: int
         size of the replay buffer
     exploration_fraction: float
@@ -141,7 +150,9 @@ def learn(env,
     exploration_final_eps: float
         final value of random action probability
     train_freq: int
-        update the model every `train_freq` steps.
+        update the model every `train_freq` steps. Steps are counted over all the envs of a VecEnv,
+        which makes as many updates per step of its envs as there are multiples of train_freq
+        in its num_envs steps, so the updates per transition are the same as with one env.
     batch_size: int
         size of a batch sampled from replay buffer for training
     print_freq: int
@@ -168,6 +179,25 @@ def learn(env,
         to 1.0. If set to None equals to total_timesteps.
     prioritized_replay_eps: float
         epsilon to add to the TD errors when updating priorities.
+    replay_storage: str
+        how the replay buffer keeps transitions, 'list', 'array' or 'frames'
+        (see baselines.deepq.replay_buffer.ReplayBuffer). 'array' samples much faster,
+        but stores observations densely. 'frames' stores each frame of 4-frame stacked
+        observations (wrap_deepmind with frame_stack=True) only once, and needs a single env.
+    replay_memmap: bool
+        keep an 'array' or 'frames' replay buffer in np.memmap files under
+        checkpoint_path (or the logger dir), for buffers larger than RAM. The buffer is
+        saved together with the model, and reloaded as it was saved when resuming
+        from a model checkpoint in checkpoint_path.
+    replay_memmap_cache: int
+        with replay_memmap, number of most recently added transitions to also keep in
+        memory, so that sampling them does not read the disk.
+    replay_prefetch: int
+        number of batches to sample ahead in a background thread while the model trains
+        (see baselines.common.prefetching_sampler). 0 samples on the learner thread.
+    replay_max_staleness: int or None
+        with prefetching and prioritized replay, drop prefetched batches that were sampled
+        before more than this many priority updates. None keeps all of them.
     param_noise: bool
         whether or not to use parameter space noise (https://arxiv.org/abs/1706.01905)
     callback: (locals, globals) -> None
@@ -216,17 +246,35 @@ def learn(env,
 
     act = ActWrapper(act, act_params)
 
+    vectorized = isinstance(env, VecEnv)
+    nenvs = env.num_envs if vectorized else 1
+    if replay_storage == 'frames' and nenvs > 1:
+        raise ValueError("'frames' replay buffer storage needs the transitions of a single env, use 'array' with a VecEnv")
+
     # Create the replay buffer
+    memmap = None
+    if replay_memmap:
+        # the buffer is only resumed together with the model it was saved with
+        resume = checkpoint_path is not None and tf.train.latest_checkpoint(checkpoint_path) is not None
+        memmap = MemmapStorage(os.path.join(checkpoint_path or logger.get_dir(), 'replay_buffer'),
+                               cache_size=replay_memmap_cache, resume=resume)
     if prioritized_replay:
-        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha)
+        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha, storage=replay_storage, memmap=memmap)
         if prioritized_replay_beta_iters is None:
             prioritized_replay_beta_iters = total_timesteps
         beta_schedule = LinearSchedule(prioritized_replay_beta_iters,
                                        initial_p=prioritized_replay_beta0,
                                        final_p=1.0)
     else:
-        replay_buffer = ReplayBuffer(buffer_size)
+        replay_buffer = ReplayBuffer(buffer_size, storage=replay_storage, memmap=memmap)
         beta_schedule = None
+    sampler = None
+    if replay_prefetch > 0:
+        if prioritized_replay:
+            sample_fn = lambda: replay_buffer.sample(batch_size, beta=beta_schedule.value(t))
+        else:
+            sample_fn = lambda: replay_buffer.sample(batch_size)
+        sampler = PrefetchingSampler(sample_fn, nprefetch=replay_prefetch, max_staleness=replay_max_staleness)
     # Create the schedule for exploration starting from 1.
     exploration = LinearSchedule(schedule_timesteps=int(exploration_fraction * total_timesteps),
                                  initial_p=1.0,
@@ -236,7 +284,10 @@ def learn(env,
     U.initialize()
     update_target()
 
+    # rewards of the finished episodes, and of the episode in progress with a single env
     episode_rewards = [0.0]
+    # rewards of the episodes in progress of every env of a VecEnv
+    episode_reward = np.zeros(nenvs)
     saved_mean_reward = None
     obs = env.reset()
     reset = True
@@ -256,7 +307,8 @@ def learn(env,
             logger.log('Loaded model from {}'.format(load_path))
 
 
-        for t in range(total_timesteps):
+        # a VecEnv makes nenvs steps at a time, steps t to t + nenvs - 1
+        for t in range(0, total_timesteps, nenvs):
             if callback is not None:
                 if callback(locals(), globals()):
                     break
@@ -275,58 +327,93 @@ def learn(env,
                 kwargs['reset'] = reset
                 kwargs['update_param_noise_threshold'] = update_param_noise_threshold
                 kwargs['update_param_noise_scale'] = True
-            action = act(np.array(obs)[None], update_eps=update_eps, **kwargs)[0]
-            env_action = action
-            reset = False
-            new_obs, rew, done, _ = env.step(env_action)
-            # Store transition in the replay buffer.
-            replay_buffer.add(obs, action, rew, new_obs, float(done))
-            obs = new_obs
-
-            episode_rewards[-1] += rew
-            if done:
-                obs = env.reset()
-                episode_rewards.append(0.0)
-                reset = True
-
-            if t > learning_starts and t % train_freq == 0:
+            num_episodes_before = len(episode_rewards)
+            if vectorized:
+                actions = act(np.asarray(obs), update_eps=update_eps, **kwargs)
+                new_obs, rews, dones, _ = env.step(actions)
+                # Store the transitions of all envs in the replay buffer. The VecEnv resets done envs,
+                # so their new_obs start the next episode, which is ignored since done masks it.
+                replay_buffer.add_batch(obs, actions, rews, new_obs, dones.astype(np.float32))
+                obs = new_obs
+
+                episode_reward += rews
+                for d in np.flatnonzero(dones):
+                    episode_rewards.insert(-1, episode_reward[d])
+                    episode_reward[d] = 0.
+                done = dones.any()
+                # perturb the policy anew whenever an episode starts
+                reset = done
+            else:
+                action = act(np.array(obs)[None], update_eps=update_eps, **kwargs)[0]
+                env_action = action
+                reset = False
+                new_obs, rew, done, _ = env.step(env_action)
+                # Store transition in the replay buffer.
+                replay_buffer.add(obs, action, rew, new_obs, float(done))
+                obs = new_obs
+
+                episode_rewards[-1] += rew
+                if done:
+                    obs = env.reset()
+                    episode_rewards.append(0.0)
+                    reset = True
+
+            for _ in range(_count_multiples(max(t, learning_starts + 1), t + nenvs, train_freq)):
                 # Minimize the error in Bellman's equation on a batch sampled from replay buffer.
-                if prioritized_replay:
+                if sampler is not None:
+                    experience = sampler.get()
+                elif prioritized_replay:
                     experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(t))
+                else:
+                    experience = replay_buffer.sample(batch_size)
+                if prioritized_replay:
                     (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
                 else:
-                    obses_t, actions, rewards, obses_tp1, dones = replay_buffer.sample(batch_size)
+                    obses_t, actions, rewards, obses_tp1, dones = experience
                     weights, batch_idxes = np.ones_like(rewards), None
                 td_errors = train(obses_t, actions, rewards, obses_tp1, dones, weights)
                 if prioritized_replay:
                     new_priorities = np.abs(td_errors) + prioritized_replay_eps
                     replay_buffer.update_priorities(batch_idxes, new_priorities)
+                    if sampler is not None:
+                        sampler.priorities_updated()
 
-            if t > learning_starts and t % target_network_update_freq == 0:
+            if _count_multiples(max(t, learning_starts + 1), t + nenvs, target_network_update_freq) > 0:
                 # Update target network periodically.
                 update_target()
 
             mean_100ep_reward = round(np.mean(episode_rewards[-101:-1]), 1)
             num_episodes = len(episode_rewards)
-            if done and print_freq is not None and len(episode_rewards) % print_freq == 0:
+            if done and print_freq is not None and num_episodes // print_freq > num_episodes_before // print_freq:
                 logger.record_tabular("steps", t)
                 logger.record_tabular("episodes", num_episodes)
                 logger.record_tabular("mean 100 episode reward", mean_100ep_reward)
                 logger.record_tabular("% time spent exploring", int(100 * exploration.value(t)))
+                if sampler is not None:
+                    logger.record_tabular("sample wait time", sampler.pop_wait_time())
                 logger.dump_tabular()
 
-            if (checkpoint_freq is not None and t > learning_starts and
-                    num_episodes > 100 and t % checkpoint_freq == 0):
+            if (checkpoint_freq is not None and num_episodes > 100 and
+                    _count_multiples(max(t, learning_starts + 1), t + nenvs, checkpoint_freq) > 0):
                 if saved_mean_reward is None or mean_100ep_reward > saved_mean_reward:
                     if print_freq is not None:
                         logger.log("Saving model due to mean reward increase: {} -> {}".format(
                                    saved_mean_reward, mean_100ep_reward))
                     save_variables(model_file)
+                    if memmap is not None:
+                        replay_buffer.save()
                     model_saved = True
                     saved_mean_reward = mean_100ep_reward
+        if sampler is not None:
+            sampler.close()
         if model_saved:
             if print_freq is not None:
                 logger.log("Restored model with mean reward: {}".format(saved_mean_reward))
             load_variables(model_file)
 
     return act
+
+
+def _count_multiples(start, stop, freq):
+    """Number of steps in [start, stop) that are multiples of freq."""
+    return max(0, (stop - 1) // freq - (start - 1) // freq)
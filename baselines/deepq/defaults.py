@@ -13,9 +13,11 @@ def atari():
         prioritized_replay_alpha=0.6,
         checkpoint_freq=10000,
         checkpoint_path=None,
+        replay_storage='frames',
         dueling=True
     )
 
 def retro():
-    return atari()
+    # deepq retro envs are not frame stacked
+    return dict(atari(), replay_storage='list')
 
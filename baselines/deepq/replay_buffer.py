@@ -1,11 +1,183 @@
+import threading
+
 import numpy as np
-import random
 
 from baselines.common.segment_tree import SumSegmentTree, MinSegmentTree
 
 
+FIELDS = ('obs_t', 'action', 'reward', 'obs_tp1', 'done')
+
+
+def _empty(memmap, name, shape, dtype):
+    if memmap is None:
+        return np.empty(shape, dtype=dtype)
+    return memmap.array(name, shape, dtype)
+
+
+class ArrayStorage(object):
+    def __init__(self, size, memmap=None):
+        """Columnar transition storage backed by one preallocated array per field.
+
+        Arrays are allocated lazily on the first insertion, with shapes and dtypes
+        taken from that transition, so the storage adapts to whatever the
+        environment produces (uint8 frames, float32 vectors, int actions...).
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store.
+        memmap: baselines.common.memmap_storage.MemmapStorage or None
+            if given, the arrays are np.memmap files in its directory
+        """
+        self._maxsize = size
+        self._memmap = memmap
+        self._columns = None
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def _allocate(self, data):
+        self._columns = []
+        for name, field in zip(FIELDS, data):
+            field = np.asarray(field)
+            self._columns.append(_empty(self._memmap, name, (self._maxsize,) + field.shape, field.dtype))
+
+    def state(self):
+        return {'len': self._len}
+
+    def restore(self, state):
+        self._len = state['len']
+        if self._len > 0:
+            self._columns = [self._memmap.open(name) for name in FIELDS]
+
+    def __setitem__(self, idx, data):
+        if self._columns is None:
+            self._allocate(data)
+        for column, field in zip(self._columns, data):
+            column[idx] = field
+
+    def append(self, data):
+        assert self._len < self._maxsize
+        self[self._len] = data
+        self._len += 1
+
+    def put_batch(self, idxes, data):
+        """Stores the i-th transition of the batch `data` (one array per field) at `idxes[i]`."""
+        idxes = np.asarray(idxes)
+        if self._columns is None:
+            self._allocate([np.asarray(field)[0] for field in data])
+        for column, field in zip(self._columns, data):
+            column[idxes] = field
+        self._len = max(self._len, int(idxes.max()) + 1)
+
+    def gather(self, idxes):
+        """Returns one array per field holding the transitions at `idxes`."""
+        idxes = np.asarray(idxes)
+        return tuple(column[idxes] for column in self._columns)
+
+
+class FrameStorage(object):
+    def __init__(self, size, frame_stack, memmap=None):
+        """Transition storage for frame-stacked observations that keeps every frame once.
+
+        Consecutive observations of an episode share all but one of their frames
+        (see atari_wrappers.FrameStack), so only the newest frame of each step is
+        kept in a ring of frames, together with a flag marking the first step of
+        every episode. Stacked obs_t / obs_tp1 are rebuilt at sample time with one
+        gather. Frames that would reach back past the start of an episode are
+        replaced with its first frame, which is what FrameStack.reset produces.
+
+        Transitions must be added in the order they were experienced, and the
+        obs_tp1 of an episode's last transition is not kept: it is returned as the
+        newest frame of obs_t repeated, which only matters if done is ignored.
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store.
+        frame_stack: int
+            number of frames stacked along the last axis of the observations.
+        memmap: baselines.common.memmap_storage.MemmapStorage or None
+            if given, the arrays are np.memmap files in its directory
+        """
+        self._maxsize = size
+        self._frame_stack = frame_stack
+        self._memmap = memmap
+        # one frame per step, plus the history of the oldest stored transition
+        self._nframes = size + frame_stack
+        self._frames = None
+        self._first = _empty(memmap, 'first', (self._nframes,), np.bool_)
+        self._columns = None
+        self._len = 0
+        self._t = 0
+        self._prev_done = True
+
+    def __len__(self):
+        return self._len
+
+    def _newest_frame(self, obs):
+        obs = np.asarray(obs)
+        return obs[..., -(obs.shape[-1] // self._frame_stack):]
+
+    def __setitem__(self, idx, data):
+        obs_t, action, reward, obs_tp1, done = data
+        assert idx == self._t % self._maxsize, "transitions have to be added in order"
+        frame_t, frame_tp1 = self._newest_frame(obs_t), self._newest_frame(obs_tp1)
+        if self._frames is None:
+            self._frames = _empty(self._memmap, 'frames', (self._nframes,) + frame_t.shape, frame_t.dtype)
+            self._columns = [_empty(self._memmap, name, (self._maxsize,), np.asarray(field).dtype)
+                             for name, field in zip(self._column_names, (action, reward, done))]
+        self._frames[self._t % self._nframes] = frame_t
+        self._frames[(self._t + 1) % self._nframes] = frame_tp1
+        self._first[self._t % self._nframes] = self._prev_done
+        for column, field in zip(self._columns, (action, reward, done)):
+            column[idx] = field
+        self._prev_done = bool(done)
+        self._t += 1
+
+    def append(self, data):
+        assert self._len < self._maxsize
+        self[self._len] = data
+        self._len += 1
+
+    _column_names = ('action', 'reward', 'done')
+
+    def state(self):
+        return {'len': self._len, 't': self._t, 'prev_done': self._prev_done}
+
+    def restore(self, state):
+        self._len, self._t, self._prev_done = state['len'], state['t'], state['prev_done']
+        if self._len > 0:
+            self._frames = self._memmap.open('frames')
+            self._columns = [self._memmap.open(name) for name in self._column_names]
+
+    def _stack(self, steps):
+        # frames of shape [batch, frame_stack, ..., channels] -> [batch, ..., frame_stack * channels]
+        frames = self._frames[(steps % self._nframes).ravel()]
+        frames = frames.reshape(steps.shape + frames.shape[1:])
+        frames = np.moveaxis(frames, 1, -2)
+        return frames.reshape(frames.shape[:-2] + (-1,))
+
+    def gather(self, idxes):
+        """Returns obs_t, action, reward, obs_tp1, done arrays for the transitions at `idxes`."""
+        idxes = np.asarray(idxes)
+        actions, rewards, dones = (column[idxes] for column in self._columns)
+        # step number of each transition, counting from the first add
+        newest = self._t - 1
+        steps = newest - (newest - idxes) % self._maxsize
+        window = steps[:, None] + np.arange(1 - self._frame_stack, 1)
+        is_first = (window >= 0) & self._first[window % self._nframes]
+        episode_start = np.where(is_first, window, -1).max(axis=1, keepdims=True)
+
+        window_t = np.maximum(window, episode_start)
+        window_tp1 = np.maximum(window + 1, episode_start)
+        window_tp1 = np.where(dones[:, None].astype(np.bool_), np.minimum(window_tp1, steps[:, None]), window_tp1)
+        return self._stack(window_t), actions, rewards, self._stack(window_tp1), dones
+
+
 class ReplayBuffer(object):
-    def __init__(self, size):
+    def __init__(self, size, storage='list', frame_stack=4, memmap=None):
         """Create Replay buffer.
 
         Parameters
@@ -13,10 +185,53 @@ class ReplayBuffer(object):
         size: int
             Max number of transitions to store in the buffer. When the buffer
             overflows the old memories are dropped.
+        storage: str
+            how transitions are kept in memory:
+            'list' - a list of tuples. Observations are stored as given, which lets
+                     atari_wrappers.LazyFrames share frames between transitions.
+            'array' - one preallocated numpy array per field (see ArrayStorage).
+                      Sampling is a single gather per field, at the cost of
+                      storing every observation as a dense array.
+            'frames' - each frame of frame-stacked observations is stored once
+                       (see FrameStorage). Meant for Atari, where it needs about
+                       2 * frame_stack times less memory than dense arrays.
+        frame_stack: int
+            number of frames stacked in each observation, used by 'frames' storage.
+        memmap: baselines.common.memmap_storage.MemmapStorage or None
+            keep the 'array' or 'frames' storage in np.memmap files instead of memory,
+            for buffers larger than RAM. If the directory holds a buffer saved with
+            `save`, it starts from the buffer as it was saved.
         """
-        self._storage = []
+        if storage == 'list':
+            if memmap is not None:
+                raise ValueError("'list' replay buffer storage cannot be memory-mapped")
+            self._storage = []
+        elif storage == 'array':
+            self._storage = ArrayStorage(size, memmap=memmap)
+        elif storage == 'frames':
+            self._storage = FrameStorage(size, frame_stack, memmap=memmap)
+        else:
+            raise ValueError('Unknown replay buffer storage: {}'.format(storage))
         self._maxsize = size
         self._next_idx = 0
+        self._memmap = memmap
+        # adding and sampling may happen on different threads (see PrefetchingSampler)
+        self.lock = threading.RLock()
+        if memmap is not None and memmap.load() is not None:
+            self._restore(memmap.load())
+
+    def _state(self):
+        return dict(self._storage.state(), next_idx=self._next_idx)
+
+    def _restore(self, state):
+        self._storage.restore(state)
+        self._next_idx = state['next_idx']
+
+    def save(self):
+        """Checkpoint a memory-mapped buffer, so that it can be resumed from its directory as it is now."""
+        assert self._memmap is not None, 'only memory-mapped replay buffers can be saved'
+        with self.lock:
+            self._memmap.save(**self._state())
 
     def __len__(self):
         return len(self._storage)
@@ -24,13 +239,37 @@ class ReplayBuffer(object):
     def add(self, obs_t, action, reward, obs_tp1, done):
         data = (obs_t, action, reward, obs_tp1, done)
 
-        if self._next_idx >= len(self._storage):
-            self._storage.append(data)
-        else:
-            self._storage[self._next_idx] = data
-        self._next_idx = (self._next_idx + 1) % self._maxsize
+        with self.lock:
+            if self._next_idx >= len(self._storage):
+                self._storage.append(data)
+            else:
+                self._storage[self._next_idx] = data
+            self._next_idx = (self._next_idx + 1) % self._maxsize
+
+    def add_batch(self, obs_t, action, reward, obs_tp1, done):
+        """Add a batch of transitions, e.g. one step of every env of a VecEnv.
+
+        Every argument holds one element per transition along its first axis.
+        With 'array' storage the whole batch is written with one assignment per field.
+        'frames' storage needs transitions in the order they were experienced, so
+        it only accepts batches of consecutive steps of a single env.
+        """
+        data = (obs_t, action, reward, obs_tp1, done)
+        batch_size = len(action)
+        assert batch_size <= self._maxsize
+
+        with self.lock:
+            if isinstance(self._storage, ArrayStorage):
+                idxes = (self._next_idx + np.arange(batch_size)) % self._maxsize
+                self._storage.put_batch(idxes, data)
+                self._next_idx = (self._next_idx + batch_size) % self._maxsize
+            else:
+                for transition in zip(*data):
+                    ReplayBuffer.add(self, *transition)
 
     def _encode_sample(self, idxes):
+        if isinstance(self._storage, (ArrayStorage, FrameStorage)):
+            return self._storage.gather(idxes)
         obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
         for i in idxes:
             data = self._storage[i]
@@ -64,12 +303,13 @@ class ReplayBuffer(object):
             done_mask[i] = 1 if executing act_batch[i] resulted in
             the end of an episode and 0 otherwise.
         """
-        idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
-        return self._encode_sample(idxes)
+        with self.lock:
+            idxes = np.random.randint(0, len(self._storage), size=batch_size)
+            return self._encode_sample(idxes)
 
 
 class PrioritizedReplayBuffer(ReplayBuffer):
-    def __init__(self, size, alpha):
+    def __init__(self, size, alpha, storage='list', frame_stack=4, memmap=None):
         """Create Prioritized Replay buffer.
 
         Parameters
@@ -80,12 +320,17 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         alpha: float
             how much prioritization is used
             (0 - no prioritization, 1 - full prioritization)
+        storage: str
+            'list', 'array' or 'frames', see ReplayBuffer.__init__
+        frame_stack: int
+            see ReplayBuffer.__init__
+        memmap: baselines.common.memmap_storage.MemmapStorage or None
+            see ReplayBuffer.__init__. The priorities are memory-mapped as well.
 
         See Also
         --------
         ReplayBuffer.__init__
         """
-        super(PrioritizedReplayBuffer, self).__init__(size)
         assert alpha >= 0
         self._alpha = alpha
 
@@ -96,23 +341,53 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_sum = SumSegmentTree(it_capacity)
         self._it_min = MinSegmentTree(it_capacity)
         self._max_priority = 1.0
+        self._tree_columns = []
+        if memmap is not None:
+            resume = memmap.load() is not None
+            for name, tree in (('it_sum', self._it_sum), ('it_min', self._it_min)):
+                column = memmap.array(name, tree._value.shape, tree._value.dtype)
+                if not resume:
+                    column.data[:] = tree._value
+                tree._value = column.data
+                self._tree_columns.append(column)
+        super(PrioritizedReplayBuffer, self).__init__(size, storage=storage, frame_stack=frame_stack, memmap=memmap)
+
+    def _state(self):
+        return dict(super()._state(), max_priority=self._max_priority)
+
+    def _restore(self, state):
+        super()._restore(state)
+        self._max_priority = state['max_priority']
+
+    def save(self):
+        """See ReplayBuffer.save"""
+        with self.lock:
+            # the segment trees are updated in place, not through the MemmapArray
+            for column in self._tree_columns:
+                column.touch()
+            super().save()
 
     def add(self, *args, **kwargs):
         """See ReplayBuffer.store_effect"""
-        idx = self._next_idx
-        super().add(*args, **kwargs)
-        self._it_sum[idx] = self._max_priority ** self._alpha
-        self._it_min[idx] = self._max_priority ** self._alpha
+        with self.lock:
+            idx = self._next_idx
+            super().add(*args, **kwargs)
+            self._it_sum[idx] = self._max_priority ** self._alpha
+            self._it_min[idx] = self._max_priority ** self._alpha
+
+    def add_batch(self, *args, **kwargs):
+        """See ReplayBuffer.add_batch"""
+        with self.lock:
+            idxes = (self._next_idx + np.arange(len(args[1]))) % self._maxsize
+            super().add_batch(*args, **kwargs)
+            self._it_sum[idxes] = self._max_priority ** self._alpha
+            self._it_min[idxes] = self._max_priority ** self._alpha
 
     def _sample_proportional(self, batch_size):
-        res = []
         p_total = self._it_sum.sum(0, len(self._storage) - 1)
         every_range_len = p_total / batch_size
-        for i in range(batch_size):
-            mass = random.random() * every_range_len + i * every_range_len
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
+        mass = (np.random.random(batch_size) + np.arange(batch_size)) * every_range_len
+        return self._it_sum.find_prefixsum_idx(mass)
 
     def sample(self, batch_size, beta):
         """Sample a batch of experiences.
@@ -152,18 +427,16 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         """
         assert beta > 0
 
-        idxes = self._sample_proportional(batch_size)
+        with self.lock:
+            idxes = self._sample_proportional(batch_size)
 
-        weights = []
-        p_min = self._it_min.min() / self._it_sum.sum()
-        max_weight = (p_min * len(self._storage)) ** (-beta)
+            p_sum = self._it_sum.sum()
+            p_min = self._it_min.min() / p_sum
+            max_weight = (p_min * len(self._storage)) ** (-beta)
 
-        for idx in idxes:
-            p_sample = self._it_sum[idx] / self._it_sum.sum()
-            weight = (p_sample * len(self._storage)) ** (-beta)
-            weights.append(weight / max_weight)
-        weights = np.array(weights)
-        encoded_sample = self._encode_sample(idxes)
+            p_sample = self._it_sum[idxes] / p_sum
+            weights = (p_sample * len(self._storage)) ** (-beta) / max_weight
+            encoded_sample = self._encode_sample(idxes)
         return tuple(list(encoded_sample) + [weights, idxes])
 
     def update_priorities(self, idxes, priorities):
@@ -181,11 +454,15 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             transitions at the sampled idxes denoted by
             variable `idxes`.
         """
+        idxes = np.asarray(idxes)
+        priorities = np.asarray(priorities)
         assert len(idxes) == len(priorities)
-        for idx, priority in zip(idxes, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
+        if len(idxes) == 0:
+            return
+        assert np.all(priorities > 0)
+        with self.lock:
+            assert np.all(0 <= idxes) and np.all(idxes < len(self._storage))
+            self._it_sum[idxes] = priorities ** self._alpha
+            self._it_min[idxes] = priorities ** self._alpha
 
-            self._max_priority = max(self._max_priority, priority)
+            self._max_priority = max(self._max_priority, np.max(priorities))
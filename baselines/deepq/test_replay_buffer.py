@@ -0,0 +1,231 @@
+import time
+
+from collections import deque
+
+import numpy as np
+
+from baselines.common.memmap_storage import MemmapStorage
+from baselines.common.tests import mark_slow
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+
+
+def _fill(buffer, n, obs_shape=(4,), seed=0):
+    rng = np.random.RandomState(seed)
+    for _ in range(n):
+        obs_t = rng.randn(*obs_shape).astype(np.float32)
+        obs_tp1 = rng.randn(*obs_shape).astype(np.float32)
+        buffer.add(obs_t, rng.randint(4), rng.randn(), obs_tp1, float(rng.rand() < 0.1))
+
+
+def test_array_storage_matches_list():
+    list_buffer = ReplayBuffer(50)
+    array_buffer = ReplayBuffer(50, storage='array')
+    # overflow the buffers so that old transitions get overwritten
+    _fill(list_buffer, 120)
+    _fill(array_buffer, 120)
+    assert len(list_buffer) == len(array_buffer) == 50
+
+    idxes = np.random.randint(0, 50, size=32)
+    for expected, actual in zip(list_buffer._encode_sample(idxes), array_buffer._encode_sample(idxes)):
+        assert expected.shape == actual.shape
+        assert np.array_equal(expected, actual)
+
+    obses_t, actions, rewards, obses_tp1, dones = array_buffer.sample(16)
+    assert obses_t.shape == obses_tp1.shape == (16, 4)
+    assert obses_t.dtype == np.float32
+    assert actions.shape == rewards.shape == dones.shape == (16,)
+
+
+def test_prioritized_array_storage():
+    buffer = PrioritizedReplayBuffer(64, alpha=0.6, storage='array')
+    _fill(buffer, 100)
+    obses_t, actions, rewards, obses_tp1, dones, weights, idxes = buffer.sample(8, beta=0.4)
+    assert obses_t.shape == (8, 4)
+    assert weights.shape == (8,)
+    buffer.update_priorities(idxes, np.ones(8))
+
+
+def test_prioritized_batch_matches_sequential():
+    batched = PrioritizedReplayBuffer(100, alpha=0.6)
+    sequential = PrioritizedReplayBuffer(100, alpha=0.6)
+    _fill(batched, 100)
+    _fill(sequential, 100)
+
+    rng = np.random.RandomState(1)
+    idxes = rng.randint(0, 100, size=64)
+    priorities = rng.rand(64) + 0.1
+    batched.update_priorities(idxes, priorities)
+    for idx, priority in zip(idxes, priorities):
+        sequential.update_priorities([idx], [priority])
+    assert np.allclose(batched._it_sum._value, sequential._it_sum._value)
+    assert np.allclose(batched._it_min._value, sequential._it_min._value)
+    assert batched._max_priority == sequential._max_priority
+
+    mass = rng.rand(32) * batched._it_sum.sum()
+    expected = [batched._it_sum.find_prefixsum_idx(m) for m in mass]
+    assert np.array_equal(batched._it_sum.find_prefixsum_idx(mass), expected)
+
+    _, _, _, _, _, weights, idxes = batched.sample(32, beta=0.5)
+    p_sum, p_min = batched._it_sum.sum(), batched._it_min.min()
+    for weight, idx in zip(weights, idxes):
+        expected = (batched._it_sum[idx] / p_sum * 100) ** -0.5 / (p_min / p_sum * 100) ** -0.5
+        assert np.isclose(weight, expected)
+
+
+def _transition_batches(nbatches, batch_size, obs_shape=(4,), seed=0):
+    rng = np.random.RandomState(seed)
+    for _ in range(nbatches):
+        yield (rng.randn(batch_size, *obs_shape).astype(np.float32), rng.randint(4, size=batch_size),
+               rng.randn(batch_size), rng.randn(batch_size, *obs_shape).astype(np.float32),
+               (rng.rand(batch_size) < 0.1).astype(np.float32))
+
+
+def test_add_batch_matches_add():
+    for make_buffer in (lambda storage: ReplayBuffer(50, storage=storage),
+                        lambda storage: PrioritizedReplayBuffer(50, alpha=0.6, storage=storage)):
+        sequential = make_buffer('list')
+        batched = [make_buffer('list'), make_buffer('array')]
+        # batches of 7 overflow the buffers in the middle of a batch
+        for batch in _transition_batches(17, 7):
+            for transition in zip(*batch):
+                sequential.add(*transition)
+            for buffer in batched:
+                buffer.add_batch(*batch)
+        idxes = np.arange(50)
+        for buffer in batched:
+            assert len(buffer) == len(sequential) == 50
+            assert buffer._next_idx == sequential._next_idx
+            for expected, actual in zip(sequential._encode_sample(idxes), buffer._encode_sample(idxes)):
+                assert np.array_equal(expected, actual)
+            if isinstance(buffer, PrioritizedReplayBuffer):
+                assert np.array_equal(buffer._it_sum._value, sequential._it_sum._value)
+
+
+def _frame_stacked_transitions(frame_stack=4, seed=0):
+    # mimics atari_wrappers.FrameStack: the first frame is repeated on reset
+    rng = np.random.RandomState(seed)
+    frames = deque(maxlen=frame_stack)
+    done = True
+    while True:
+        if done:
+            frame = rng.randint(0, 255, size=(6, 6, 1), dtype=np.uint8)
+            for _ in range(frame_stack):
+                frames.append(frame)
+        obs_t = np.concatenate(frames, axis=-1)
+        frames.append(rng.randint(0, 255, size=(6, 6, 1), dtype=np.uint8))
+        obs_tp1 = np.concatenate(frames, axis=-1)
+        done = rng.rand() < 0.05
+        yield obs_t, rng.randint(4), rng.randn(), obs_tp1, float(done)
+
+
+def test_frame_storage_matches_list():
+    list_buffer = ReplayBuffer(100)
+    frame_buffer = ReplayBuffer(100, storage='frames')
+    transitions = _frame_stacked_transitions()
+    for n in (3, 50, 333):
+        for _ in range(n):
+            transition = next(transitions)
+            list_buffer.add(*transition)
+            frame_buffer.add(*transition)
+        assert len(list_buffer) == len(frame_buffer)
+
+        idxes = np.arange(len(frame_buffer))
+        expected = list_buffer._encode_sample(idxes)
+        actual = frame_buffer._encode_sample(idxes)
+        for field in (0, 1, 2, 4):
+            assert np.array_equal(expected[field], actual[field])
+        # obs_tp1 of terminal transitions is not stored
+        not_done = expected[4] == 0
+        assert np.array_equal(expected[3][not_done], actual[3][not_done])
+
+    # frames are stored once instead of 2 * frame_stack times
+    assert frame_buffer._storage._frames.nbytes < 2 * 4 * 100 * 6 * 6 / 7
+
+
+def test_memmap_storage_resume(tmpdir):
+    for storage in ('array', 'frames'):
+        path = str(tmpdir.join(storage))
+        buffer = PrioritizedReplayBuffer(100, alpha=0.6, storage=storage, memmap=MemmapStorage(path))
+        transitions = _frame_stacked_transitions()
+        for _ in range(150):
+            buffer.add(*next(transitions))
+        buffer.update_priorities(np.arange(10), np.arange(1, 11))
+        buffer.save()
+
+        resumed = PrioritizedReplayBuffer(100, alpha=0.6, storage=storage, memmap=MemmapStorage(path))
+        assert len(resumed) == len(buffer)
+        assert resumed._next_idx == buffer._next_idx
+        assert resumed._max_priority == buffer._max_priority
+        assert np.array_equal(resumed._it_sum._value, buffer._it_sum._value)
+        idxes = np.arange(100)
+        for expected, actual in zip(buffer._encode_sample(idxes), resumed._encode_sample(idxes)):
+            assert np.array_equal(expected, actual)
+        # the resumed buffer keeps going where the saved one stopped
+        transition = next(transitions)
+        buffer.add(*transition)
+        resumed.add(*transition)
+        for expected, actual in zip(buffer._encode_sample(idxes), resumed._encode_sample(idxes)):
+            assert np.array_equal(expected, actual)
+
+
+def test_memmap_storage_resume_after_more_adds(tmpdir):
+    """
+    Test that a buffer resumes as it was saved, not with the transitions added after the save.
+    """
+    for storage in ('array', 'frames'):
+        path = str(tmpdir.join(storage))
+        buffer = PrioritizedReplayBuffer(100, alpha=0.6, storage=storage, memmap=MemmapStorage(path))
+        transitions = _frame_stacked_transitions()
+        for _ in range(150):
+            buffer.add(*next(transitions))
+        buffer.save()
+        idxes = np.arange(100)
+        expected = [np.copy(field) for field in buffer._encode_sample(idxes)]
+        expected_priorities = np.copy(buffer._it_sum._value)
+        state = (len(buffer), buffer._next_idx, buffer._max_priority)
+        for _ in range(30):
+            buffer.add(*next(transitions))
+        buffer.update_priorities(np.arange(100, 110) % 100, np.arange(1, 11))
+
+        resumed = PrioritizedReplayBuffer(100, alpha=0.6, storage=storage, memmap=MemmapStorage(path))
+        assert (len(resumed), resumed._next_idx, resumed._max_priority) == state
+        assert np.array_equal(resumed._it_sum._value, expected_priorities)
+        for e, a in zip(expected, resumed._encode_sample(idxes)):
+            assert np.array_equal(e, a)
+        # saving again only copies the rows written since the resume
+        resumed.add(*next(transitions))
+        resumed.save()
+        again = PrioritizedReplayBuffer(100, alpha=0.6, storage=storage, memmap=MemmapStorage(path))
+        for e, a in zip(resumed._encode_sample(idxes), again._encode_sample(idxes)):
+            assert np.array_equal(e, a)
+        # a storage that doesn't resume starts empty
+        assert len(PrioritizedReplayBuffer(100, alpha=0.6, storage=storage,
+                                           memmap=MemmapStorage(path, resume=False))) == 0
+
+
+@mark_slow
+def test_replay_buffer_throughput():
+    size, nsamples, batch_size = 10000, 200, 256
+    for obs_shape, storages in [((4,), ('list', 'array')), ((84, 84, 4), ('list', 'array', 'frames'))]:
+        obs = np.zeros(obs_shape, dtype=np.float32 if len(obs_shape) == 1 else np.uint8)
+        for storage in storages:
+            buffer = ReplayBuffer(size, storage=storage)
+            tstart = time.time()
+            for _ in range(size):
+                buffer.add(obs, 0, 0.0, obs, 0.0)
+            add_time = time.time() - tstart
+
+            tstart = time.time()
+            for _ in range(nsamples):
+                buffer.sample(batch_size)
+            sample_time = time.time() - tstart
+            print('obs {} {}: {:.0f} adds/s, {:.0f} samples/s (batch {})'.format(
+                obs_shape, storage, size / add_time, nsamples / sample_time, batch_size))
+
+
+if __name__ == '__main__':
+    test_array_storage_matches_list()
+    test_prioritized_array_storage()
+    test_prioritized_batch_matches_sequential()
+    test_frame_storage_matches_list()
+    test_replay_buffer_throughput()
@@ -65,6 +65,10 @@ class MlpPolicy(object):
         ac1, vpred1 = self._act(stochastic, ob[None])
         return ac1[0], vpred1[0]
 
+    def act_batch(self, stochastic, obs):
+        # actions and value predictions of a batch of observations
+        return self._act(stochastic, obs)
+
     def get_variables(self):
         return tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, self.scope)
 
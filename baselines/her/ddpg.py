@@ -9,6 +9,7 @@ from baselines.her.util import (
     import_function, store_args, flatten_grads, transitions_in_episode_batch, convert_episode_to_batch_major)
 from baselines.her.normalizer import Normalizer
 from baselines.her.replay_buffer import ReplayBuffer
+from baselines.common.memmap_storage import MemmapStorage
 from baselines.common.mpi_adam import MpiAdam
 from baselines.common import tf_util
 
@@ -25,7 +26,8 @@ class DDPG(object):
                  Q_lr, pi_lr, norm_eps, norm_clip, max_u, action_l2, clip_obs, scope, T,
                  rollout_batch_size, subtract_goals, relative_goals, clip_pos_returns, clip_return,
                  bc_loss, q_filter, num_demo, demo_batch_size, prm_loss_weight, aux_loss_weight,
-                 sample_transitions, gamma, reuse=False, **kwargs):
+                 sample_transitions, gamma, reuse=False, buffer_memmap_path=None, buffer_memmap_cache=0,
+                 buffer_obs_dtype='float32', **kwargs):
         """Implementation of DDPG that is used in combination with Hindsight Experience Replay (HER).
             Added functionality to use demonstrations for training to Overcome exploration problem.
 
@@ -61,6 +63,11 @@ class DDPG(object):
             demo_batch_size: number of samples to be used from the demonstrations buffer, per mpi thread
             prm_loss_weight: Weight corresponding to the primary loss
             aux_loss_weight: Weight corresponding to the auxilliary loss also called the cloning loss
+            buffer_memmap_path (str): if set, directory to keep the replay buffer in as np.memmap files
+            buffer_memmap_cache (int): number of most recently stored episodes of a memory-mapped
+                replay buffer to also keep in memory
+            buffer_obs_dtype (str): dtype of the observations in the replay buffer, e.g. float16
+                to halve its size
         """
         if self.clip_return is None:
             self.clip_return = np.inf
@@ -99,12 +106,19 @@ class DDPG(object):
                          for key, val in input_shapes.items()}
         buffer_shapes['g'] = (buffer_shapes['g'][0], self.dimg)
         buffer_shapes['ag'] = (self.T, self.dimg)
+        # rollouts are float32, except for the success flags
+        buffer_dtypes = {key: np.bool_ if key == 'info_is_success' else np.float32 for key in buffer_shapes}
+        buffer_dtypes['o'] = self.buffer_obs_dtype
 
         buffer_size = (self.buffer_size // self.rollout_batch_size) * self.rollout_batch_size
-        self.buffer = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions)
+        memmap = None
+        if self.buffer_memmap_path is not None:
+            memmap = MemmapStorage(self.buffer_memmap_path, cache_size=self.buffer_memmap_cache)
+        self.buffer = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions, memmap=memmap,
+                                   buffer_dtypes=buffer_dtypes)
 
         global DEMO_BUFFER
-        DEMO_BUFFER = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions) #initialize the demo buffer; in the same way as the primary data buffer
+        DEMO_BUFFER = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions, buffer_dtypes=buffer_dtypes) #initialize the demo buffer; in the same way as the primary data buffer
 
     def _random_action(self, n):
         return np.random.uniform(low=-self.max_u, high=self.max_u, size=(n, self.dimu))
@@ -196,8 +210,6 @@ class DDPG(object):
 
             if update_stats:
                 # add transitions to normalizer to normalize the demo data as well
-                episode['o_2'] = episode['o'][:, 1:, :]
-                episode['ag_2'] = episode['ag'][:, 1:, :]
                 num_normalizing_transitions = transitions_in_episode_batch(episode)
                 transitions = self.sample_transitions(episode, num_normalizing_transitions)
 
@@ -224,8 +236,6 @@ class DDPG(object):
 
         if update_stats:
             # add transitions to normalizer
-            episode_batch['o_2'] = episode_batch['o'][:, 1:, :]
-            episode_batch['ag_2'] = episode_batch['ag'][:, 1:, :]
             num_normalizing_transitions = transitions_in_episode_batch(episode_batch)
             transitions = self.sample_transitions(episode_batch, num_normalizing_transitions)
 
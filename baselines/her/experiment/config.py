@@ -24,6 +24,7 @@ DEFAULT_PARAMS = {
     'Q_lr': 0.001,  # critic learning rate
     'pi_lr': 0.001,  # actor learning rate
     'buffer_size': int(1E6),  # for experience replay
+    'buffer_obs_dtype': 'float32',  # dtype of the observations in the replay buffer, float16 halves their memory
     'polyak': 0.95,  # polyak averaging coefficient
     'action_l2': 1.0,  # quadratic penalty on actions (before rescaling by max_u)
     'clip_obs': 200.,
@@ -105,7 +106,7 @@ def prepare_params(kwargs):
         kwargs['pi_lr'] = kwargs['lr']
         kwargs['Q_lr'] = kwargs['lr']
         del kwargs['lr']
-    for name in ['buffer_size', 'hidden', 'layers',
+    for name in ['buffer_size', 'buffer_obs_dtype', 'hidden', 'layers',
                  'network_class',
                  'polyak',
                  'batch_size', 'Q_lr', 'pi_lr',
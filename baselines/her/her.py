@@ -8,6 +8,7 @@ from mpi4py import MPI
 from baselines import logger
 from baselines.common import set_global_seeds, tf_util
 from baselines.common.mpi_moments import mpi_moments
+from baselines.common.prefetching_sampler import PrefetchingSampler
 import baselines.her.experiment.config as config
 from baselines.her.rollout import RolloutWorker
 
@@ -21,9 +22,12 @@ def mpi_average(value):
 
 def train(*, policy, rollout_worker, evaluator,
           n_epochs, n_test_rollouts, n_cycles, n_batches, policy_save_interval,
-          save_path, demo_file, **kwargs):
+          save_path, demo_file, replay_prefetch=0, **kwargs):
     rank = MPI.COMM_WORLD.Get_rank()
 
+    # sample the next batches in a background thread while the policy trains
+    sampler = PrefetchingSampler(policy.sample_batch, nprefetch=replay_prefetch) if replay_prefetch > 0 else None
+
     if save_path:
         latest_policy_path = os.path.join(save_path, 'policy_latest.pkl')
         best_policy_path = os.path.join(save_path, 'policy_best.pkl')
@@ -42,7 +46,11 @@ def train(*, policy, rollout_worker, evaluator,
             episode = rollout_worker.generate_rollouts()
             policy.store_episode(episode)
             for _ in range(n_batches):
-                policy.train()
+                if sampler is not None:
+                    policy.stage_batch(sampler.get())
+                    policy.train(stage=False)
+                else:
+                    policy.train()
             policy.update_target_net()
 
         # test
@@ -58,10 +66,15 @@ def train(*, policy, rollout_worker, evaluator,
             logger.record_tabular(key, mpi_average(val))
         for key, val in policy.logs():
             logger.record_tabular(key, mpi_average(val))
+        if sampler is not None:
+            logger.record_tabular('train/sample_wait_time', mpi_average(sampler.pop_wait_time()))
 
         if rank == 0:
             logger.dump_tabular()
 
+        if policy.buffer.memmap is not None:
+            policy.buffer.save()
+
         # save the policy if it's better than the previous ones
         success_rate = mpi_average(evaluator.current_success_rate())
         if rank == 0 and success_rate >= best_success_rate and save_path:
@@ -81,6 +94,8 @@ def train(*, policy, rollout_worker, evaluator,
         if rank != 0:
             assert local_uniform[0] != root_uniform[0]
 
+    if sampler is not None:
+        sampler.close()
     return policy
 
 
@@ -94,6 +109,9 @@ def learn(*, network, env, total_timesteps,
     override_params=None,
     load_path=None,
     save_path=None,
+    replay_memmap=False,
+    replay_memmap_cache=0,
+    replay_prefetch=0,
     **kwargs
 ):
 
@@ -137,6 +155,12 @@ def learn(*, network, env, total_timesteps,
         logger.warn('****************')
         logger.warn()
 
+    if replay_memmap:
+        # keep the replay buffer of every worker in np.memmap files
+        params['ddpg_params']['buffer_memmap_path'] = os.path.join(
+            save_path or logger.get_dir(), 'replay_buffer_{}'.format(rank))
+        params['ddpg_params']['buffer_memmap_cache'] = replay_memmap_cache
+
     dims = config.configure_dims(params)
     policy = config.configure_ddpg(dims=dims, params=params, clip_return=clip_return)
     if load_path is not None:
@@ -174,7 +198,8 @@ def learn(*, network, env, total_timesteps,
         save_path=save_path, policy=policy, rollout_worker=rollout_worker,
         evaluator=evaluator, n_epochs=n_epochs, n_test_rollouts=params['n_test_rollouts'],
         n_cycles=params['n_cycles'], n_batches=params['n_batches'],
-        policy_save_interval=policy_save_interval, demo_file=demo_file)
+        policy_save_interval=policy_save_interval, demo_file=demo_file,
+        replay_prefetch=replay_prefetch)
 
 
 @click.command()
@@ -1,5 +1,7 @@
 import numpy as np
 
+from baselines.common.memmap_storage import MemmapArray
+
 
 def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
     """Creates a sample function that can be used for HER experience replay.
@@ -16,31 +18,45 @@ def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
     else:  # 'replay_strategy' == 'none'
         future_p = 0
 
-    def _sample_her_transitions(episode_batch, batch_size_in_transitions):
-        """episode_batch is {key: array(buffer_size x T x dim_key)}
+    def _sample_her_transitions(episode_batch, batch_size_in_transitions, out=None):
+        """episode_batch is {key: array(buffer_size x T or T+1 x dim_key)}; 'o_2' and 'ag_2'
+        are gathered from 'o' and 'ag' one time step later unless given.
+
+        If out is a dict, the sampled arrays are kept in it and reused by the next call with
+        the same batch size, so that they are only valid until then.
         """
         T = episode_batch['u'].shape[1]
         rollout_batch_size = episode_batch['u'].shape[0]
         batch_size = batch_size_in_transitions
+        if out is None:
+            out = {}
 
         # Select which episodes and time steps to use.
         episode_idxs = np.random.randint(0, rollout_batch_size, batch_size)
         t_samples = np.random.randint(T, size=batch_size)
-        transitions = {key: episode_batch[key][episode_idxs, t_samples].copy()
-                       for key in episode_batch.keys()}
 
         # Select future time indexes proportional with probability future_p. These
         # will be used for HER replay by substituting in future goals.
-        her_indexes = np.where(np.random.uniform(size=batch_size) < future_p)
+        her_mask = np.random.uniform(size=batch_size) < future_p
         future_offset = np.random.uniform(size=batch_size) * (T - t_samples)
         future_offset = future_offset.astype(int)
-        future_t = (t_samples + 1 + future_offset)[her_indexes]
+        future_t = t_samples + 1 + future_offset
+
+        # Gather the transitions with flat indexes into the buffers flattened over episodes
+        # and time steps, for buffers of length T (u, g, info) and T+1 (o, ag).
+        flat_idxs = {T: episode_idxs * T + t_samples, T + 1: episode_idxs * (T + 1) + t_samples}
+        transitions = {key: _gather(value, flat_idxs[value.shape[1]], out, key)
+                       for key, value in episode_batch.items()}
+        for key in ['o', 'ag']:
+            if key + '_2' not in episode_batch:
+                transitions[key + '_2'] = _gather(episode_batch[key], flat_idxs[T + 1] + 1, out, key + '_2')
 
         # Replace goal with achieved goal but only for the previously-selected
-        # HER transitions (as defined by her_indexes). For the other transitions,
+        # HER transitions (as defined by her_mask). For the other transitions,
         # keep the original goal.
-        future_ag = episode_batch['ag'][episode_idxs[her_indexes], future_t]
-        transitions['g'][her_indexes] = future_ag
+        if future_p > 0:
+            future_ag = _gather(episode_batch['ag'], episode_idxs * (T + 1) + future_t, out, 'future_ag')
+            np.copyto(transitions['g'], future_ag, where=her_mask[:, np.newaxis])
 
         # Reconstruct info dictionary for reward  computation.
         info = {}
@@ -53,11 +69,38 @@ def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
         reward_params['info'] = info
         transitions['r'] = reward_fun(**reward_params)
 
-        transitions = {k: transitions[k].reshape(batch_size, *transitions[k].shape[1:])
-                       for k in transitions.keys()}
-
         assert(transitions['u'].shape[0] == batch_size_in_transitions)
 
         return transitions
 
     return _sample_her_transitions
+
+
+def _out_array(out, key, shape, dtype):
+    if key not in out or out[key].shape != shape or out[key].dtype != dtype:
+        out[key] = np.empty(shape, dtype)
+    return out[key]
+
+
+def _gather(values, flat_idxs, out, key):
+    """Gathers the rows flat_idxs of values flattened over its first two axes into out[key].
+    float16 values are converted to float32.
+    """
+    # np.take is called with mode='clip', which skips its bounds checks (and the buffering of out),
+    # but would silently clamp bad indexes
+    assert flat_idxs.min() >= 0 and flat_idxs.max() < values.shape[0] * values.shape[1], 'transition index out of range'
+    if isinstance(values, MemmapArray):
+        # read the rows in file order, and the recently stored episodes from memory
+        gathered = values.take(flat_idxs // values.shape[1], flat_idxs % values.shape[1])
+        dtype = np.float32 if gathered.dtype == np.float16 else gathered.dtype
+        result = _out_array(out, key, gathered.shape, dtype)
+        np.copyto(result, gathered)
+        return result
+    values = values.reshape(-1, *values.shape[2:])
+    shape = (len(flat_idxs),) + values.shape[1:]
+    if values.dtype != np.float16:
+        return np.take(values, flat_idxs, axis=0, mode='clip', out=_out_array(out, key, shape, values.dtype))
+    gathered = np.take(values, flat_idxs, axis=0, mode='clip', out=_out_array(out, key + '_float16', shape, np.float16))
+    result = _out_array(out, key, shape, np.float32)
+    np.copyto(result, gathered)
+    return result
@@ -4,7 +4,8 @@ import numpy as np
 
 
 class ReplayBuffer:
-    def __init__(self, buffer_shapes, size_in_transitions, T, sample_transitions):
+    def __init__(self, buffer_shapes, size_in_transitions, T, sample_transitions, memmap=None,
+                 buffer_dtypes=None):
         """Creates a replay buffer.
 
         Args:
@@ -12,22 +13,40 @@ class ReplayBuffer:
                 buffer
             size_in_transitions (int): the size of the buffer, measured in transitions
             T (int): the time horizon for episodes
-            sample_transitions (function): a function that samples from the replay buffer
+            sample_transitions (function): a function that samples from the replay buffer, see
+                her_sampler.make_sample_her_transitions
+            memmap (MemmapStorage): if given, the buffers are kept in np.memmap files in its
+                directory, and a buffer saved there with `save` is loaded back
+            buffer_dtypes (dict of dtypes): the dtype of each buffer, float32 if missing. Buffers
+                stored as float16 are sampled as float32.
         """
         self.buffer_shapes = buffer_shapes
         self.size = size_in_transitions // T
         self.T = T
         self.sample_transitions = sample_transitions
+        self.memmap = memmap
+        buffer_dtypes = buffer_dtypes or {}
+        self.buffer_dtypes = {key: np.dtype(buffer_dtypes.get(key, np.float32)) for key in buffer_shapes}
 
         # self.buffers is {key: array(size_in_episodes x T or T+1 x dim_key)}
-        self.buffers = {key: np.empty([self.size, *shape])
-                        for key, shape in buffer_shapes.items()}
+        if memmap is None:
+            self.buffers = {key: np.empty([self.size, *shape], self.buffer_dtypes[key])
+                            for key, shape in buffer_shapes.items()}
+        else:
+            self.buffers = {key: memmap.array(key, [self.size, *shape], self.buffer_dtypes[key])
+                            for key, shape in buffer_shapes.items()}
 
         # memory management
         self.current_size = 0
         self.n_transitions_stored = 0
+        state = memmap.load() if memmap is not None else None
+        if state is not None:
+            self.current_size = state['current_size']
+            self.n_transitions_stored = state['n_transitions_stored']
 
         self.lock = threading.Lock()
+        # arrays the batches are sampled into, reused across calls to sample
+        self._sampled = {}
 
     @property
     def full(self):
@@ -36,18 +55,21 @@ class ReplayBuffer:
 
     def sample(self, batch_size):
         """Returns a dict {key: array(batch_size x shapes[key])}
+
+        The arrays are reused by the next call, so they are only valid until then.
         """
         buffers = {}
 
         with self.lock:
             assert self.current_size > 0
             for key in self.buffers.keys():
-                buffers[key] = self.buffers[key][:self.current_size]
-
-        buffers['o_2'] = buffers['o'][:, 1:, :]
-        buffers['ag_2'] = buffers['ag'][:, 1:, :]
+                if self.memmap is None:
+                    buffers[key] = self.buffers[key][:self.current_size]
+                else:
+                    # gathered with MemmapArray.take, see her_sampler._gather
+                    buffers[key] = self.buffers[key].head(self.current_size)
 
-        transitions = self.sample_transitions(buffers, batch_size)
+        transitions = self.sample_transitions(buffers, batch_size, out=self._sampled)
 
         for key in (['r', 'o_2', 'ag_2'] + list(self.buffers.keys())):
             assert key in transitions, "key %s missing from transitions" % key
@@ -82,6 +104,12 @@ class ReplayBuffer:
         with self.lock:
             return self.n_transitions_stored
 
+    def save(self):
+        """Flushes a memory-mapped buffer to disk, so that it can be resumed from its directory."""
+        assert self.memmap is not None, 'only memory-mapped buffers can be saved'
+        with self.lock:
+            self.memmap.save(current_size=self.current_size, n_transitions_stored=self.n_transitions_stored)
+
     def clear_buffer(self):
         with self.lock:
             self.current_size = 0
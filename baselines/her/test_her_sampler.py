@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from baselines.common.memmap_storage import MemmapStorage
+from baselines.her.her_sampler import make_sample_her_transitions
+from baselines.her.replay_buffer import ReplayBuffer
+
+
+def _reward_fun(ag_2, g, info):
+    return -(np.linalg.norm(ag_2 - g, axis=-1) > 0.5).astype(np.float32)
+
+
+def _reference_sample(episode_batch, batch_size, future_p):
+    # the sampler as it was before gathering with flat indexes
+    T = episode_batch['u'].shape[1]
+    episode_batch = dict(episode_batch, o_2=episode_batch['o'][:, 1:], ag_2=episode_batch['ag'][:, 1:])
+    episode_idxs = np.random.randint(0, episode_batch['u'].shape[0], batch_size)
+    t_samples = np.random.randint(T, size=batch_size)
+    transitions = {key: value[episode_idxs, t_samples].copy() for key, value in episode_batch.items()}
+    her_indexes = np.where(np.random.uniform(size=batch_size) < future_p)
+    future_offset = (np.random.uniform(size=batch_size) * (T - t_samples)).astype(int)
+    future_t = (t_samples + 1 + future_offset)[her_indexes]
+    transitions['g'][her_indexes] = episode_batch['ag'][episode_idxs[her_indexes], future_t]
+    transitions['r'] = _reward_fun(transitions['ag_2'], transitions['g'], None)
+    return transitions
+
+
+def _episodes(n, T=5, seed=0):
+    rng = np.random.RandomState(seed)
+    return dict(o=rng.randn(n, T + 1, 3), ag=rng.randn(n, T + 1, 2), g=rng.randn(n, T, 2),
+                u=rng.randn(n, T, 2), info_is_success=rng.rand(n, T, 1) < 0.5)
+
+
+def test_sample_matches_reference():
+    sample_transitions = make_sample_her_transitions('future', 4, _reward_fun)
+    episodes = _episodes(7)
+    out = {}
+    for batch_size in (16, 16, 9):
+        np.random.seed(batch_size)
+        expected = _reference_sample(episodes, batch_size, future_p=0.8)
+        np.random.seed(batch_size)
+        actual = sample_transitions(episodes, batch_size, out=out)
+        assert sorted(expected) == sorted(actual)
+        for key in expected:
+            assert np.array_equal(expected[key], actual[key]), key
+
+
+def test_gather_out_of_range():
+    sample_transitions = make_sample_her_transitions('future', 4, _reward_fun)
+    episodes = _episodes(3)
+    # 'o_2' gathered one step past the end of the given observations
+    episodes['o'] = episodes['o'][:, :-1]
+    np.random.seed(0)
+    with pytest.raises(AssertionError):
+        sample_transitions(episodes, 64)
+
+
+def test_replay_buffer_reuses_sampled_arrays():
+    sample_transitions = make_sample_her_transitions('future', 4, _reward_fun)
+    buffer_shapes = {key: value.shape[1:] for key, value in _episodes(1).items()}
+    buffer = ReplayBuffer(buffer_shapes, 50, 5, sample_transitions,
+                          buffer_dtypes={'o': np.float16, 'info_is_success': np.bool_})
+    buffer.store_episode(_episodes(4))
+
+    first = buffer.sample(8)
+    second = buffer.sample(8)
+    for key in buffer_shapes:
+        assert first[key] is second[key]
+    assert second['o'].dtype == second['o_2'].dtype == np.float32
+    assert second['info_is_success'].dtype == np.bool_
+
+
+def test_memmap_replay_buffer_matches_in_memory(tmpdir):
+    sample_transitions = make_sample_her_transitions('future', 4, _reward_fun)
+    buffer_shapes = {key: value.shape[1:] for key, value in _episodes(1).items()}
+    buffer_dtypes = {'o': np.float16, 'info_is_success': np.bool_}
+    buffer = ReplayBuffer(buffer_shapes, 50, 5, sample_transitions, buffer_dtypes=buffer_dtypes)
+    memmap_buffer = ReplayBuffer(buffer_shapes, 50, 5, sample_transitions, buffer_dtypes=buffer_dtypes,
+                                 memmap=MemmapStorage(str(tmpdir), cache_size=3))
+    for seed in range(3):
+        buffer.store_episode(_episodes(3, seed=seed))
+        memmap_buffer.store_episode(_episodes(3, seed=seed))
+        np.random.seed(seed)
+        expected = buffer.sample(16)
+        np.random.seed(seed)
+        actual = memmap_buffer.sample(16)
+        assert sorted(expected) == sorted(actual)
+        for key in expected:
+            assert expected[key].dtype == actual[key].dtype, key
+            assert np.array_equal(expected[key], actual[key]), key
@@ -1,5 +1,6 @@
 import tensorflow as tf
 import functools
+import numpy as np
 
 from baselines.common.tf_util import get_session, save_variables, load_variables
 from baselines.common.tf_util import initialize
@@ -111,6 +112,7 @@ class Model(object):
 
         self.grads = grads
         self.var = var
+        self.neglogpac = neglogpac
         self._train_op = self.trainer.apply_gradients(grads_and_var)
         self.loss_names = ['policy_loss', 'value_loss', 'policy_entropy', 'approxkl', 'clipfrac']
         self.stats_list = [pg_loss, vf_loss, entropy, approxkl, clipfrac]
@@ -130,6 +132,14 @@ class Model(object):
         if MPI is not None:
             sync_from_root(sess, global_variables, comm=comm) #pylint: disable=E1101
 
+    def neglogp(self, obs, actions):
+        # negative log likelihood of the actions under the current policy,
+        # in batches of the size of the train model (feedforward policies only)
+        nbatch = self.train_model.X.get_shape().as_list()[0] or len(obs)
+        return np.concatenate([
+            self.sess.run(self.neglogpac, {self.train_model.X: obs[start:start + nbatch], self.A: actions[start:start + nbatch]})
+            for start in range(0, len(obs), nbatch)])
+
     def train(self, lr, cliprange, obs, returns, masks, actions, values, neglogpacs, states=None):
         # Here we calculate advantage A(s,a) = R + yV(s') - V(s)
         # Returns = R + yV(s')
@@ -10,7 +10,8 @@ try:
     from mpi4py import MPI
 except ImportError:
     MPI = None
-from baselines.ppo2.runner import Runner
+from baselines.common.runners import BackgroundRunner
+from baselines.ppo2.runner import Runner, AsyncRunner, DoubleBufferedRunner
 
 
 def constfn(val):
@@ -21,7 +22,8 @@ def constfn(val):
 def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2048, ent_coef=0.0, lr=3e-4,
             vf_coef=0.5,  max_grad_norm=0.5, gamma=0.99, lam=0.95,
             log_interval=10, nminibatches=4, noptepochs=4, cliprange=0.2,
-            save_interval=0, load_path=None, model_fn=None, update_fn=None, init_fn=None, mpi_rank_weight=1, comm=None, **network_kwargs):
+            save_interval=0, load_path=None, model_fn=None, update_fn=None, init_fn=None, mpi_rank_weight=1, comm=None,
+            ready_k=None, double_buffered=False, async_collect=False, **network_kwargs):
     '''
     Learn policy using PPO algorithm (https://arxiv.org/abs/1707.06347)
 
@@ -70,6 +72,16 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
 
     load_path: str                    path to load the model from
 
+    ready_k: int or None              if set, env must be a baselines.common.vec_env.AsyncVecEnv, and actions are computed as
+                                      soon as ready_k envs have finished their step instead of waiting for all of them
+
+    double_buffered: bool             if True, env must be a baselines.common.vec_env.AsyncVecEnv, and its two halves are stepped
+                                      in turns so that one half is stepping while the actions of the other are computed
+
+    async_collect: bool               if True, the next batch is collected in a background thread while training on the current one.
+                                      The batch is collected by the policy of up to one update ago, so its neglogpacs are
+                                      recomputed with the policy it is trained from. Recurrent policies are not supported.
+
     **network_kwargs:                 keyword arguments to the policy / network builder. See baselines.common/policies.py/build_policy and arguments to a particular type of network
                                       For instance, 'mlp' network architecture has arguments num_hidden and num_layers.
 
@@ -104,16 +116,26 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
         from baselines.ppo2.model import Model
         model_fn = Model
 
-    model = model_fn(policy=policy, ob_space=ob_space, ac_space=ac_space, nbatch_act=nenvs, nbatch_train=nbatch_train,
+    nbatch_act = nenvs // 2 if double_buffered else nenvs
+    model = model_fn(policy=policy, ob_space=ob_space, ac_space=ac_space, nbatch_act=nbatch_act, nbatch_train=nbatch_train,
                     nsteps=nsteps, ent_coef=ent_coef, vf_coef=vf_coef,
                     max_grad_norm=max_grad_norm, comm=comm, mpi_rank_weight=mpi_rank_weight)
 
     if load_path is not None:
         model.load(load_path)
     # Instantiate the runner object
-    runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+    if double_buffered:
+        runner = DoubleBufferedRunner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+    elif ready_k is not None:
+        runner = AsyncRunner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam, ready_k=ready_k)
+    else:
+        runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+    if async_collect:
+        assert model.initial_state is None, 'async_collect does not support recurrent policies'
+        collector = BackgroundRunner(runner)
     if eval_env is not None:
-        eval_runner = Runner(env = eval_env, model = model, nsteps = nsteps, gamma = gamma, lam= lam)
+        eval_runner_cls = DoubleBufferedRunner if double_buffered else Runner
+        eval_runner = eval_runner_cls(env = eval_env, model = model, nsteps = nsteps, gamma = gamma, lam= lam)
 
     epinfobuf = deque(maxlen=100)
     if eval_env is not None:
@@ -139,11 +161,17 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
         if update % log_interval == 0 and is_mpi_root: logger.info('Stepping environment...')
 
         # Get minibatch
-        obs, returns, masks, actions, values, neglogpacs, states, epinfos = runner.run() #pylint: disable=E0632
+        if async_collect:
+            obs, returns, masks, actions, values, neglogpacs, states, epinfos = collector.run(start_next=update < nupdates) #pylint: disable=E0632
+            # this batch was collected while training on the previous one, by a policy up to one update behind ours
+            neglogpacs = model.neglogp(obs, actions)
+        else:
+            obs, returns, masks, actions, values, neglogpacs, states, epinfos = runner.run() #pylint: disable=E0632
         if eval_env is not None:
             eval_obs, eval_returns, eval_masks, eval_actions, eval_values, eval_neglogpacs, eval_states, eval_epinfos = eval_runner.run() #pylint: disable=E0632
 
         if update % log_interval == 0 and is_mpi_root: logger.info('Done.')
+        tcollected = time.perf_counter()
 
         epinfobuf.extend(epinfos)
         if eval_env is not None:
@@ -197,6 +225,11 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
             logger.logkv("misc/nupdates", update)
             logger.logkv("misc/total_timesteps", update*nbatch)
             logger.logkv("fps", fps)
+            logger.logkv("misc/collect_time", collector.collect_time if async_collect else tcollected - tstart)
+            logger.logkv("misc/train_time", tnow - tcollected)
+            if async_collect:
+                # fraction of the collection that was hidden behind training
+                logger.logkv("misc/collect_overlap", collector.overlap)
             logger.logkv("misc/explained_variance", float(ev))
             logger.logkv('eprewmean', safemean([epinfo['r'] for epinfo in epinfobuf]))
             logger.logkv('eplenmean', safemean([epinfo['l'] for epinfo in epinfobuf]))
@@ -215,6 +248,8 @@ def learn(*, network, env, total_timesteps, eval_env = None, seed=None, nsteps=2
             print('Saving to', savepath)
             model.save(savepath)
 
+    if async_collect:
+        collector.close()
     return model
 # Avoid division error when calculate the mean (in our case if epinfo is empty returns np.nan, not return an error)
 def safemean(xs):
@@ -1,5 +1,7 @@
 import numpy as np
-from baselines.common.runners import AbstractEnvRunner
+from baselines.common.returns import gae
+from baselines.common.runners import AbstractEnvRunner, RolloutStorage, double_buffered_steps
+from baselines.common.vec_env.async_vec_env import AsyncVecEnv
 
 class Runner(AbstractEnvRunner):
     """
@@ -8,7 +10,7 @@ class Runner(AbstractEnvRunner):
     - Initialize the runner
 
     run():
-    - Make a mini batch
+    - Make a mini batch. The arrays returned are views of storage that the next run overwrites.
     """
     def __init__(self, *, env, model, nsteps, gamma, lam):
         super().__init__(env=env, model=model, nsteps=nsteps)
@@ -16,22 +18,18 @@ class Runner(AbstractEnvRunner):
         self.lam = lam
         # Discount rate
         self.gamma = gamma
+        self.storage = RolloutStorage(self.nenv, nsteps, dtypes={'obs': self.obs.dtype, 'rewards': np.float32,
+            'values': np.float32, 'neglogpacs': np.float32, 'dones': np.bool_})
 
     def run(self):
-        # Here, we init the lists that will contain the mb of experiences
-        mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_neglogpacs = [],[],[],[],[],[]
         mb_states = self.states
         epinfos = []
         # For n in range number of steps
-        for _ in range(self.nsteps):
+        for t in range(self.nsteps):
             # Given observations, get action value and neglopacs
             # We already have self.obs because Runner superclass run self.obs[:] = env.reset() on init
             actions, values, self.states, neglogpacs = self.model.step(self.obs, S=self.states, M=self.dones)
-            mb_obs.append(self.obs.copy())
-            mb_actions.append(actions)
-            mb_values.append(values)
-            mb_neglogpacs.append(neglogpacs)
-            mb_dones.append(self.dones)
+            self.storage.write(t, obs=self.obs, actions=actions, values=values, neglogpacs=neglogpacs, dones=self.dones)
 
             # Take actions in env and look the results
             # Infos contains a ton of useful informations
@@ -39,32 +37,104 @@ class Runner(AbstractEnvRunner):
             for info in infos:
                 maybeepinfo = info.get('episode')
                 if maybeepinfo: epinfos.append(maybeepinfo)
-            mb_rewards.append(rewards)
-        #batch of steps to batch of rollouts
-        mb_obs = np.asarray(mb_obs, dtype=self.obs.dtype)
-        mb_rewards = np.asarray(mb_rewards, dtype=np.float32)
-        mb_actions = np.asarray(mb_actions)
-        mb_values = np.asarray(mb_values, dtype=np.float32)
-        mb_neglogpacs = np.asarray(mb_neglogpacs, dtype=np.float32)
-        mb_dones = np.asarray(mb_dones, dtype=np.bool)
+            self.storage.write(t, rewards=rewards)
         last_values = self.model.value(self.obs, S=self.states, M=self.dones)
+        return self._batch(last_values, mb_states, epinfos)
 
-        # discount/bootstrap off value fn
-        mb_returns = np.zeros_like(mb_rewards)
-        mb_advs = np.zeros_like(mb_rewards)
-        lastgaelam = 0
-        for t in reversed(range(self.nsteps)):
-            if t == self.nsteps - 1:
-                nextnonterminal = 1.0 - self.dones
-                nextvalues = last_values
-            else:
-                nextnonterminal = 1.0 - mb_dones[t+1]
-                nextvalues = mb_values[t+1]
-            delta = mb_rewards[t] + self.gamma * nextvalues * nextnonterminal - mb_values[t]
-            mb_advs[t] = lastgaelam = delta + self.gamma * self.lam * nextnonterminal * lastgaelam
-        mb_returns = mb_advs + mb_values
-        return (*map(sf01, (mb_obs, mb_returns, mb_dones, mb_actions, mb_values, mb_neglogpacs)),
+    def _batch(self, last_values, mb_states, epinfos):
+        # the env-major storage flattens to a batch of rollouts without copies
+        mb_rewards, mb_values, mb_dones = (self.storage[name].T for name in ('rewards', 'values', 'dones'))
+        mb_returns = self._returns(mb_rewards, mb_values, mb_dones, last_values)
+        return (self.storage.flat('obs'), sf01(mb_returns), *map(self.storage.flat, ('dones', 'actions', 'values', 'neglogpacs')),
             mb_states, epinfos)
+
+    def _returns(self, mb_rewards, mb_values, mb_dones, last_values):
+        # discount/bootstrap off value fn
+        mb_advs = gae(mb_rewards, mb_values, mb_dones, last_values, self.dones, self.gamma, self.lam)
+        return mb_advs + mb_values
+
+
+class AsyncRunner(Runner):
+    """
+    Runner for an AsyncVecEnv that acts as soon as ready_k envs have finished their step,
+    instead of waiting for the slowest env every step. Each env still makes exactly nsteps
+    steps per run, so the mini batch has the same layout as with Runner.
+
+    The env must not be wrapped, since wrappers only see step_async / step_wait, and
+    recurrent policies are not supported.
+    """
+    def __init__(self, *, env, model, nsteps, gamma, lam, ready_k):
+        super().__init__(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+        assert isinstance(env, AsyncVecEnv), 'AsyncRunner needs an unwrapped AsyncVecEnv'
+        assert self.states is None, 'AsyncRunner does not support recurrent policies'
+        self.ready_k = ready_k
+        self.dones = np.array(self.dones)
+
+    def run(self):
+        nsteps, nenv = self.nsteps, self.nenv
+        epinfos = []
+        # step of the mini batch each env is at
+        t = np.zeros(nenv, dtype=np.int64)
+        ready = np.arange(nenv)
+        nstepping = 0
+        while True:
+            if len(ready) > 0:
+                # the act model takes a full batch, only the rows of the ready envs are used
+                actions, values, _, neglogpacs = self.model.step(self.obs, S=self.states, M=self.dones)
+                self.storage.write(t[ready], ready, obs=self.obs[ready], actions=actions[ready], values=values[ready],
+                                   neglogpacs=neglogpacs[ready], dones=self.dones[ready])
+                self.env.step_send(actions[ready], ready)
+                nstepping += len(ready)
+            if nstepping == 0:
+                break
+
+            obs, rewards, dones, infos, env_ids = self.env.step_recv(self.ready_k)
+            nstepping -= len(env_ids)
+            self.storage.write(t[env_ids], env_ids, rewards=rewards)
+            self.obs[env_ids] = obs
+            self.dones[env_ids] = dones
+            for info in infos:
+                maybeepinfo = info.get('episode')
+                if maybeepinfo: epinfos.append(maybeepinfo)
+            t[env_ids] += 1
+            ready = env_ids[t[env_ids] < nsteps]
+
+        last_values = self.model.value(self.obs, S=self.states, M=self.dones)
+        return self._batch(last_values, self.states, epinfos)
+
+
+class DoubleBufferedRunner(Runner):
+    """
+    Runner for an AsyncVecEnv that steps the two halves of the envs in turns, computing
+    the actions of one half while the other half is stepping, so that the envs are not idle
+    during inference. The mini batch has the same layout as with Runner.
+
+    The model must act on batches of env.num_envs // 2 envs, the env must not be wrapped,
+    and recurrent policies are not supported.
+    """
+    def __init__(self, *, env, model, nsteps, gamma, lam):
+        super().__init__(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+        assert isinstance(env, AsyncVecEnv), 'DoubleBufferedRunner needs an unwrapped AsyncVecEnv'
+        assert self.states is None, 'DoubleBufferedRunner does not support recurrent policies'
+        self.dones = np.array(self.dones)
+
+    def run(self):
+        nsteps, nenv = self.nsteps, self.nenv
+        epinfos = []
+        for t, env_ids, obs, dones, (actions, values, _, neglogpacs), rewards, infos in double_buffered_steps(
+                self.env, self.model, nsteps, self.obs, self.dones):
+            self.storage.write(t, env_ids, obs=obs, actions=actions, values=values, neglogpacs=neglogpacs,
+                               dones=dones, rewards=rewards)
+            for info in infos:
+                maybeepinfo = info.get('episode')
+                if maybeepinfo: epinfos.append(maybeepinfo)
+
+        half = nenv // 2
+        last_values = np.concatenate([self.model.value(self.obs[:half], S=None, M=self.dones[:half]),
+                                      self.model.value(self.obs[half:], S=None, M=self.dones[half:])])
+        return self._batch(last_values, self.states, epinfos)
+
+
 # obs, returns, masks, actions, values, neglogpacs, states = runner.run()
 def sf01(arr):
     """
@@ -0,0 +1,237 @@
+import time
+
+import gym
+import numpy as np
+
+from baselines.common.runners import BackgroundRunner
+from baselines.common.tests import mark_slow
+from baselines.common.vec_env.async_vec_env import AsyncVecEnv
+from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
+from baselines.ppo2.runner import Runner, AsyncRunner, DoubleBufferedRunner, sf01
+
+
+class JitteryEnv(gym.Env):
+    """
+    A deterministic env whose steps take a random time,
+    so that the envs of an AsyncVecEnv finish out of order.
+    """
+
+    def __init__(self, seed, step_time=2e-3):
+        self.step_time = step_time
+        self.observation_space = gym.spaces.Box(low=-10, high=10, shape=(2,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+        self._episode_len = seed + 3
+        self._start_obs = np.array([seed, -seed], dtype=np.float32)
+        self._obs = None
+        self._t = 0
+
+    def reset(self):
+        self._obs = self._start_obs.copy()
+        self._t = 0
+        return self._obs
+
+    def step(self, action):
+        time.sleep(np.random.rand() * self.step_time)
+        self._obs = self._obs * 0.9 + (action - 0.5)
+        self._t += 1
+        return self._obs, float(action), self._t >= self._episode_len, {}
+
+
+class DeterministicModel(object):
+    initial_state = None
+
+    def step(self, obs, S=None, M=None):
+        actions = (obs[:, 0] > obs[:, 1]).astype(np.int64)
+        return actions, obs.sum(axis=1), None, obs[:, 0].copy()
+
+    def value(self, obs, S=None, M=None):
+        return obs.sum(axis=1)
+
+
+class SlowModel(DeterministicModel):
+    """
+    A DeterministicModel whose inference takes 0.1ms per env.
+    """
+
+    def step(self, obs, S=None, M=None):
+        time.sleep(1e-4 * len(obs))
+        return DeterministicModel.step(self, obs, S=S, M=M)
+
+
+class AtariSizedEnv(gym.Env):
+    """
+    An env with stacked Atari frames as observations, whose steps are free.
+    """
+    observation_space = gym.spaces.Box(low=0, high=255, shape=(84, 84, 4), dtype=np.uint8)
+    action_space = gym.spaces.Discrete(4)
+
+    def __init__(self):
+        self._obs = np.zeros(self.observation_space.shape, dtype=np.uint8)
+
+    def reset(self):
+        return self._obs
+
+    def step(self, action):
+        self._obs[0, 0, 0] += 1
+        return self._obs, 0.0, False, {}
+
+
+class ZeroModel(DeterministicModel):
+    def step(self, obs, S=None, M=None):
+        zeros = np.zeros(len(obs), dtype=np.float32)
+        return zeros.astype(np.int64), zeros, None, zeros
+
+    def value(self, obs, S=None, M=None):
+        return np.zeros(len(obs), dtype=np.float32)
+
+
+def test_runner_storage():
+    """
+    Test that Runner returns views of its storage, which hold
+    the observations in the order sf01 puts them in.
+    """
+    nenv, nsteps = 4, 7
+    fns = [lambda seed=seed: JitteryEnv(seed, step_time=0) for seed in range(nenv)]
+    model = DeterministicModel()
+    runner = Runner(env=DummyVecEnv(fns), model=model, nsteps=nsteps, gamma=0.99, lam=0.95)
+    env = DummyVecEnv(fns)
+    obs = env.reset()
+    for _ in range(2):
+        mb_obs = []
+        for _ in range(nsteps):
+            mb_obs.append(obs.copy())
+            obs = env.step(model.step(obs)[0])[0]
+        actual = runner.run()[0]
+        assert np.shares_memory(actual, runner.storage['obs'])
+        assert np.array_equal(actual, sf01(np.asarray(mb_obs)))
+
+
+def test_async_runner_matches_runner():
+    _assert_runner_matches(lambda env, model: AsyncRunner(env=env, model=model, nsteps=7, gamma=0.99, lam=0.95, ready_k=1))
+
+
+def test_double_buffered_runner_matches_runner():
+    _assert_runner_matches(lambda env, model: DoubleBufferedRunner(env=env, model=model, nsteps=7, gamma=0.99, lam=0.95))
+
+
+def _assert_runner_matches(make_runner):
+    nenv, nsteps = 4, 7
+    fns = [lambda seed=seed: JitteryEnv(seed) for seed in range(nenv)]
+    model = DeterministicModel()
+    runner = Runner(env=DummyVecEnv(fns), model=model, nsteps=nsteps, gamma=0.99, lam=0.95)
+    async_env = AsyncVecEnv(fns)
+    async_runner = make_runner(async_env, model)
+    try:
+        for _ in range(3):
+            expected = runner.run()
+            actual = async_runner.run()
+            for e, a in zip(expected[:6], actual[:6]):
+                assert e.shape == a.shape
+                assert np.allclose(e, a)
+    finally:
+        async_env.close()
+
+
+def test_background_runner_matches_runner():
+    """
+    Test that BackgroundRunner returns the batches of its runner,
+    which stay valid while the next one is collected.
+    """
+    nenv, nsteps = 4, 7
+    fns = [lambda seed=seed: JitteryEnv(seed, step_time=0) for seed in range(nenv)]
+    model = DeterministicModel()
+    runner = Runner(env=DummyVecEnv(fns), model=model, nsteps=nsteps, gamma=0.99, lam=0.95)
+    collector = BackgroundRunner(Runner(env=DummyVecEnv(fns), model=model, nsteps=nsteps, gamma=0.99, lam=0.95))
+    try:
+        previous = None
+        for i in range(4):
+            expected = [np.copy(e) for e in runner.run()[:6]]
+            # every other batch, no rollout is started after it, so that nothing is writing
+            # to the storages while the previous batch is checked
+            idle = i % 2 == 1
+            actual = collector.run(start_next=not idle)
+            if idle:
+                # the previous batch was not overwritten by the rollout of this one
+                for e, a in zip(previous[0], previous[1]):
+                    assert np.array_equal(e, a)
+            for e, a in zip(expected, actual[:6]):
+                assert e.shape == a.shape
+                assert np.array_equal(e, a)
+            assert 0 <= collector.overlap <= 1
+            previous = (expected, actual[:6])
+    finally:
+        collector.close()
+
+
+@mark_slow
+def test_background_runner_throughput():
+    """
+    Print the steps per second of collecting and training in turns, and of collecting the next
+    batch in the background while training, when training takes as long as collecting.
+    """
+    nenv, nsteps, nruns = 8, 32, 5
+    fns = [lambda seed=seed: JitteryEnv(seed, step_time=4e-3) for seed in range(nenv)]
+    model = DeterministicModel()
+    # a step waits for the slowest of the envs, which takes 3.5ms on average
+    train_time = nsteps * 3.5e-3
+    for name, background in [('Runner', False), ('BackgroundRunner', True)]:
+        env = SubprocVecEnv(fns)
+        runner = Runner(env=env, model=model, nsteps=nsteps, gamma=0.99, lam=0.95)
+        collector = BackgroundRunner(runner) if background else None
+        try:
+            tstart = time.time()
+            overlaps = []
+            for i in range(nruns):
+                if background:
+                    collector.run(start_next=i < nruns - 1)
+                    overlaps.append(collector.overlap)
+                else:
+                    runner.run()
+                # the GIL is released during training, as in a session run
+                time.sleep(train_time)
+            print('{}: {:.0f} steps/s ({} envs){}'.format(name, nruns * nsteps * nenv / (time.time() - tstart), nenv,
+                  ', overlap {:.2f}'.format(np.mean(overlaps[1:])) if background else ''))
+        finally:
+            if background:
+                collector.close()
+            env.close()
+
+
+@mark_slow
+def test_double_buffered_runner_throughput():
+    nenv, nsteps, nruns = 16, 32, 5
+    # steps take 1.6ms on average, as long as inference on all envs
+    fns = [lambda seed=seed: JitteryEnv(seed, step_time=3.2e-3) for seed in range(nenv)]
+    model = SlowModel()
+    for name, env, runner_cls in [('Runner', SubprocVecEnv(fns), Runner),
+                                  ('DoubleBufferedRunner', AsyncVecEnv(fns), DoubleBufferedRunner)]:
+        try:
+            runner = runner_cls(env=env, model=model, nsteps=nsteps, gamma=0.99, lam=0.95)
+            tstart = time.time()
+            for _ in range(nruns):
+                runner.run()
+            print('{}: {:.0f} steps/s ({} envs)'.format(name, nruns * nsteps * nenv / (time.time() - tstart), nenv))
+        finally:
+            env.close()
+
+
+@mark_slow
+def test_runner_atari_sized_obs():
+    """
+    Print the time Runner takes per run on Atari-sized observations, where copying
+    the observations dominates, and the memory allocated by a run.
+    """
+    import tracemalloc
+    nenv, nsteps, nruns = 8, 128, 5
+    runner = Runner(env=DummyVecEnv([AtariSizedEnv] * nenv), model=ZeroModel(), nsteps=nsteps, gamma=0.99, lam=0.95)
+    runner.run()
+    tstart = time.time()
+    for _ in range(nruns):
+        runner.run()
+    run_time = (time.time() - tstart) / nruns
+    tracemalloc.start()
+    runner.run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('Runner: {:.1f} ms per run, {:.1f} MB allocated ({} envs, {} steps)'.format(run_time * 1e3, peak / 2 ** 20, nenv, nsteps))
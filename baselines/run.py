@@ -58,7 +58,7 @@ def train(args, extra_args):
     seed = args.seed
 
     learn = get_learn_function(args.alg)
-    alg_kwargs = get_learn_function_defaults(args.alg, env_type)
+    alg_kwargs = get_learn_function_defaults(args.alg, env_type, args.num_env)
     alg_kwargs.update(extra_args)
 
     env = build_env(args)
@@ -91,15 +91,20 @@ def build_env(args):
     seed = args.seed
 
     env_type, env_id = get_env_type(args)
+    vec_env_kwargs = dict(in_series=args.in_series, vec_env_type=args.vec_env_type)
 
     if env_type in {'atari', 'retro'}:
-        if alg == 'deepq':
+        if alg == 'deepq' and (args.num_env or 1) > 1:
+            env = make_vec_env(env_id, env_type, args.num_env, seed, wrapper_kwargs={'frame_stack': True},
+                               gamestate=args.gamestate, reward_scale=args.reward_scale, **vec_env_kwargs)
+        elif alg == 'deepq':
             env = make_env(env_id, env_type, seed=seed, wrapper_kwargs={'frame_stack': True})
         elif alg == 'trpo_mpi':
             env = make_env(env_id, env_type, seed=seed)
         else:
             frame_stack_size = 4
-            env = make_vec_env(env_id, env_type, nenv, seed, gamestate=args.gamestate, reward_scale=args.reward_scale)
+            env = make_vec_env(env_id, env_type, nenv, seed, gamestate=args.gamestate, reward_scale=args.reward_scale,
+                               **vec_env_kwargs)
             env = VecFrameStack(env, frame_stack_size)
 
     else:
@@ -110,7 +115,8 @@ def build_env(args):
         get_session(config=config)
 
         flatten_dict_observations = alg not in {'her'}
-        env = make_vec_env(env_id, env_type, args.num_env or 1, seed, reward_scale=args.reward_scale, flatten_dict_observations=flatten_dict_observations)
+        env = make_vec_env(env_id, env_type, args.num_env or 1, seed, reward_scale=args.reward_scale,
+                           flatten_dict_observations=flatten_dict_observations, **vec_env_kwargs)
 
         if env_type == 'mujoco':
             env = VecNormalize(env, use_tf=True)
@@ -167,12 +173,15 @@ def get_learn_function(alg):
     return get_alg_module(alg).learn
 
 
-def get_learn_function_defaults(alg, env_type):
+def get_learn_function_defaults(alg, env_type, num_env=None):
     try:
         alg_defaults = get_alg_module(alg, 'defaults')
         kwargs = getattr(alg_defaults, env_type)()
     except (ImportError, AttributeError):
         kwargs = {}
+    if alg == 'deepq' and (num_env or 1) > 1 and kwargs.get('replay_storage') == 'frames':
+        # build_env makes a VecEnv, whose transitions can't share frames in the replay buffer
+        kwargs['replay_storage'] = 'array'
     return kwargs
 
 
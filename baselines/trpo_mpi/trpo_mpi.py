@@ -10,6 +10,8 @@ from baselines.common.mpi_adam import MpiAdam
 from baselines.common.cg import cg
 from baselines.common.input import observation_placeholder
 from baselines.common.policies import build_policy
+from baselines.common.returns import gae
+from baselines.common.segment_generator import traj_segment_generator, flatten_segment
 from contextlib import contextmanager
 
 try:
@@ -17,73 +19,8 @@ try:
 except ImportError:
     MPI = None
 
-def traj_segment_generator(pi, env, horizon, stochastic):
-    # Initialize state variables
-    t = 0
-    ac = env.action_space.sample()
-    new = True
-    rew = 0.0
-    ob = env.reset()
-
-    cur_ep_ret = 0
-    cur_ep_len = 0
-    ep_rets = []
-    ep_lens = []
-
-    # Initialize history arrays
-    obs = np.array([ob for _ in range(horizon)])
-    rews = np.zeros(horizon, 'float32')
-    vpreds = np.zeros(horizon, 'float32')
-    news = np.zeros(horizon, 'int32')
-    acs = np.array([ac for _ in range(horizon)])
-    prevacs = acs.copy()
-
-    while True:
-        prevac = ac
-        ac, vpred, _, _ = pi.step(ob, stochastic=stochastic)
-        # Slight weirdness here because we need value function at time T
-        # before returning segment [0, T-1] so we get the correct
-        # terminal value
-        if t > 0 and t % horizon == 0:
-            yield {"ob" : obs, "rew" : rews, "vpred" : vpreds, "new" : news,
-                    "ac" : acs, "prevac" : prevacs, "nextvpred": vpred * (1 - new),
-                    "ep_rets" : ep_rets, "ep_lens" : ep_lens}
-            _, vpred, _, _ = pi.step(ob, stochastic=stochastic)
-            # Be careful!!! if you change the downstream algorithm to aggregate
-            # several of these batches, then be sure to do a deepcopy
-            ep_rets = []
-            ep_lens = []
-        i = t % horizon
-        obs[i] = ob
-        vpreds[i] = vpred
-        news[i] = new
-        acs[i] = ac
-        prevacs[i] = prevac
-
-        ob, rew, new, _ = env.step(ac)
-        rews[i] = rew
-
-        cur_ep_ret += rew
-        cur_ep_len += 1
-        if new:
-            ep_rets.append(cur_ep_ret)
-            ep_lens.append(cur_ep_len)
-            cur_ep_ret = 0
-            cur_ep_len = 0
-            ob = env.reset()
-        t += 1
-
 def add_vtarg_and_adv(seg, gamma, lam):
-    new = np.append(seg["new"], 0) # last element is only used for last vtarg, but we already zeroed it if last new = 1
-    vpred = np.append(seg["vpred"], seg["nextvpred"])
-    T = len(seg["rew"])
-    seg["adv"] = gaelam = np.empty(T, 'float32')
-    rew = seg["rew"]
-    lastgaelam = 0
-    for t in reversed(range(T)):
-        nonterminal = 1-new[t+1]
-        delta = rew[t] + gamma * vpred[t+1] * nonterminal - vpred[t]
-        gaelam[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
+    seg["adv"] = gae(seg["rew"], seg["vpred"], seg["new"], seg["nextvpred"], 0, gamma, lam).astype('float32')
     seg["tdlamret"] = seg["adv"] + seg["vpred"]
 
 def learn(*,
@@ -117,7 +54,7 @@ def learn(*,
 
     env                     environment (one of the gym environments or wrapped via baselines.common.vec_env.VecEnv-type class
 
-    timesteps_per_batch     timesteps per gradient estimation batch
+    timesteps_per_batch     timesteps per gradient estimation batch, summed over the envs of a VecEnv
 
     max_kl                  max KL divergence between old policy and new policy ( KL(pi_old || pi) )
 
@@ -267,7 +204,9 @@ def learn(*,
 
     # Prepare for rollouts
     # ----------------------------------------
-    seg_gen = traj_segment_generator(pi, env, timesteps_per_batch, stochastic=True)
+    nenvs = env.num_envs if hasattr(env, 'num_envs') else 1
+    assert timesteps_per_batch % nenvs == 0, 'timesteps_per_batch must be a multiple of the number of envs'
+    seg_gen = traj_segment_generator(lambda ob: pi.step(ob, stochastic=True)[:2], env, timesteps_per_batch // nenvs)
 
     episodes_so_far = 0
     timesteps_so_far = 0
@@ -296,6 +235,7 @@ def learn(*,
         with timed("sampling"):
             seg = seg_gen.__next__()
         add_vtarg_and_adv(seg, gamma, lam)
+        flatten_segment(seg)
 
         # ob, ac, atarg, ret, td1ret = map(np.concatenate, (obs, acs, atargs, rets, td1rets))
         ob, ac, atarg, tdlamret = seg["ob"], seg["ac"], seg["adv"], seg["tdlamret"]